@@ -1,54 +1,30 @@
-import os
 from dotenv import load_dotenv
-import requests
-from datetime import datetime, timedelta
-import time
-import json
+from datetime import datetime
 import pandas as pd
+from functools import partial
+from daterange import date_range_from_dates, default_date_range, resolve_date_range, to_klaviyo_datetime
+from event_cache import fetch_events, new_customer_orders, next_page_cursor
+from klaviyo_client import account_key, make_klaviyo_request
+from logs import get_logger
+from instrumentation import RunProfile, format_report, profiling, timed_stage
+from writers import new_run_dir, update_manifest, write_results
+from tables import aggregate_totals, product_attribution_tables, product_attribution_view
+from store import load_source_daily_revenue
 import streamlit as st
+from downloads import download_section, reset_downloads
+from display import show_dataframe, precomputed_results, show_artifact_notice, show_range_totals, show_run_profile
 
 load_dotenv()
 
-KLAVIYO_API_URL = "https://a.klaviyo.com/api"
-
-# Shared API request function
-def make_klaviyo_request(endpoint, api_key, params=None, method="GET", json_body=None):
-    """Make a request to Klaviyo API with enhanced error handling"""
-    headers = {
-        "Authorization": f"Klaviyo-API-Key {api_key}",
-        "Accept": "application/json",
-        "revision": "2025-01-15"
-    }
-    url = f"{KLAVIYO_API_URL}/{endpoint.lstrip('/')}"
-    
-    try:
-        if method == "POST":
-            response = requests.post(url, headers=headers, params=params, json=json_body)
-        else:
-            response = requests.get(url, headers=headers, params=params)
-        
-        if response.status_code == 429:
-            retry_after = int(response.headers.get("Retry-After", 60))
-            print(f"Rate limit reached. Waiting {retry_after} seconds...")
-            time.sleep(retry_after)
-            return make_klaviyo_request(endpoint, api_key, params, method, json_body)
-        
-        if response.status_code != 200:
-            print(f"Error response for {endpoint}: {response.text}")
-            return None
-            
-        return response.json()
-    
-    except requests.exceptions.RequestException as e:
-        print(f"API Request failed for {endpoint}: {str(e)}")
-        return None
+logger = get_logger("app")
 
 # Feature 1: Revenue Attribution Split
-def get_campaigns_and_flows(api_key):
-    """Fetch campaigns and flows from the last 365 days"""
+@timed_stage("fetch")
+def get_campaigns_and_flows(api_key, date_range=None):
+    """Fetch campaigns and flows updated within the date range (default: last 365 days)"""
     campaign_list = []
     flow_list = []
-    start_date = (datetime.utcnow() - timedelta(days=365)).isoformat() + "Z"
+    start_date = to_klaviyo_datetime(resolve_date_range(date_range)[0])
     
     next_page = None
     while True:
@@ -61,9 +37,8 @@ def get_campaigns_and_flows(api_key):
         if campaigns is None or 'data' not in campaigns:
             break
         campaign_list.extend(campaigns['data'])
-        if 'links' in campaigns and 'next' in campaigns['links'] and campaigns['links']['next']:
-            next_page = campaigns['links']['next'].split("?page[cursor]=")[1]
-        else:
+        next_page = next_page_cursor(campaigns)
+        if next_page is None:
             break
 
     next_page = None
@@ -77,17 +52,18 @@ def get_campaigns_and_flows(api_key):
         if flows is None or 'data' not in flows:
             break
         flow_list.extend(flows['data'])
-        if 'links' in flows and 'next' in flows['links'] and flows['links']['next']:
-            next_page = flows['links']['next'].split("?page[cursor]=")[1]
-        else:
+        next_page = next_page_cursor(flows)
+        if next_page is None:
             break
     
     return campaign_list, flow_list
 
-def get_revenue_data(api_key, metric_id):
+@timed_stage("fetch")
+def get_revenue_data(api_key, metric_id, date_range=None):
     """Fetch revenue data for campaigns and flows"""
-    start_date = (datetime.utcnow() - timedelta(days=365)).isoformat() + "Z"
-    end_date = datetime.utcnow().isoformat() + "Z"
+    start, end = resolve_date_range(date_range)
+    start_date = to_klaviyo_datetime(start)
+    end_date = to_klaviyo_datetime(end)
     json_body = {
         "data": {
             "type": "metric-aggregate",
@@ -102,64 +78,35 @@ def get_revenue_data(api_key, metric_id):
     response = make_klaviyo_request("metric-aggregates", api_key, method="POST", json_body=json_body)
     return response["data"]["attributes"]["data"] if response and "data" in response else []
 
-def split_revenue(api_key, metric_id):
+@timed_stage("aggregate")
+def split_revenue(api_key, metric_id, date_range=None):
     """Fetch events and split revenue into new vs. recurring"""
-    start_date = "2024-01-01T00:00:00Z"
-    filter_str = f'greater-or-equal(datetime,{start_date})'
-    params = {"filter": filter_str}
-    print(f"Fetching events with filter: {filter_str}")
-    
-    events = []
-    next_page = None
-    
-    while True:
-        if next_page:
-            params["page[cursor]"] = next_page
-        response = make_klaviyo_request("events", api_key, params=params)
-        if response is None or "data" not in response:
-            break
-        filtered_events = [e for e in response["data"] if e["relationships"]["metric"]["data"]["id"] == metric_id]
-        events.extend(filtered_events)
-        print(f"Fetched {len(filtered_events)} Placed Order events this page")
-        
-        if "links" in response and "next" in response["links"] and response["links"]["next"] is not None:
-            next_link = response["links"]["next"]
-            if "?page[cursor]=" in next_link:
-                next_page = next_link.split("?page[cursor]=")[1]
-            elif "page%5Bcursor%5D=" in next_link:
-                next_page = next_link.split("page%5Bcursor%5D=")[1]
-            else:
-                print(f"Unexpected next link format: {next_link}")
-                break
-        else:
-            break
-    
+    events = fetch_events(partial(make_klaviyo_request, api_key=api_key), api_key, metric_id,
+                          resolve_date_range(date_range))
+    return aggregate_revenue_split(api_key, metric_id, events)
+
+def aggregate_revenue_split(api_key, metric_id, events):
+    """Split event revenue per campaign/flow into new vs. recurring (one prior-orders lookup per profile)"""
     revenue_split = {}
+    new_orders = new_customer_orders(partial(make_klaviyo_request, api_key=api_key), metric_id, events)
     for event in events:
         campaign_id = event["attributes"]["properties"].get("$attributed_message", 
                                                           event["attributes"]["properties"].get("$attributed_flow", ""))
         revenue = event["attributes"]["properties"].get("$value", 0.0)
-        profile_id = event["relationships"]["profile"]["data"]["id"]
-        timestamp = event["attributes"]["datetime"]
-        
-        prior_filter = f'equals(metric_id,"{metric_id}"),less-than(datetime,{timestamp})'
-        prior_params = {"filter": prior_filter}
-        prior_response = make_klaviyo_request(f"profiles/{profile_id}/events", api_key, params=prior_params)
-        prior_count = len(prior_response["data"]) if prior_response and "data" in prior_response else 0
-        
         if campaign_id not in revenue_split:
             revenue_split[campaign_id] = {"new": 0.0, "recurring": 0.0}
-        if prior_count == 0:
+        if event["id"] in new_orders:
             revenue_split[campaign_id]["new"] += revenue
         else:
             revenue_split[campaign_id]["recurring"] += revenue
     
     return revenue_split
 
-def process_revenue_attribution(api_key, campaigns, flows, revenue_data, revenue_split):
+@timed_stage("write")
+def process_revenue_attribution(api_key, campaigns, flows, revenue_data, revenue_split, output_dir=None):
     """Process revenue attribution with new vs. recurring split"""
     results = []
-    revenue_dict = {item["dimensions"][0]: item["measurements"]["sum_value"][0] for item in revenue_data if item["dimensions"][0]}
+    revenue_dict = aggregate_totals(revenue_data, "sum_value")
     
     for campaign in campaigns:
         campaign_id = campaign.get('id', '')
@@ -168,7 +115,6 @@ def process_revenue_attribution(api_key, campaigns, flows, revenue_data, revenue
         total = revenue_dict.get(campaign_id, 0.0)
         split = revenue_split.get(campaign_id, {"new": 0.0, "recurring": 0.0})
         results.append({
-            "klaviyo_api_key": api_key,
             "campaign_id": campaign_id,
             "campaign_name": campaign.get('attributes', {}).get('name', 'Unknown'),
             "send_time": campaign.get('attributes', {}).get('created_at', datetime.utcnow().isoformat())[:10],
@@ -184,7 +130,6 @@ def process_revenue_attribution(api_key, campaigns, flows, revenue_data, revenue
         total = revenue_dict.get(flow_id, 0.0)
         split = revenue_split.get(flow_id, {"new": 0.0, "recurring": 0.0})
         results.append({
-            "klaviyo_api_key": api_key,
             "campaign_id": flow_id,
             "campaign_name": flow.get('attributes', {}).get('name', 'Unknown Flow'),
             "send_time": flow.get('attributes', {}).get('updated_at', datetime.utcnow().isoformat())[:10],
@@ -195,15 +140,15 @@ def process_revenue_attribution(api_key, campaigns, flows, revenue_data, revenue
     
     df = pd.DataFrame(results)
     if not df.empty:
-        df.to_json("revenue_attribution_results.json", orient="records", indent=2)
-        df.to_csv("revenue_attribution_results.csv", index=False)
+        write_results(df, "revenue_attribution_results", output_dir)
+        update_manifest(output_dir, account=account_key(api_key))
     return df
 
-def revenue_attribution_analysis(api_key):
+def revenue_attribution_analysis(api_key, date_range=None, output_dir=None):
     """Run Feature 1 analysis"""
     try:
         print("Starting revenue attribution analysis...")
-        campaigns, flows = get_campaigns_and_flows(api_key)
+        campaigns, flows = get_campaigns_and_flows(api_key, date_range)
         print(f"Found {len(campaigns)} campaigns and {len(flows)} flows")
         
         metrics = make_klaviyo_request("metrics", api_key)
@@ -212,9 +157,9 @@ def revenue_attribution_analysis(api_key):
             print("No Placed Order metric found")
             return None
         
-        revenue_data = get_revenue_data(api_key, metric_id)
-        revenue_split = split_revenue(api_key, metric_id)
-        df = process_revenue_attribution(api_key, campaigns, flows, revenue_data, revenue_split)
+        revenue_data = get_revenue_data(api_key, metric_id, date_range)
+        revenue_split = split_revenue(api_key, metric_id, date_range)
+        df = process_revenue_attribution(api_key, campaigns, flows, revenue_data, revenue_split, output_dir)
         
         print("\nRevenue Attribution Analysis complete!")
         return df
@@ -225,105 +170,73 @@ def revenue_attribution_analysis(api_key):
         return None
 
 # Feature 2: Product Purchase Attribution
-def get_product_purchases(api_key, metric_id):
+@timed_stage("aggregate")
+def get_product_purchases(api_key, metric_id, date_range=None):
     """Fetch product purchase data from Placed Order events"""
-    start_date = (datetime.utcnow() - timedelta(days=365)).isoformat() + "Z"
-    filter_str = f'greater-or-equal(datetime,{start_date})'
-    params = {"filter": filter_str}
-    print(f"Fetching events with filter: {filter_str}")
-    
-    events = []
-    next_page = None
-    
-    while True:
-        if next_page:
-            params["page[cursor]"] = next_page
-        response = make_klaviyo_request("events", api_key, params=params)
-        if response is None or "data" not in response:
-            break
-        filtered_events = [e for e in response["data"] if e["relationships"]["metric"]["data"]["id"] == metric_id]
-        events.extend(filtered_events)
-        print(f"Fetched {len(filtered_events)} Placed Order events this page")
-        
-        if "links" in response and "next" in response["links"] and response["links"]["next"] is not None:
-            next_link = response["links"]["next"]
-            if "?page[cursor]=" in next_link:
-                next_page = next_link.split("?page[cursor]=")[1]
-            elif "page%5Bcursor%5D=" in next_link:
-                next_page = next_link.split("page%5Bcursor%5D=")[1]
-            else:
-                print(f"Unexpected next link format: {next_link}")
-                break
-        else:
-            break
-    
-    product_data = {}
+    events = fetch_events(partial(make_klaviyo_request, api_key=api_key), api_key, metric_id,
+                          resolve_date_range(date_range))
+    return aggregate_product_purchases(dedupe_orders(events))
+
+@timed_stage("filter")
+def dedupe_orders(events):
+    """Keep the first event per OrderId"""
+    unique_events = []
     seen_orders = set()
-    
     for event in events:
         order_id = event["attributes"]["properties"].get("OrderId", "")
         if order_id in seen_orders:
             continue
         seen_orders.add(order_id)
-        
-        campaign_id = event["attributes"]["properties"].get("$attributed_message", 
-                                                          event["attributes"]["properties"].get("$attributed_flow", ""))
+        unique_events.append(event)
+    return unique_events
+
+def aggregate_product_purchases(events):
+    """Sum orders, units and revenue per (campaign or flow, product) across attributed orders"""
+    product_data = {}
+    # Key -> number of the last order counted for it, so an order listing a product twice counts once
+    counted = {}
+    for number, event in enumerate(events):
+        properties = event["attributes"]["properties"]
+        campaign_id = properties.get("$attributed_message", properties.get("$attributed_flow", ""))
         if not campaign_id:
             continue
         
-        items = event["attributes"]["properties"].get("Items", [])
-        for item in items:
-            product_id = item.get("ProductID", "unknown")
-            if product_id not in product_data:
-                product_data[product_id] = {
-                    "campaign_ids": set(),
+        for item in properties.get("Items", []):
+            key = (campaign_id, item.get("ProductID", "unknown"))
+            data = product_data.get(key)
+            if data is None:
+                data = product_data[key] = {
                     "product_name": item.get("ProductName", "Unknown"),
-                    "units_sold": 0,
                     "product_type": item.get("Categories", ["Unknown"])[0],
+                    "orders": 0,
+                    "units_sold": 0,
                     "revenue": 0.0
                 }
-            product_data[product_id]["campaign_ids"].add(campaign_id)
-            product_data[product_id]["units_sold"] += int(item.get("Quantity", 0))
-            product_data[product_id]["revenue"] += float(item.get("ItemPrice", 0.0)) * int(item.get("Quantity", 0))
+            quantity = int(item.get("Quantity", 0))
+            data["units_sold"] += quantity
+            data["revenue"] += float(item.get("ItemPrice", 0.0)) * quantity
+            if counted.get(key) != number:
+                counted[key] = number
+                data["orders"] += 1
     
     return product_data
 
-def process_product_attribution(api_key, campaigns, flows, product_data):
-    """Process product purchase attribution"""
-    results = []
-    campaign_dict = {c["id"]: c for c in campaigns}
-    flow_dict = {f["id"]: f for f in flows}
-    
-    for product_id, data in product_data.items():
-        for campaign_id in data["campaign_ids"]:
-            source = campaign_dict.get(campaign_id, flow_dict.get(campaign_id, {}))
-            results.append({
-                "klaviyo_api_key": api_key,
-                "campaign_id": campaign_id,
-                "campaign_name": source.get("attributes", {}).get("name", "Unknown"),
-                "send_time": source.get("attributes", {}).get("created_at", 
-                                                            source.get("attributes", {}).get("updated_at", 
-                                                                                           datetime.utcnow().isoformat()))[:10],
-                "products": [{
-                    "product_id": product_id,
-                    "product_name": data["product_name"],
-                    "units_sold": data["units_sold"],
-                    "product_type": data["product_type"],
-                    "revenue": data["revenue"]
-                }]
-            })
-    
-    df = pd.DataFrame(results)
-    if not df.empty:
-        df.to_json("product_attribution_results.json", orient="records", indent=2)
-        df.to_csv("product_attribution_results.csv", index=False)
-    return df
+@timed_stage("write")
+def process_product_attribution(api_key, campaigns, flows, product_data, output_dir=None):
+    """Write product attribution as a fact table plus campaign and product dimension tables"""
+    tables = product_attribution_tables(campaigns, flows, product_data)
+    if not tables["product_attribution_results"].empty:
+        for stem, table in tables.items():
+            write_results(table, stem, output_dir)
+        # The account is recorded once, as a fingerprint, instead of the API key on every row
+        update_manifest(output_dir, account=account_key(api_key))
+    return product_attribution_view(tables)
 
-def product_attribution_analysis(api_key):
+def product_attribution_analysis(api_key, date_range=None, output_dir=None):
     """Run Feature 2 analysis"""
     try:
         print("Starting product purchase attribution analysis...")
-        campaigns, flows = get_campaigns_and_flows(api_key)
+        campaigns, flows = get_campaigns_and_flows(api_key, date_range)
         print(f"Found {len(campaigns)} campaigns and {len(flows)} flows")
         
         metrics = make_klaviyo_request("metrics", api_key)
@@ -332,8 +245,8 @@ def product_attribution_analysis(api_key):
             print("No Placed Order metric found")
             return None
         
-        product_data = get_product_purchases(api_key, metric_id)
-        df = process_product_attribution(api_key, campaigns, flows, product_data)
+        product_data = get_product_purchases(api_key, metric_id, date_range)
+        df = process_product_attribution(api_key, campaigns, flows, product_data, output_dir)
         
         print("\nProduct Attribution Analysis complete!")
         return df
@@ -344,47 +257,17 @@ def product_attribution_analysis(api_key):
         return None
 
 # Feature 3: Klaviyo Attribution Share
-def get_revenue_share(api_key, metric_id):
+@timed_stage("aggregate")
+def get_revenue_share(api_key, metric_id, date_range=None):
     """Fetch Placed Order events and calculate daily revenue share"""
-    start_date = (datetime.utcnow() - timedelta(days=365)).isoformat() + "Z"
-    filter_str = f'greater-or-equal(datetime,{start_date})'
-    params = {"filter": filter_str}
-    print(f"Fetching events with filter: {filter_str}")
-    
-    events = []
-    next_page = None
-    
-    while True:
-        if next_page:
-            params["page[cursor]"] = next_page
-        response = make_klaviyo_request("events", api_key, params=params)
-        if response is None or "data" not in response:
-            break
-        filtered_events = [e for e in response["data"] if e["relationships"]["metric"]["data"]["id"] == metric_id]
-        events.extend(filtered_events)
-        print(f"Fetched {len(filtered_events)} Placed Order events this page")
-        
-        if "links" in response and "next" in response["links"] and response["links"]["next"] is not None:
-            next_link = response["links"]["next"]
-            if "?page[cursor]=" in next_link:
-                next_page = next_link.split("?page[cursor]=")[1]
-            elif "page%5Bcursor%5D=" in next_link:
-                next_page = next_link.split("page%5Bcursor%5D=")[1]
-            else:
-                print(f"Unexpected next link format: {next_link}")
-                break
-        else:
-            break
-    
+    events = fetch_events(partial(make_klaviyo_request, api_key=api_key), api_key, metric_id,
+                          resolve_date_range(date_range))
+    return aggregate_revenue_share(api_key, dedupe_orders(events))
+
+def aggregate_revenue_share(api_key, events):
+    """Daily total vs. Klaviyo-attributed revenue and the attributed share in percent"""
     daily_data = {}
-    seen_orders = set()
-    
     for event in events:
-        order_id = event["attributes"]["properties"].get("OrderId", "")
-        if order_id in seen_orders:
-            continue
-        seen_orders.add(order_id)
-        
         date = event["attributes"]["datetime"][:10]
         revenue = float(event["attributes"]["properties"].get("$value", 0.0))
         is_attributed = bool(event["attributes"]["properties"].get("$attributed_message") or 
@@ -402,7 +285,6 @@ def get_revenue_share(api_key, metric_id):
         attributed = data["attributed"]
         share = (attributed / total * 100) if total > 0 else 0.0
         results.append({
-            "klaviyo_api_key": api_key,
             "date": date,
             "total_shop_revenue": total,
             "klaviyo_attributed_revenue": attributed,
@@ -411,15 +293,16 @@ def get_revenue_share(api_key, metric_id):
     
     return results
 
-def process_revenue_share(api_key, results):
+@timed_stage("write")
+def process_revenue_share(api_key, results, output_dir=None):
     """Process and save revenue share data"""
     df = pd.DataFrame(results)
     if not df.empty:
-        df.to_json("revenue_share_results.json", orient="records", indent=2)
-        df.to_csv("revenue_share_results.csv", index=False)
+        write_results(df, "revenue_share_results", output_dir)
+        update_manifest(output_dir, account=account_key(api_key))
     return df
 
-def revenue_share_analysis(api_key):
+def revenue_share_analysis(api_key, date_range=None, output_dir=None):
     """Run Feature 3 analysis"""
     try:
         print("Starting revenue share analysis...")
@@ -430,8 +313,8 @@ def revenue_share_analysis(api_key):
             print("No Placed Order metric found")
             return None
         
-        share_data = get_revenue_share(api_key, metric_id)
-        df = process_revenue_share(api_key, share_data)
+        share_data = get_revenue_share(api_key, metric_id, date_range)
+        df = process_revenue_share(api_key, share_data, output_dir)
         
         print("\nRevenue Share Analysis complete!")
         return df
@@ -442,6 +325,15 @@ def revenue_share_analysis(api_key):
         return None
 
 # Streamlit Interface
+def show_result(df, file_stem, key):
+    """Render one analysis result with on-demand downloads"""
+    if df is not None and not df.empty:
+        st.success("Analysis completed!")
+        show_dataframe(df, key)
+        download_section(df, file_stem, key)
+    else:
+        st.warning("No data retrieved or analysis failed")
+
 def main():
     st.title("Klaviyo Marketing Analytics Dashboard")
     
@@ -450,89 +342,74 @@ def main():
         private_api_key = st.text_input("Private API Key (Klaviyo API Key)", type="password")
         if private_api_key:
             st.success("API Key loaded!")
+        default_start, default_end = default_date_range()
+        selected_dates = st.date_input("Date range", value=(default_start.date(), default_end.date()),
+                                       max_value=default_end.date())
         analyze_button = st.button("Run All Analyses")
 
+    # Start from the latest precomputed run so the first view needs no crawl
+    if "df_revenue" not in st.session_state:
+        manifest, frames = precomputed_results(["revenue_attribution", "product_attribution", "revenue_share"])
+        if manifest is not None:
+            st.session_state["df_revenue"] = frames["revenue_attribution"]
+            st.session_state["df_products"] = frames["product_attribution"]
+            st.session_state["df_share"] = frames["revenue_share"]
+            st.session_state["artifact_manifest"] = manifest
+            # Per-campaign daily revenue for the range totals, if the store has this account
+            st.session_state["source_daily"] = load_source_daily_revenue(manifest.get("account"))
+
     if analyze_button:
-        if not private_api_key:
+        if len(selected_dates) != 2:
+            st.error("Please pick both a start and an end date")
+        elif not private_api_key:
             st.error("Please provide a Private API Key")
         else:
             print(f"Loaded API Key: {private_api_key[:6]}...")
-            tab1, tab2, tab3 = st.tabs(["Revenue Attribution", "Product Attribution", "Revenue Share"])
-            
-            # Feature 1: Revenue Attribution
-            with tab1:
-                st.header("Revenue Attribution Split")
+            date_range = date_range_from_dates(*selected_dates)
+            # This session's own output directory and profile: other sessions in the process run concurrently
+            output_dir = new_run_dir()
+            profile = RunProfile()
+            # Results live in session state so reruns (e.g. from a download click) keep them
+            with profiling(profile):
                 with st.spinner("Running revenue attribution analysis..."):
-                    df_revenue = revenue_attribution_analysis(private_api_key)
-                    if df_revenue is not None and not df_revenue.empty:
-                        st.success("Analysis completed!")
-                        st.dataframe(df_revenue)
-                        csv = df_revenue.to_csv(index=False)
-                        st.download_button(
-                            label="Download CSV",
-                            data=csv,
-                            file_name="revenue_attribution_results.csv",
-                            mime="text/csv"
-                        )
-                        json_data = df_revenue.to_json(orient="records", indent=2)
-                        st.download_button(
-                            label="Download JSON",
-                            data=json_data,
-                            file_name="revenue_attribution_results.json",
-                            mime="application/json"
-                        )
-                    else:
-                        st.warning("No data retrieved or analysis failed")
-
-            # Feature 2: Product Attribution
-            with tab2:
-                st.header("Product Purchase Attribution")
+                    st.session_state["df_revenue"] = revenue_attribution_analysis(private_api_key, date_range,
+                                                                                  output_dir)
                 with st.spinner("Running product attribution analysis..."):
-                    df_products = product_attribution_analysis(private_api_key)
-                    if df_products is not None and not df_products.empty:
-                        st.success("Analysis completed!")
-                        st.dataframe(df_products)
-                        csv = df_products.to_csv(index=False)
-                        st.download_button(
-                            label="Download CSV",
-                            data=csv,
-                            file_name="product_attribution_results.csv",
-                            mime="text/csv"
-                        )
-                        json_data = df_products.to_json(orient="records", indent=2)
-                        st.download_button(
-                            label="Download JSON",
-                            data=json_data,
-                            file_name="product_attribution_results.json",
-                            mime="application/json"
-                        )
-                    else:
-                        st.warning("No data retrieved or analysis failed")
-
-            # Feature 3: Revenue Share
-            with tab3:
-                st.header("Klaviyo Revenue Share")
+                    st.session_state["df_products"] = product_attribution_analysis(private_api_key, date_range,
+                                                                                   output_dir)
                 with st.spinner("Running revenue share analysis..."):
-                    df_share = revenue_share_analysis(private_api_key)
-                    if df_share is not None and not df_share.empty:
-                        st.success("Analysis completed!")
-                        st.dataframe(df_share)
-                        csv = df_share.to_csv(index=False)
-                        st.download_button(
-                            label="Download CSV",
-                            data=csv,
-                            file_name="revenue_share_results.csv",
-                            mime="text/csv"
-                        )
-                        json_data = df_share.to_json(orient="records", indent=2)
-                        st.download_button(
-                            label="Download JSON",
-                            data=json_data,
-                            file_name="revenue_share_results.json",
-                            mime="application/json"
-                        )
-                    else:
-                        st.warning("No data retrieved or analysis failed")
+                    st.session_state["df_share"] = revenue_share_analysis(private_api_key, date_range, output_dir)
+            st.session_state["source_daily"] = load_source_daily_revenue(account_key(private_api_key))
+            for key in ("revenue", "products", "share"):
+                reset_downloads(key)
+            st.session_state.pop("artifact_manifest", None)
+            st.session_state["run_profile"] = profile.report()
+            print(format_report(st.session_state["run_profile"]))
+
+    if "df_revenue" in st.session_state:
+        if "artifact_manifest" in st.session_state:
+            show_artifact_notice(st.session_state["artifact_manifest"])
+        tab1, tab2, tab3 = st.tabs(["Revenue Attribution", "Product Attribution", "Revenue Share"])
+        
+        # Feature 1: Revenue Attribution
+        with tab1:
+            st.header("Revenue Attribution Split")
+            show_result(st.session_state["df_revenue"], "revenue_attribution_results", "revenue")
+
+        # Feature 2: Product Attribution
+        with tab2:
+            st.header("Product Purchase Attribution")
+            show_result(st.session_state["df_products"], "product_attribution_results", "products")
+
+        # Feature 3: Revenue Share
+        with tab3:
+            st.header("Klaviyo Revenue Share")
+            if st.session_state["df_share"] is not None and not st.session_state["df_share"].empty:
+                show_range_totals(st.session_state["df_share"], "share", st.session_state.get("source_daily"))
+            show_result(st.session_state["df_share"], "revenue_share_results", "share")
+
+    if "run_profile" in st.session_state:
+        show_run_profile(st.session_state["run_profile"])
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,93 @@
+import os
+import json
+import shutil
+from datetime import datetime
+import pyarrow.parquet as pq
+from klaviyo_client import account_key
+
+# Precomputed dashboard results live here, one sub-directory per run
+ARTIFACTS_DIR = os.getenv("KLAVIYO_ARTIFACTS_DIR", "artifacts")
+
+# Bump when the layout of the manifest or the result frames changes incompatibly
+ARTIFACT_VERSION = 3
+
+# Columns never published: artifacts are shown to visitors without a key, who get the manifest's account instead
+SECRET_COLUMNS = ("klaviyo_api_key",)
+
+LATEST_FILE = "LATEST"
+
+def write_artifacts(frames, output_dir=ARTIFACTS_DIR, api_key=None, date_range=None):
+    """Write result frames as Parquet plus a manifest into a new run directory and mark it latest"""
+    created_at = datetime.utcnow()
+    run_id = created_at.strftime("%Y%m%dT%H%M%S%fZ")
+    run_dir = os.path.join(output_dir, run_id)
+    tmp_dir = run_dir + ".tmp"
+    os.makedirs(tmp_dir)
+
+    manifest = {
+        "version": ARTIFACT_VERSION,
+        "run_id": run_id,
+        "created_at": created_at.isoformat() + "Z",
+        "account": account_key(api_key) if api_key else None,
+        "date_range": [d.isoformat() + "Z" for d in date_range] if date_range else None,
+        "features": {},
+    }
+    for name, df in frames.items():
+        if df is None:
+            continue
+        file_name = f"{name}.parquet"
+        df = df.drop(columns=[c for c in SECRET_COLUMNS if c in df.columns])
+        df.to_parquet(os.path.join(tmp_dir, file_name), index=False)
+        manifest["features"][name] = {"file": file_name, "rows": len(df), "columns": list(df.columns)}
+
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    # Publish the run directory and the LATEST pointer atomically so readers never see half a run
+    os.replace(tmp_dir, run_dir)
+    latest_tmp = os.path.join(output_dir, LATEST_FILE + ".tmp")
+    with open(latest_tmp, "w") as f:
+        f.write(run_id)
+    os.replace(latest_tmp, os.path.join(output_dir, LATEST_FILE))
+    return run_dir
+
+def latest_run_id(output_dir=ARTIFACTS_DIR):
+    """Return the id of the most recent complete run, or None"""
+    try:
+        with open(os.path.join(output_dir, LATEST_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def load_manifest(run_id, output_dir=ARTIFACTS_DIR):
+    """Read a run's manifest, or None if it is missing or from an incompatible version"""
+    try:
+        with open(os.path.join(output_dir, run_id, "manifest.json")) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    return manifest if manifest.get("version") == ARTIFACT_VERSION else None
+
+def load_artifact(run_id, name, output_dir=ARTIFACTS_DIR):
+    """Load one feature's result frame from a run, memory-mapping the Parquet file"""
+    manifest = load_manifest(run_id, output_dir)
+    if manifest is None or name not in manifest["features"]:
+        return None
+    path = os.path.join(output_dir, run_id, manifest["features"][name]["file"])
+    return pq.read_table(path, memory_map=True).to_pandas()
+
+def load_run(run_id, names, output_dir=ARTIFACTS_DIR):
+    """Return (manifest, {name: frame}) for a run, or (None, {}) if it is missing or incompatible"""
+    manifest = load_manifest(run_id, output_dir)
+    if manifest is None:
+        return None, {}
+    return manifest, {name: load_artifact(run_id, name, output_dir) for name in names}
+
+def prune_artifacts(keep, output_dir=ARTIFACTS_DIR):
+    """Delete all but the newest `keep` run directories"""
+    runs = sorted(d for d in os.listdir(output_dir)
+                  if os.path.isdir(os.path.join(output_dir, d)) and not d.endswith(".tmp"))
+    latest = latest_run_id(output_dir)
+    for run_id in runs[:-keep] if keep > 0 else []:
+        if run_id != latest:
+            shutil.rmtree(os.path.join(output_dir, run_id))
@@ -0,0 +1,171 @@
+import os
+import re
+import csv
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from dotenv import load_dotenv
+from daterange import add_date_range_args, date_range_from_args
+from precompute import FEATURES
+from trends import share_trends
+from writers import new_run_dir, write_results
+from metrics import METRICS_PORT, flush_metrics, forward_metrics, metric_labels, receive_metrics, registry, start_metrics_server
+
+load_dotenv()
+
+BATCH_OUTPUT_DIR = "batch_output"
+
+def _summarize_revenue_attribution(df):
+    return None, df["total_attributed_revenue"].sum()
+
+def _summarize_product_attribution(df):
+    return None, df["revenue"].sum()
+
+def _summarize_revenue_share(df):
+    return df["total_shop_revenue"].sum(), df["klaviyo_attributed_revenue"].sum()
+
+# Feature -> function returning (total revenue, attributed revenue) for the summary frame
+SUMMARIZERS = {
+    "revenue_attribution": _summarize_revenue_attribution,
+    "product_attribution": _summarize_product_attribution,
+    "revenue_share": _summarize_revenue_share,
+}
+
+def load_accounts(path):
+    """Read accounts from a CSV or JSON file with `name` and either `api_key` or `api_key_env` per entry"""
+    with open(path, newline="") as f:
+        if path.endswith(".json"):
+            entries = json.load(f)
+        else:
+            entries = list(csv.DictReader(f))
+
+    accounts = []
+    for entry in entries:
+        name = entry.get("name")
+        api_key = entry.get("api_key") or os.getenv(entry.get("api_key_env") or "")
+        if not name or not api_key:
+            raise ValueError(f"Account entry needs a name and an api_key or a set api_key_env: {entry.get('name')!r}")
+        accounts.append({"name": name, "api_key": api_key})
+    names = [a["name"] for a in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError("Account names must be unique; they are used as output directory names")
+    return accounts
+
+def account_dir_name(name):
+    """Filesystem-safe directory name for an account"""
+    return re.sub(r"[^\w.-]", "_", name)
+
+def write_share_trends(df, name, account_dir):
+    """Write the revenue share trends next to the results and return the anomaly count
+
+    The trends are derived from results already written, so a failure here is reported and leaves the
+    revenue_share row as it is (anomalies None).
+    """
+    try:
+        trends = share_trends(df)
+        write_results(trends, "revenue_share_trends", account_dir)
+    except Exception as e:
+        print(f"Share trends for account {name} failed: {str(e)}")
+        return None
+    return int(trends["anomaly"].sum())
+
+def run_account(account, features, date_range, output_dir):
+    """Run the selected analyses for one account into its own output directory (runs in a worker process)"""
+    account_dir = os.path.join(output_dir, account_dir_name(account["name"]))
+    os.makedirs(account_dir, exist_ok=True)
+
+    rows = []
+    for feature in features:
+        started = time.monotonic()
+        with metric_labels(account=account["name"], feature=feature):
+            df = FEATURES[feature](account["api_key"], date_range, account_dir)
+        flush_metrics()
+        total, attributed = SUMMARIZERS[feature](df) if df is not None and not df.empty else (None, None)
+        anomalies = None
+        if feature == "revenue_share" and df is not None and not df.empty:
+            anomalies = write_share_trends(df, account["name"], account_dir)
+        rows.append({
+            "account": account["name"],
+            "feature": feature,
+            "status": "failed" if df is None else ("empty" if df.empty else "ok"),
+            "rows": 0 if df is None else len(df),
+            "total_revenue": total,
+            "attributed_revenue": attributed,
+            "anomalies": anomalies,
+            "elapsed_seconds": round(time.monotonic() - started, 2),
+            "output_dir": account_dir,
+        })
+    return rows
+
+def run_batch(accounts, features=tuple(FEATURES), date_range=None, output_dir=BATCH_OUTPUT_DIR, workers=None,
+              metrics_port=None):
+    """Run every account in a process pool; returns the consolidated summary frame and this run's directory
+
+    Each batch run writes into its own <output_dir>/<run id> directory, so a run never overwrites an earlier one.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    batch_dir = new_run_dir(output_dir)
+    rows = []
+    pool_options = {}
+    if metrics_port is not None:
+        # Workers forward their metrics to this process, which serves them all on one endpoint
+        manager = multiprocessing.Manager()
+        queue = manager.Queue()
+        pool_options = {"initializer": forward_metrics, "initargs": (queue,)}
+        receiver = receive_metrics(queue)
+        start_metrics_server(metrics_port)
+    registry.inc("klaviyo_queue_depth", len(accounts), queue="accounts")
+    # One account per task: each worker process keeps its own per-account rate limiter and HTTP session
+    with ProcessPoolExecutor(max_workers=workers, **pool_options) as pool:
+        futures = {pool.submit(run_account, account, features, date_range, batch_dir): account["name"]
+                   for account in accounts}
+        for future in as_completed(futures):
+            name = futures[future]
+            registry.dec("klaviyo_queue_depth", queue="accounts")
+            try:
+                rows.extend(future.result())
+                print(f"Finished account {name} ({len(rows)} result rows so far)")
+            except Exception as e:
+                print(f"Account {name} failed: {str(e)}")
+                rows.extend({"account": name, "feature": feature, "status": "failed"} for feature in features)
+    if metrics_port is not None:
+        queue.put(None)
+        receiver.join()
+        manager.shutdown()
+
+    summary = pd.DataFrame(rows, columns=["account", "feature", "status", "rows", "total_revenue",
+                                          "attributed_revenue", "anomalies", "elapsed_seconds", "output_dir"])
+    summary = summary.sort_values(["account", "feature"], ignore_index=True)
+    summary.to_csv(os.path.join(batch_dir, "batch_summary.csv"), index=False)
+    summary.to_parquet(os.path.join(batch_dir, "batch_summary.parquet"), index=False)
+    return summary, batch_dir
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the analyses for many Klaviyo accounts in parallel")
+    parser.add_argument("accounts", help="CSV or JSON file with name and api_key/api_key_env per account")
+    add_date_range_args(parser)
+    parser.add_argument("--output-dir", default=BATCH_OUTPUT_DIR,
+                        help=f"Root output directory, one sub-directory per run and account (default: {BATCH_OUTPUT_DIR})")
+    parser.add_argument("--features", nargs="+", choices=list(FEATURES), default=list(FEATURES),
+                        help="Analyses to run (default: all)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Worker processes (default: number of CPUs)")
+    parser.add_argument("--metrics-port", type=int, nargs="?", const=METRICS_PORT,
+                        help=f"Serve live Prometheus metrics for all workers (default port: {METRICS_PORT}; off if omitted)")
+    args = parser.parse_args()
+
+    accounts = load_accounts(args.accounts)
+    print(f"Running {len(args.features)} analyses for {len(accounts)} accounts with {args.workers} workers")
+    summary, batch_dir = run_batch(accounts, args.features, date_range_from_args(args), args.output_dir, args.workers,
+                        args.metrics_port)
+
+    print("\nBatch complete! Summary saved to:")
+    print(f"- {os.path.join(batch_dir, 'batch_summary.csv')}")
+    print(f"- {os.path.join(batch_dir, 'batch_summary.parquet')}")
+    print(summary.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
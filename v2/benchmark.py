@@ -0,0 +1,293 @@
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import argparse
+import resource
+import tempfile
+import contextlib
+import subprocess
+from datetime import datetime, timedelta
+import pandas as pd
+import requests
+import klaviyo_client
+import event_cache
+from event_cache import fetch_events_from_api, filter_metric_events
+from synthetic import generate_dataset, write_fixtures
+from logs import configure_logging
+from memprofile import MEMORY_PROFILE_FILE, memory_profiler
+import app
+
+BENCH_FIXTURES_DIR = "bench_fixtures"
+BENCH_OUTPUT = "benchmark_results.json"
+BENCH_SIZES = (10000, 100000, 1000000)
+BENCH_API_KEY = "pk_benchmark"
+
+# The revenue split makes one prior-orders request per ordering profile; above this many profiles that stage is
+# skipped
+MAX_PROFILE_LOOKUPS = 20000
+
+PIPELINES = ("revenue_attribution", "product_attribution", "revenue_share")
+
+# What peak_memory_bytes holds: the traced peak above the stage's starting heap, from memory_profiler.track.
+# Recorded in every report so results measured differently are never compared.
+MEMORY_MEASURE = "peak_growth"
+
+class MockProcess:
+    """mock_server.py in a child process, so its work does not share the GIL or the traced heap"""
+
+    def __init__(self, fixtures_dir, page_size=200, latency_ms=0.0):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        self.root = f"http://127.0.0.1:{port}"
+        self.api_url = f"{self.root}/api"
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_server.py")
+        self.process = subprocess.Popen(
+            [sys.executable, script, "--fixtures", fixtures_dir, "--port", str(port),
+             "--page-size", str(page_size), "--latency-ms", str(latency_ms)],
+            stdout=subprocess.DEVNULL)
+        deadline = time.monotonic() + 300
+        while True:
+            try:
+                requests.get(f"{self.root}/__stats", timeout=1)
+                return
+            except requests.exceptions.ConnectionError:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"Mock server for {fixtures_dir} did not start")
+                time.sleep(0.2)
+
+    def reset(self):
+        requests.post(f"{self.root}/__reset")
+
+    def stats(self):
+        return requests.get(f"{self.root}/__stats").json()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+def ensure_fixtures(orders, fixtures_root=BENCH_FIXTURES_DIR, seed=42):
+    """Return the fixture directory for `orders` orders, generating it on first use"""
+    path = os.path.join(fixtures_root, f"orders_{orders}")
+    if not os.path.exists(os.path.join(path, "events.parquet")):
+        print(f"Generating fixtures for {orders:,} orders in {path}")
+        write_fixtures(generate_dataset(orders=orders, seed=seed), path)
+    return path
+
+def fixture_date_range(fixtures_dir):
+    """Date range covering every event in a fixture directory"""
+    stamps = pd.to_datetime(pd.read_parquet(os.path.join(fixtures_dir, "events.parquet"), columns=["datetime"])
+                            ["datetime"], utc=True).dt.tz_localize(None)
+    return stamps.min().floor("D").to_pydatetime(), stamps.max().to_pydatetime() + timedelta(seconds=1)
+
+def ordering_profiles(fixtures_dir):
+    """Distinct profiles with a Placed Order in a fixture directory: the revenue split's prior-orders lookups"""
+    with open(os.path.join(fixtures_dir, "metrics.json")) as f:
+        metric_id = next(m["id"] for m in json.load(f) if m["attributes"]["name"] == "Placed Order")
+    events = pd.read_parquet(os.path.join(fixtures_dir, "events.parquet"), columns=["metric_id", "profile_id"])
+    return int(events.loc[events["metric_id"] == metric_id, "profile_id"].nunique())
+
+def measure(mock, pipeline, orders, stage, fn):
+    """Run one stage quietly; returns (its result, a result record with time, memory and request counts)
+
+    Memory is only filled in while the memory profiler runs (see run_pipeline). A None result, which is how the
+    analyses report a swallowed error, marks the stage "failed".
+    """
+    mock.reset()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), \
+            memory_profiler.track(f"bench:{stage}") as memory:
+        # Timed inside the profiled block so its closing snapshot is not charged to the stage
+        started = time.perf_counter()
+        value = fn()
+        wall = time.perf_counter() - started
+    stats = mock.stats()
+    # The mock's own /__reset and /__stats calls are not part of the stage
+    api_requests = {endpoint: count for endpoint, count in stats["requests"].items() if not endpoint.startswith("__")}
+    status = "failed" if value is None else "ok"
+    print(f"{pipeline:<20} {orders:>9,} {stage:<10} {wall:9.3f}s {sum(api_requests.values()):>9,} requests"
+          + (" FAILED" if value is None else ""))
+    return value, {
+        "pipeline": pipeline,
+        "orders": orders,
+        "stage": stage,
+        "status": status,
+        "wall_seconds": round(wall, 4),
+        "peak_memory_bytes": memory.get("peak_growth_bytes"),
+        "retained_memory_bytes": memory.get("retained_bytes"),
+        "peak_rss_bytes": memory.get("peak_rss_bytes"),
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "request_count": sum(api_requests.values()),
+        "requests": api_requests,
+        "bytes_received": stats["bytes_sent"],
+    }
+
+def skipped(pipeline, orders, stage, reason):
+    print(f"{pipeline:<20} {orders:>9,} {stage:<10} skipped ({reason})")
+    return {"pipeline": pipeline, "orders": orders, "stage": stage, "status": "skipped", "reason": reason}
+
+def fetch_pages(metric_id, date_range):
+    """Page through /events the way the pipelines do, keeping each raw body for the decode stage"""
+    bodies = []
+    session = klaviyo_client.get_session(BENCH_API_KEY)
+
+    def request(endpoint, params=None):
+        response = session.get(f"{klaviyo_client.KLAVIYO_API_URL}/{endpoint}", params=params)
+        if response.status_code != 200:
+            return None
+        bodies.append(response.content)
+        return response.json()
+
+    events, _ = fetch_events_from_api(request, metric_id, *date_range)
+    return events, bodies
+
+def run_pipeline(mock, pipeline, orders, date_range, track_memory=True, max_lookups=MAX_PROFILE_LOOKUPS,
+                 profiles=0):
+    """Benchmark one pipeline end to end and stage by stage against a running mock
+
+    `profiles` is the number of ordering profiles (see ordering_profiles), which sets the revenue split's lookups.
+    Returns the result records and, when tracking memory, the pipeline's memory profile.
+    """
+    if track_memory:
+        memory_profiler.start()
+    try:
+        return _run_pipeline(mock, pipeline, orders, date_range, max_lookups, profiles), memory_profiler.stop()
+    finally:
+        memory_profiler.stop()
+
+def _run_pipeline(mock, pipeline, orders, date_range, max_lookups, profiles):
+    results = []
+    with tempfile.TemporaryDirectory() as scratch:
+        event_cache.CACHE_DIR = os.path.join(scratch, "cache")
+        # The split needs one request per ordering profile, which is the cost being measured but unbounded at scale
+        slow = pipeline == "revenue_attribution" and profiles > max_lookups
+        too_many = f"{profiles:,} profile lookups, more than {max_lookups:,}"
+        analysis = {
+            "revenue_attribution": app.revenue_attribution_analysis,
+            "product_attribution": app.product_attribution_analysis,
+            "revenue_share": app.revenue_share_analysis,
+        }[pipeline]
+        if slow:
+            results.append(skipped(pipeline, orders, "full", too_many))
+        else:
+            _, record = measure(mock, pipeline, orders, "full",
+                                lambda: analysis(BENCH_API_KEY, date_range, os.path.join(scratch, "full")))
+            results.append(record)
+
+        metrics = klaviyo_client.make_klaviyo_request("metrics", BENCH_API_KEY)
+        metric_id = next(m["id"] for m in metrics["data"] if m["attributes"]["name"] == "Placed Order")
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            campaigns, flows = app.get_campaigns_and_flows(BENCH_API_KEY, date_range)
+
+        (events, bodies), record = measure(mock, pipeline, orders, "fetch",
+                                           lambda: fetch_pages(metric_id, date_range))
+        results.append(record)
+        del events
+        pages, record = measure(mock, pipeline, orders, "decode",
+                                lambda: [json.loads(body) for body in bodies])
+        results.append(record)
+        del bodies
+        events, record = measure(mock, pipeline, orders, "filter",
+                                 lambda: [e for page in pages for e in filter_metric_events(page["data"], metric_id)])
+        results.append(record)
+        del pages
+
+        write_dir = os.path.join(scratch, "write")
+        os.makedirs(write_dir)
+        if pipeline == "revenue_attribution":
+            # split_revenue counts every event, duplicates included
+            results.append(skipped(pipeline, orders, "dedup", "not part of this pipeline"))
+            revenue_data = app.get_revenue_data(BENCH_API_KEY, metric_id, date_range)
+            if slow:
+                results.append(skipped(pipeline, orders, "aggregate", too_many))
+                revenue_split = {}
+            else:
+                revenue_split, record = measure(
+                    mock, pipeline, orders, "aggregate",
+                    lambda: app.aggregate_revenue_split(BENCH_API_KEY, metric_id, events))
+                results.append(record)
+            write = lambda: app.process_revenue_attribution(BENCH_API_KEY, campaigns, flows, revenue_data,
+                                                            revenue_split, write_dir)
+        else:
+            unique, record = measure(mock, pipeline, orders, "dedup", lambda: app.dedupe_orders(events))
+            results.append(record)
+            if pipeline == "product_attribution":
+                product_data, record = measure(mock, pipeline, orders, "aggregate",
+                                               lambda: app.aggregate_product_purchases(unique))
+                write = lambda: app.process_product_attribution(BENCH_API_KEY, campaigns, flows, product_data,
+                                                                write_dir)
+            else:
+                share, record = measure(mock, pipeline, orders, "aggregate",
+                                        lambda: app.aggregate_revenue_share(BENCH_API_KEY, unique))
+                write = lambda: app.process_revenue_share(BENCH_API_KEY, share, write_dir)
+            results.append(record)
+        _, record = measure(mock, pipeline, orders, "write", write)
+        results.append(record)
+    return results
+
+def run_benchmarks(sizes=BENCH_SIZES, pipelines=PIPELINES, fixtures_root=BENCH_FIXTURES_DIR, page_size=200,
+                   latency_ms=0.0, track_memory=True, max_lookups=MAX_PROFILE_LOOKUPS):
+    """Run every pipeline at every size; returns the report dict written as JSON"""
+    # The client budget is not under test here; the mock answers as fast as it can
+    klaviyo_client.MAX_REQUESTS_PER_SECOND = 1e6
+    klaviyo_client.BURST = 10 ** 6
+    configure_logging("WARNING")
+    results, memory = [], []
+    for orders in sizes:
+        fixtures_dir = ensure_fixtures(orders, fixtures_root)
+        date_range = fixture_date_range(fixtures_dir)
+        profiles = ordering_profiles(fixtures_dir)
+        mock = MockProcess(fixtures_dir, page_size, latency_ms)
+        klaviyo_client.KLAVIYO_API_URL = mock.api_url
+        try:
+            for pipeline in pipelines:
+                records, profile = run_pipeline(mock, pipeline, orders, date_range, track_memory, max_lookups,
+                                                profiles)
+                results.extend(records)
+                if profile is not None:
+                    memory.append({"pipeline": pipeline, "orders": orders, **profile})
+        finally:
+            mock.stop()
+    return {
+        "created_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"sizes": list(sizes), "pipelines": list(pipelines), "page_size": page_size,
+                   "latency_ms": latency_ms, "track_memory": track_memory, "max_lookups": max_lookups,
+                   "memory_measure": MEMORY_MEASURE if track_memory else None},
+        "results": results,
+        "memory_profiles": memory,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the attribution pipelines against synthetic fixtures")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(BENCH_SIZES),
+                        help="Order counts to benchmark (default: 10k, 100k, 1M)")
+    parser.add_argument("--pipelines", nargs="+", choices=PIPELINES, default=list(PIPELINES))
+    parser.add_argument("--fixtures-dir", default=BENCH_FIXTURES_DIR,
+                        help=f"Where generated fixtures are kept between runs (default: {BENCH_FIXTURES_DIR})")
+    parser.add_argument("--output", default=BENCH_OUTPUT, help=f"Results JSON (default: {BENCH_OUTPUT})")
+    parser.add_argument("--page-size", type=int, default=200, help="Events per mock page (default: 200)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latency added to every mock request")
+    parser.add_argument("--max-lookups", type=int, default=MAX_PROFILE_LOOKUPS,
+                        help="Skip the revenue split above this many ordering profiles (one lookup each)")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="Skip the memory profiler; timings are cleaner but memory is not recorded")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.sizes, args.pipelines, args.fixtures_dir, args.page_size, args.latency_ms,
+                            not args.no_memory, args.max_lookups)
+    memory = report.pop("memory_profiles")
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nBenchmark results saved to {args.output}")
+    if memory:
+        memory_output = os.path.splitext(args.output)[0] + "_" + MEMORY_PROFILE_FILE
+        with open(memory_output, "w") as f:
+            json.dump(memory, f, indent=2)
+        print(f"Memory profiles saved to {memory_output}")
+
+if __name__ == "__main__":
+    main()
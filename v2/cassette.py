@@ -0,0 +1,149 @@
+import os
+import re
+import gzip
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+
+# Set KLAVIYO_CASSETTE to a .jsonl.gz path to record or replay every Klaviyo request made by this process
+CASSETTE_PATH = os.getenv("KLAVIYO_CASSETTE")
+
+# record: call the API and append each response to a new cassette (an existing file is moved aside); replay: serve from the cassette at full speed;
+# replay-timed: serve from the cassette with each response's recorded latency
+CASSETTE_MODE = os.getenv("KLAVIYO_CASSETTE_MODE", "replay")
+CASSETTE_MODES = ("record", "replay", "replay-timed")
+
+# Only headers the client reads are kept
+RECORDED_HEADERS = ("Retry-After",)
+
+# Timestamps in filters, e.g. a window ending "now", differ between a recording and its replay
+TIMESTAMP_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:\d{2})?")
+
+def request_key(method, endpoint, params=None, json_body=None, use_track=False, ignore_timestamps=False):
+    """Fingerprint of a request: method, endpoint, sorted params and body (never the API key)"""
+    payload = json.dumps([method, "track" if use_track else endpoint.lstrip("/"),
+                          sorted((params or {}).items()), json_body], sort_keys=True, default=str)
+    if ignore_timestamps:
+        payload = TIMESTAMP_PATTERN.sub("<datetime>", payload)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class RecordedResponse:
+    """The parts of a requests.Response that make_klaviyo_request uses, rebuilt from a cassette entry"""
+
+    def __init__(self, entry):
+        self.status_code = entry["status"]
+        self.headers = entry["headers"]
+        self.text = entry["body"]
+        self.content = self.text.encode("utf-8")
+        self.elapsed_seconds = entry["elapsed"]
+
+    def json(self):
+        return json.loads(self.text)
+
+def rotate(path):
+    """Move an existing cassette aside before recording, so replay never serves an older run's responses first
+
+    Returns the new path of the old recording, or None if there was none.
+    """
+    if not os.path.exists(path):
+        return None
+    stamp = datetime.utcfromtimestamp(os.path.getmtime(path)).strftime("%Y%m%dT%H%M%S")
+    rotated, n = f"{path}.{stamp}.bak", 1
+    while os.path.exists(rotated):
+        rotated, n = f"{path}.{stamp}-{n}.bak", n + 1
+    os.replace(path, rotated)
+    return rotated
+
+class Cassette:
+    """Gzip'd JSON Lines file of request/response pairs; identical requests replay in recorded order
+
+    Requests are matched exactly first, then with every timestamp ignored, so a run over a relative window
+    ("last 365 days") still replays on a later day.
+    """
+
+    def __init__(self, path, mode="replay"):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Cassette mode must be one of {', '.join(CASSETTE_MODES)}, got {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.loose_entries = {}
+        self.played = {}
+        if mode == "record":
+            self.rotated = rotate(path)
+        else:
+            if not os.path.exists(path):
+                raise ValueError(f"Cassette not found: {path}")
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.entries.setdefault(entry["key"], []).append(entry)
+                    self.loose_entries.setdefault(entry["loose_key"], []).append(entry)
+
+    @property
+    def replaying(self):
+        return self.mode != "record"
+
+    @property
+    def timed(self):
+        return self.mode == "replay-timed"
+
+    def record(self, method, endpoint, params, json_body, use_track, response, elapsed):
+        """Append one response; each call is its own gzip member, so a crashed run keeps what it recorded"""
+        entry = {
+            "key": request_key(method, endpoint, params, json_body, use_track),
+            "loose_key": request_key(method, endpoint, params, json_body, use_track, ignore_timestamps=True),
+            "method": method,
+            "endpoint": endpoint,
+            "params": params,
+            "status": response.status_code,
+            "headers": {h: response.headers[h] for h in RECORDED_HEADERS if h in response.headers},
+            "body": response.text,
+            "elapsed": round(elapsed, 4),
+        }
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(line)
+
+    def play(self, method, endpoint, params=None, json_body=None, use_track=False):
+        """Next recorded response for this request (the last one repeats), or None if it was never recorded"""
+        key = request_key(method, endpoint, params, json_body, use_track)
+        with self.lock:
+            recorded = self.entries.get(key)
+            if not recorded:
+                key = request_key(method, endpoint, params, json_body, use_track, ignore_timestamps=True)
+                recorded = self.loose_entries.get(key)
+            if not recorded:
+                return None
+            position = self.played.get(key, 0)
+            self.played[key] = position + 1
+            response = RecordedResponse(recorded[min(position, len(recorded) - 1)])
+        if self.timed:
+            time.sleep(response.elapsed_seconds)
+        return response
+
+_cassette = None
+_configured = False
+_cassette_lock = threading.Lock()
+
+def set_cassette(path, mode="replay"):
+    """Record to or replay from `path` for every following request in this process; None turns it off"""
+    global _cassette, _configured
+    with _cassette_lock:
+        _cassette = Cassette(path, mode) if path else None
+        _configured = True
+    return _cassette
+
+def get_cassette():
+    """The active cassette, set up from KLAVIYO_CASSETTE on first use; None when not configured"""
+    global _cassette, _configured
+    with _cassette_lock:
+        if not _configured:
+            _cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE) if CASSETTE_PATH else None
+            _configured = True
+        return _cassette
@@ -0,0 +1,129 @@
+import os
+import argparse
+from functools import partial
+from dotenv import load_dotenv
+import numpy as np
+import pandas as pd
+from daterange import add_date_range_args, date_range_from_args
+from event_cache import fetch_events
+from instrumentation import PROFILE_FILE, report_run, stage, timed_stage
+from klaviyo_client import account_key, make_klaviyo_request
+from tables import acquisition_source, order_frame
+from writers import result_paths, run_dir, update_manifest, write_results
+
+load_dotenv()
+
+CUSTOMER_STEM = "customer_metrics"
+ACQUISITION_STEM = "acquisition_ltv"
+
+DAY = np.timedelta64(1, "D")
+
+def _group_medians(values, groups, count):
+    """Median of `values` per group code in 0..count-1 (NaN for groups without values), by one sort"""
+    medians = np.full(count, np.nan)
+    if len(values) == 0:
+        return medians
+    order = np.lexsort((values, groups))
+    values, groups = values[order], groups[order]
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    sizes = np.diff(np.r_[starts, len(groups)])
+    medians[groups[starts]] = (values[starts + (sizes - 1) // 2] + values[starts + sizes // 2]) / 2
+    return medians
+
+def customer_metrics(orders):
+    """One row per profile: order count, revenue, average order value, repeat intervals and acquiring source
+
+    `orders` is an order_frame. The acquiring source is the campaign or flow of the customer's first order; as with
+    the cohorts, "first" means first within the loaded orders.
+    """
+    if orders.empty:
+        return pd.DataFrame(columns=["profile_id", "first_order_at", "last_order_at", "orders", "total_revenue",
+                                     "average_order_value", "days_to_second_order", "median_days_between_orders",
+                                     "acquisition_source_id", "acquisition_source_type"])
+    codes, profiles = pd.factorize(orders["profile_id"])
+    # Group the orders by profile; the stable sort keeps each profile's orders in time order
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    times = orders["datetime"].to_numpy()[order]
+    values = orders["value"].to_numpy(float)[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    counts = np.diff(np.r_[starts, len(codes)])
+    ends = starts + counts - 1
+    totals = np.add.reduceat(values, starts)
+
+    days_to_second = np.full(len(starts), np.nan)
+    repeat = counts > 1
+    days_to_second[repeat] = (times[starts[repeat] + 1] - times[starts[repeat]]) / DAY
+    same_profile = codes[1:] == codes[:-1]
+    gaps = (times[1:] - times[:-1])[same_profile] / DAY
+
+    first = orders.iloc[order[starts]]
+    source_type = np.where(first["campaign_id"].notna(), "campaign",
+                           np.where(first["flow_id"].notna(), "flow", "unattributed"))
+    return pd.DataFrame({
+        "profile_id": profiles[codes[starts]],
+        "first_order_at": times[starts],
+        "last_order_at": times[ends],
+        "orders": counts,
+        "total_revenue": totals,
+        "average_order_value": totals / counts,
+        "days_to_second_order": days_to_second,
+        "median_days_between_orders": _group_medians(gaps, codes[1:][same_profile], len(profiles))[codes[starts]],
+        "acquisition_source_id": acquisition_source(first).to_numpy(),
+        "acquisition_source_type": source_type,
+    })
+
+def acquisition_ltv(customers):
+    """Customer lifetime value per acquiring campaign or flow, largest total first"""
+    grouped = customers.groupby(["acquisition_source_id", "acquisition_source_type"], sort=False)
+    table = grouped.agg(
+        customers=("profile_id", "size"),
+        repeat_customers=("days_to_second_order", "count"),
+        orders=("orders", "sum"),
+        total_ltv=("total_revenue", "sum"),
+        average_ltv=("total_revenue", "mean"),
+        median_days_to_second_order=("days_to_second_order", "median"),
+    ).reset_index()
+    table["repeat_rate"] = table["repeat_customers"] / table["customers"]
+    return table.sort_values("total_ltv", ascending=False, ignore_index=True)
+
+@timed_stage("aggregate")
+def get_customer_metrics(api_key, metric_id, date_range):
+    """Fetch Placed Order events (through the event cache) and compute per-customer metrics"""
+    events = fetch_events(partial(make_klaviyo_request, api_key=api_key), api_key, metric_id, date_range)
+    with stage("customers"):
+        return customer_metrics(order_frame(events))
+
+def main():
+    parser = argparse.ArgumentParser(description="Customer lifetime value and repeat intervals per acquiring source")
+    add_date_range_args(parser)
+    args = parser.parse_args()
+
+    api_key = os.getenv("KLAVIYO_API_KEY")
+    if not api_key:
+        raise ValueError("No API key found. Please create a .env file with your KLAVIYO_API_KEY")
+    metrics = make_klaviyo_request("metrics", api_key)
+    metric_id = next((m["id"] for m in (metrics or {}).get("data", []) if m["attributes"]["name"] == "Placed Order"),
+                     None)
+    if not metric_id:
+        print("No Placed Order metric found")
+        return
+
+    customers = get_customer_metrics(api_key, metric_id, date_range_from_args(args))
+    if customers.empty:
+        print("No data retrieved - no orders in the window")
+    else:
+        ltv = acquisition_ltv(customers)
+        write_results(customers, CUSTOMER_STEM)
+        write_results(ltv, ACQUISITION_STEM)
+        update_manifest(account=account_key(api_key))
+        print(f"\nCustomer analysis complete! Results saved to {run_dir()}:")
+        for stem in (CUSTOMER_STEM, ACQUISITION_STEM):
+            for path in result_paths(stem):
+                print(f"- {path}")
+        print("\nLTV by acquiring campaign/flow:")
+        print(ltv.head(20).to_string(index=False))
+    report_run(os.path.join(run_dir(), PROFILE_FILE))
+
+if __name__ == "__main__":
+    main()
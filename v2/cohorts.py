@@ -0,0 +1,110 @@
+import os
+import argparse
+from functools import partial
+from dotenv import load_dotenv
+import numpy as np
+import pandas as pd
+from daterange import add_date_range_args, date_range_from_args
+from event_cache import fetch_events
+from instrumentation import PROFILE_FILE, report_run, stage, timed_stage
+from klaviyo_client import account_key, make_klaviyo_request
+from tables import acquisition_source, order_frame
+from writers import result_paths, run_dir, update_manifest, write_results
+
+load_dotenv()
+
+COHORT_STEM = "cohort_matrix"
+
+def cohort_table(orders, by_source=False):
+    """Long cohort table: customers, retention and revenue per first-order month and months since
+
+    `orders` is an order_frame. A profile's cohort is the month of its first order in `orders`, so profiles that
+    bought before the loaded window start a cohort late; use a window that reaches back far enough. With
+    `by_source`, cohorts are also split by the campaign or flow that the first order is attributed to.
+    """
+    columns = ["source_id"] * by_source + ["cohort", "months_since_first", "customers", "retention", "revenue"]
+    if orders.empty:
+        return pd.DataFrame(columns=columns)
+    profile_codes, _ = pd.factorize(orders["profile_id"])
+    # Months since 1970-01, the ordinals of monthly pandas periods
+    months = (orders["datetime"].dt.year.to_numpy() - 1970) * 12 + orders["datetime"].dt.month.to_numpy() - 1
+    # Orders are sorted by time and factorize numbers profiles by first appearance, so profile k's first order is
+    # the k-th position where a code above all earlier ones appears
+    first = np.flatnonzero(np.r_[True, profile_codes[1:] > np.maximum.accumulate(profile_codes)[:-1]])
+    cohort_month = months[first][profile_codes]
+    since_first = months - cohort_month
+    if by_source:
+        source_codes, sources = pd.factorize(acquisition_source(orders.iloc[first]).to_numpy())
+        source_codes = source_codes[profile_codes]
+    else:
+        source_codes, sources = np.zeros(len(orders), dtype=np.int64), np.array(["all"])
+
+    # One integer per (source, cohort, months since) cell, and per (cell, profile) for distinct customers
+    span = int(months.max() - months.min()) + 1
+    cell = (source_codes * span + (cohort_month - months.min())) * span + since_first
+    cell_index, cells = pd.factorize(cell, sort=True)
+    profiles = profile_codes.max() + 1
+    pairs = np.sort(cell_index.astype(np.int64) * profiles + profile_codes)
+    active = pairs[np.r_[True, pairs[1:] != pairs[:-1]]] // profiles
+    table = pd.DataFrame({
+        "source_id": sources[cells // (span * span)],
+        "cohort": cells // span % span + months.min(),
+        "months_since_first": cells % span,
+        "customers": np.bincount(active, minlength=len(cells)),
+        "revenue": np.bincount(cell_index, weights=orders["value"].to_numpy(float), minlength=len(cells)),
+    })
+    # Cells are sorted, so each cohort's month-0 cell (its size) comes first
+    sizes = table["customers"].where(table["months_since_first"] == 0).ffill()
+    table["retention"] = table["customers"] / sizes
+    table["cohort"] = pd.PeriodIndex.from_ordinals(table["cohort"].to_numpy(), freq="M").astype(str)
+    return table[columns]
+
+def cohort_matrices(table):
+    """Pivot a cohort_table into {"customers", "retention", "revenue"} matrices
+
+    One row per cohort (and source), one column per month since the first order.
+    """
+    index = [c for c in ("source_id", "cohort") if c in table.columns]
+    return {value: table.pivot(index=index, columns="months_since_first", values=value)
+            for value in ("customers", "retention", "revenue")}
+
+@timed_stage("aggregate")
+def get_cohorts(api_key, metric_id, date_range, by_source=False):
+    """Fetch Placed Order events (through the event cache) and build the cohort table"""
+    events = fetch_events(partial(make_klaviyo_request, api_key=api_key), api_key, metric_id, date_range)
+    with stage("cohorts"):
+        return cohort_table(order_frame(events), by_source)
+
+def main():
+    parser = argparse.ArgumentParser(description="Monthly first-purchase cohort retention and revenue")
+    add_date_range_args(parser)
+    parser.add_argument("--by-source", action="store_true",
+                        help="Split cohorts by the campaign or flow of each customer's first order")
+    args = parser.parse_args()
+
+    api_key = os.getenv("KLAVIYO_API_KEY")
+    if not api_key:
+        raise ValueError("No API key found. Please create a .env file with your KLAVIYO_API_KEY")
+    metrics = make_klaviyo_request("metrics", api_key)
+    metric_id = next((m["id"] for m in (metrics or {}).get("data", []) if m["attributes"]["name"] == "Placed Order"),
+                     None)
+    if not metric_id:
+        print("No Placed Order metric found")
+        return
+
+    table = get_cohorts(api_key, metric_id, date_range_from_args(args), args.by_source)
+    if table.empty:
+        print("No data retrieved - no orders in the window")
+    else:
+        write_results(table, COHORT_STEM)
+        update_manifest(account=account_key(api_key))
+        print(f"\nCohort analysis complete! Results saved to {run_dir()}:")
+        for path in result_paths(COHORT_STEM):
+            print(f"- {path}")
+        if not args.by_source:
+            print("\nRetention:")
+            print(cohort_matrices(table)["retention"].round(3).to_string())
+    report_run(os.path.join(run_dir(), PROFILE_FILE))
+
+if __name__ == "__main__":
+    main()
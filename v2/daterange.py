@@ -0,0 +1,57 @@
+import argparse
+from datetime import datetime, timedelta, timezone, time as dt_time
+
+DEFAULT_DAYS = 365
+
+def default_date_range(days=DEFAULT_DAYS):
+    """Return (start, end) covering the last `days` days up to now, as naive UTC datetimes"""
+    end = datetime.utcnow()
+    return end - timedelta(days=days), end
+
+def resolve_date_range(date_range=None):
+    """Fill in the default 365-day window when no range was given"""
+    return date_range if date_range is not None else default_date_range()
+
+def date_range_from_dates(start_date, end_date):
+    """Turn inclusive calendar dates (e.g. from st.date_input) into a [start, end) datetime range"""
+    start = datetime.combine(start_date, dt_time.min)
+    end = min(datetime.combine(end_date, dt_time.min) + timedelta(days=1), datetime.utcnow())
+    return start, end
+
+def to_klaviyo_datetime(value):
+    """Format a naive UTC datetime the way the Klaviyo filters expect it"""
+    return value.isoformat() + "Z"
+
+def parse_event_datetime(value):
+    """Parse a Klaviyo datetime string into a naive UTC datetime"""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def add_date_range_args(parser):
+    """Add --start/--end/--days options to an argparse parser"""
+    parser.add_argument("--start", help="First day to analyse (YYYY-MM-DD, UTC)")
+    parser.add_argument("--end", help="Last day to analyse, inclusive (YYYY-MM-DD, UTC). Defaults to today")
+    parser.add_argument("--days", type=int, default=DEFAULT_DAYS,
+                        help=f"Window length when --start is not given (default: {DEFAULT_DAYS})")
+    return parser
+
+def date_range_from_args(args):
+    """Build a [start, end) range from parsed --start/--end/--days options"""
+    if args.end:
+        end = datetime.strptime(args.end, "%Y-%m-%d") + timedelta(days=1)
+    else:
+        end = datetime.utcnow()
+    if args.start:
+        start = datetime.strptime(args.start, "%Y-%m-%d")
+    else:
+        start = end - timedelta(days=args.days)
+    if start >= end:
+        raise ValueError(f"Empty date range: {start.date()} is not before {end.date()}")
+    return start, end
+
+def parse_date_range_args(description=None, argv=None):
+    """Parse the date-range options of a CLI module"""
+    parser = add_date_range_args(argparse.ArgumentParser(description=description))
+    return date_range_from_args(parser.parse_args(argv))
@@ -0,0 +1,162 @@
+import json
+import operator
+import pandas as pd
+import streamlit as st
+from artifacts import latest_run_id, load_run
+from rollup import RollupIndex
+
+PAGE_SIZES = [50, 100, 500, 1000]
+
+# Comparison prefixes accepted in the filter box for numeric columns, longest first
+NUMERIC_FILTER_OPS = [
+    (">=", operator.ge),
+    ("<=", operator.le),
+    (">", operator.gt),
+    ("<", operator.lt),
+    ("=", operator.eq),
+]
+
+def flatten_for_display(df):
+    """Return a copy of a result frame with flat, Arrow-friendly column types"""
+    flat = df.copy()
+
+    # Nested list-of-dict cells (e.g. in results from older runs) become regular columns
+    for column in list(flat.columns):
+        if flat[column].dtype == object and flat[column].map(lambda v: isinstance(v, list)).any():
+            exploded = flat.explode(column, ignore_index=True)
+            nested = pd.json_normalize([v if isinstance(v, dict) else {} for v in exploded[column]])
+            nested.columns = [c if c not in exploded.columns else f"{column}_{c}" for c in nested.columns]
+            flat = pd.concat([exploded.drop(columns=[column]), nested], axis=1)
+
+    for column in flat.columns:
+        if flat[column].dtype == object:
+            flat[column] = flat[column].astype("string[pyarrow]")
+    return flat
+
+def filter_frame(df, column, query):
+    """Filter rows by a substring (text columns) or a comparison like '>=100' (numeric columns)"""
+    query = query.strip()
+    if not query:
+        return df
+    series = df[column]
+    if pd.api.types.is_numeric_dtype(series):
+        for prefix, op in NUMERIC_FILTER_OPS:
+            if query.startswith(prefix):
+                query = query[len(prefix):]
+                break
+        else:
+            op = operator.eq
+        try:
+            value = float(query)
+        except ValueError:
+            return df.iloc[0:0]
+        return df[op(series, value)]
+    return df[series.astype("string").str.contains(query, case=False, regex=False, na=False)]
+
+def _view_index(df, key, column, query, sort_by, ascending):
+    """Row positions for the current filter/sort, cached until the controls change"""
+    cache_key = f"{key}_view"
+    signature = (id(df), column, query, sort_by, ascending)
+    cached = st.session_state.get(cache_key)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    view = filter_frame(df, column, query) if column else df
+    if sort_by:
+        view = view.sort_values(sort_by, ascending=ascending, kind="stable")
+    positions = df.index.get_indexer(view.index)
+    st.session_state[cache_key] = (signature, positions)
+    return positions
+
+@st.fragment
+def paginated_dataframe(df, key):
+    """Show a large frame page by page, sorting and filtering server-side"""
+    columns = list(df.columns)
+    filter_col, query_col, sort_col, order_col = st.columns([2, 3, 2, 1])
+    column = filter_col.selectbox("Filter column", columns, key=f"{key}_filter_column")
+    query = query_col.text_input("Filter", key=f"{key}_filter_query",
+                                 help="Substring for text columns, or e.g. >=100 for numbers")
+    sort_by = sort_col.selectbox("Sort by", [None] + columns, key=f"{key}_sort_by")
+    ascending = order_col.radio("Order", ["Asc", "Desc"], key=f"{key}_sort_order") == "Asc"
+
+    positions = _view_index(df, key, column, query, sort_by, ascending)
+    total_rows = len(positions)
+
+    size_col, page_col, info_col = st.columns([1, 1, 2])
+    page_size = size_col.selectbox("Rows per page", PAGE_SIZES, key=f"{key}_page_size")
+    page_count = max((total_rows - 1) // page_size + 1, 1)
+    if st.session_state.get(f"{key}_page", 1) > page_count:
+        st.session_state[f"{key}_page"] = page_count
+    page = page_col.number_input("Page", min_value=1, max_value=page_count, step=1, key=f"{key}_page")
+    start = (page - 1) * page_size
+    info_col.caption(f"Rows {min(start + 1, total_rows)}-{min(start + page_size, total_rows)} of {total_rows:,} "
+                     f"(filtered from {len(df):,})")
+
+    # Only the visible slice is serialized and sent to the browser
+    st.dataframe(df.iloc[positions[start:start + page_size]], use_container_width=True, hide_index=True)
+
+def show_dataframe(df, key):
+    """Flatten a result frame once per result and display it paginated"""
+    cached = st.session_state.get(f"{key}_flat")
+    if cached is None or cached[0] is not df:
+        cached = (df, flatten_for_display(df))
+        st.session_state[f"{key}_flat"] = cached
+    paginated_dataframe(cached[1], key)
+
+def rollup_index(daily, key, source_daily=None):
+    """RollupIndex over a revenue share result, built once per result"""
+    cached = st.session_state.get(f"{key}_rollup")
+    if cached is None or cached[0] is not daily or cached[1] is not source_daily:
+        cached = (daily, source_daily, RollupIndex.from_frames(daily, source_daily))
+        st.session_state[f"{key}_rollup"] = cached
+    return cached[2]
+
+@st.fragment
+def show_range_totals(daily, key, source_daily=None):
+    """Revenue, attributed revenue and share for any range picked on a slider, read from the rollup index"""
+    index = rollup_index(daily, key, source_daily)
+    if index.days < 2:
+        return
+    start, end = st.slider("Range", min_value=index.first_day, max_value=index.last_day,
+                           value=index.last(min(30, index.days)), key=f"{key}_range")
+    summary = index.summary(start, end)
+    total_col, attributed_col, share_col = st.columns(3)
+    total_col.metric("Total revenue", f"{summary['total_shop_revenue']:,.2f}")
+    attributed_col.metric("Klaviyo-attributed revenue", f"{summary['klaviyo_attributed_revenue']:,.2f}")
+    share_col.metric("Klaviyo share", f"{summary['klaviyo_revenue_share']:.1f}%")
+    if index.source_ids:
+        st.caption("Revenue per campaign and flow in this range")
+        st.dataframe(index.sources_revenue(start, end).reset_index(), use_container_width=True, hide_index=True)
+
+@st.cache_resource(show_spinner=False)
+def _cached_artifacts(run_id, names):
+    return load_run(run_id, names)
+
+def precomputed_results(names):
+    """Latest precomputed (manifest, frames), loaded once per artifact run and shared across sessions"""
+    run_id = latest_run_id()
+    if run_id is None:
+        return None, {}
+    return _cached_artifacts(run_id, tuple(names))
+
+def show_artifact_notice(manifest):
+    """Tell the user which precomputed run is on screen"""
+    window = " to ".join(d[:10] for d in manifest["date_range"]) if manifest.get("date_range") else "default window"
+    st.info(f"Showing precomputed results from {manifest['created_at'][:16].replace('T', ' ')} UTC "
+            f"({window}). Run the analysis to refresh live.")
+
+def show_run_profile(report):
+    """Requests per endpoint and time per stage for the last run, with the JSON report as a download"""
+    with st.expander(f"Run profile ({report['elapsed_seconds']:.1f}s)"):
+        endpoints = pd.DataFrame.from_dict(report["endpoints"], orient="index")
+        if not endpoints.empty:
+            st.dataframe(endpoints.drop(columns="latency_histogram"))
+        st.dataframe(pd.DataFrame.from_dict(report["stages"], orient="index"))
+        if "memory" in report:
+            memory = report["memory"]
+            st.caption(f"Memory: peak traced {memory['peak_traced_bytes'] / 2**20:.1f} MB, "
+                       f"peak RSS {memory['peak_rss_bytes'] / 2**20:.1f} MB")
+            st.dataframe(pd.DataFrame.from_dict(memory["stages"], orient="index").drop(columns="top_live_allocations"))
+            st.dataframe(pd.DataFrame(memory["top_live_allocations"]))
+        st.download_button("Download run profile (JSON)", json.dumps(report, indent=2),
+                           file_name="run_profile.json", mime="application/json")
@@ -0,0 +1,73 @@
+import gzip
+import io
+import streamlit as st
+
+# Rows serialized per chunk when streaming a frame into a compressed buffer
+CHUNK_ROWS = 50000
+
+def write_csv_gzip(df, buffer):
+    """Stream a DataFrame into a buffer as gzip-compressed CSV"""
+    with gzip.GzipFile(fileobj=buffer, mode="wb") as gz:
+        for start in range(0, max(len(df), 1), CHUNK_ROWS):
+            chunk = df.iloc[start:start + CHUNK_ROWS]
+            gz.write(chunk.to_csv(index=False, header=start == 0).encode("utf-8"))
+
+def write_ndjson_gzip(df, buffer):
+    """Stream a DataFrame into a buffer as gzip-compressed newline-delimited JSON"""
+    with gzip.GzipFile(fileobj=buffer, mode="wb") as gz:
+        for start in range(0, len(df), CHUNK_ROWS):
+            chunk = df.iloc[start:start + CHUNK_ROWS]
+            gz.write(chunk.to_json(orient="records", lines=True).encode("utf-8"))
+
+def write_parquet(df, buffer):
+    """Write a DataFrame into a buffer as Parquet"""
+    df.to_parquet(buffer, index=False)
+
+def write_csv(df, buffer):
+    """Write a DataFrame into a buffer as plain CSV"""
+    buffer.write(df.to_csv(index=False).encode("utf-8"))
+
+def write_json_pretty(df, buffer):
+    """Write a DataFrame into a buffer as pretty-printed JSON records"""
+    buffer.write(df.to_json(orient="records", indent=2).encode("utf-8"))
+
+# Label -> (file extension, MIME type, writer). Compressed and columnar formats come first.
+DOWNLOAD_FORMATS = {
+    "CSV (gzip)": (".csv.gz", "application/gzip", write_csv_gzip),
+    "NDJSON (gzip)": (".ndjson.gz", "application/gzip", write_ndjson_gzip),
+    "Parquet": (".parquet", "application/vnd.apache.parquet", write_parquet),
+    "CSV": (".csv", "text/csv", write_csv),
+    "JSON (pretty)": (".json", "application/json", write_json_pretty),
+}
+
+def build_download(df, fmt):
+    """Serialize a DataFrame in the given download format and return the bytes"""
+    _, _, writer = DOWNLOAD_FORMATS[fmt]
+    buffer = io.BytesIO()
+    writer(df, buffer)
+    return buffer.getvalue()
+
+def reset_downloads(key):
+    """Drop prepared download bytes for a result, e.g. after the analysis reran"""
+    st.session_state.pop(f"{key}_downloads", None)
+
+@st.fragment
+def download_section(df, file_stem, key):
+    """Render a format picker and build the download only when requested"""
+    fmt = st.selectbox("Download format", list(DOWNLOAD_FORMATS), key=f"{key}_download_format")
+    extension, mime, _ = DOWNLOAD_FORMATS[fmt]
+    prepared = st.session_state.setdefault(f"{key}_downloads", {})
+
+    if fmt not in prepared:
+        if st.button(f"Prepare {fmt} download", key=f"{key}_prepare_{fmt}"):
+            with st.spinner(f"Building {fmt} file..."):
+                prepared[fmt] = build_download(df, fmt)
+
+    if fmt in prepared:
+        st.download_button(
+            label=f"Download {fmt}",
+            data=prepared[fmt],
+            file_name=f"{file_stem}{extension}",
+            mime=mime,
+            key=f"{key}_download_{fmt}"
+        )
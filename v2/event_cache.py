@@ -0,0 +1,253 @@
+import os
+import gzip
+import json
+import logging
+from datetime import datetime, timedelta
+from urllib.parse import urlparse, parse_qs
+from daterange import to_klaviyo_datetime, parse_event_datetime
+from klaviyo_client import account_key
+from instrumentation import timed_stage
+from metrics import account_labels, registry
+from logs import Progress, Sampler, get_logger, log
+
+logger = get_logger("events")
+
+# Fetched events are kept per account and metric under this directory
+CACHE_DIR = os.getenv("KLAVIYO_CACHE_DIR", ".klaviyo_cache")
+
+# Events this close to "now" may still be arriving, so that tail is never marked as covered
+FRESHNESS_WINDOW = timedelta(hours=1)
+
+# Above this many segment files for one metric, contiguous segments are merged into one file
+MAX_SEGMENTS = 20
+
+def next_page_cursor(response):
+    """Extract the page[cursor] value from a response's next link, or None on the last page"""
+    next_link = response.get("links", {}).get("next")
+    if not next_link:
+        return None
+    cursor = parse_qs(urlparse(next_link).query).get("page[cursor]")
+    if not cursor:
+        log(logger, logging.WARNING, "Unexpected next link format", next_link=next_link)
+        return None
+    return cursor[0]
+
+@timed_stage("filter")
+def filter_metric_events(events, metric_id):
+    """Keep only events of one metric from a page of /events data"""
+    return [e for e in events if e["relationships"]["metric"]["data"]["id"] == metric_id]
+
+def iter_event_pages(request, metric_id, start, end, status=None, sort=None):
+    """Yield one metric's events in [start, end) a page at a time
+
+    `status["complete"]` tells afterwards whether the last page was reached. `sort` (e.g. "datetime") is passed
+    through to the API.
+    """
+    filter_str = (f'equals(metric_id,"{metric_id}"),'
+                  f'greater-or-equal(datetime,{to_klaviyo_datetime(start)}),'
+                  f'less-than(datetime,{to_klaviyo_datetime(end)})')
+    params = {"filter": filter_str}
+    if sort:
+        params["sort"] = sort
+    status = status if status is not None else {}
+    status["complete"] = False
+    log(logger, logging.INFO, "Fetching events", filter=filter_str)
+    progress = Progress(logger, "Fetching events", metric_id=metric_id)
+    sampler = Sampler(logger)
+
+    while True:
+        response = request("events", params=params)
+        if response is None or "data" not in response:
+            progress.done("Failed to fetch events", logging.WARNING)
+            return
+        filtered_events = filter_metric_events(response["data"], metric_id)
+        registry.inc("klaviyo_pages_total")
+        registry.inc("klaviyo_events_total", len(filtered_events))
+        progress.update(pages=1, events=len(filtered_events))
+        sampler.debug("Fetched events page", lambda: filtered_events[:1], events=len(filtered_events))
+        yield filtered_events
+
+        cursor = next_page_cursor(response)
+        if cursor is None:
+            status["complete"] = True
+            progress.done("Fetched events")
+            return
+        params["page[cursor]"] = cursor
+
+def fetch_events_from_api(request, metric_id, start, end):
+    """Page through /events for one metric in [start, end); returns (events, complete)"""
+    status = {}
+    events = []
+    for page in iter_event_pages(request, metric_id, start, end, status):
+        events.extend(page)
+    return events, status["complete"]
+
+def _cache_path(api_key, metric_id):
+    return os.path.join(CACHE_DIR, account_key(api_key), metric_id)
+
+def _load_index(path):
+    index_file = os.path.join(path, "index.json")
+    if not os.path.exists(index_file):
+        return []
+    with open(index_file) as f:
+        return [
+            {"start": datetime.fromisoformat(s["start"]), "end": datetime.fromisoformat(s["end"]), "file": s["file"]}
+            for s in json.load(f)
+        ]
+
+def _save_index(path, segments):
+    tmp_file = os.path.join(path, "index.json.tmp")
+    with open(tmp_file, "w") as f:
+        json.dump([{"start": s["start"].isoformat(), "end": s["end"].isoformat(), "file": s["file"]}
+                   for s in segments], f, indent=2)
+    os.replace(tmp_file, os.path.join(path, "index.json"))
+
+def _read_segment(path, segment):
+    with gzip.open(os.path.join(path, segment["file"]), "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+def _write_segment(path, start, end, events):
+    file_name = f"events_{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}.json.gz"
+    with gzip.open(os.path.join(path, file_name), "wt", encoding="utf-8") as f:
+        json.dump(events, f)
+    return {"start": start, "end": end, "file": file_name}
+
+def missing_ranges(segments, start, end):
+    """Return the parts of [start, end) not covered by any cached segment"""
+    gaps = []
+    cursor = start
+    for segment in sorted(segments, key=lambda s: s["start"]):
+        if segment["end"] <= cursor or segment["start"] >= end:
+            continue
+        if segment["start"] > cursor:
+            gaps.append((cursor, segment["start"]))
+        cursor = max(cursor, segment["end"])
+        if cursor >= end:
+            break
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+def cache_gaps(api_key, metric_id, date_range):
+    """Ranges of [start, end) that a cached fetch would still download"""
+    return missing_ranges(_load_index(_cache_path(api_key, metric_id)), *date_range)
+
+def _in_range(event, start, end):
+    return start <= parse_event_datetime(event["attributes"]["datetime"]) < end
+
+def _compact(path, segments):
+    """Merge runs of touching segments into single files once there are too many"""
+    if len(segments) <= MAX_SEGMENTS:
+        return segments
+    merged = []
+    for segment in sorted(segments, key=lambda s: s["start"]):
+        if merged and merged[-1][-1]["end"] >= segment["start"]:
+            merged[-1].append(segment)
+        else:
+            merged.append([segment])
+
+    compacted = []
+    for run in merged:
+        if len(run) == 1:
+            compacted.append(run[0])
+            continue
+        events = {}
+        for segment in run:
+            for event in _read_segment(path, segment):
+                events[event["id"]] = event
+        start, end = run[0]["start"], max(s["end"] for s in run)
+        compacted.append(_write_segment(path, start, end, list(events.values())))
+        for segment in run:
+            if segment["file"] != compacted[-1]["file"]:
+                os.remove(os.path.join(path, segment["file"]))
+    return compacted
+
+@timed_stage("fetch")
+def fetch_events(request, api_key, metric_id, date_range, use_cache=True):
+    """Return events for a metric in [start, end), downloading only what the cache does not cover"""
+    with account_labels(account_key(api_key)):
+        return _fetch_events(request, api_key, metric_id, date_range, use_cache)
+
+def _fetch_events(request, api_key, metric_id, date_range, use_cache):
+    start, end = date_range
+    if not use_cache:
+        return fetch_events_from_api(request, metric_id, start, end)[0]
+
+    path = _cache_path(api_key, metric_id)
+    os.makedirs(path, exist_ok=True)
+    segments = _load_index(path)
+    gaps = missing_ranges(segments, start, end)
+    if gaps:
+        log(logger, logging.INFO, "Fetching ranges missing from the event cache", segments=len(segments), gaps=len(gaps))
+    else:
+        log(logger, logging.INFO, "Serving events entirely from cache", segments=len(segments))
+
+    fresh_events = []
+    cutoff = datetime.utcnow() - FRESHNESS_WINDOW
+    for gap_start, gap_end in gaps:
+        events, complete = fetch_events_from_api(request, metric_id, gap_start, gap_end)
+        fresh_events.extend(events)
+        covered_end = min(gap_end, cutoff)
+        # A range is only cached once every page of it came back
+        if not complete:
+            log(logger, logging.WARNING, "Range not cached: a page failed, the next run fetches it again",
+                start=gap_start.isoformat(), end=gap_end.isoformat(), events=len(events))
+        elif covered_end > gap_start:
+            stable = [e for e in events if _in_range(e, gap_start, covered_end)]
+            segments.append(_write_segment(path, gap_start, covered_end, stable))
+    if gaps:
+        segments = _compact(path, segments)
+        _save_index(path, segments)
+
+    by_id = {}
+    for segment in segments:
+        if segment["end"] <= start or segment["start"] >= end:
+            continue
+        for event in _read_segment(path, segment):
+            if _in_range(event, start, end):
+                by_id[event["id"]] = event
+    fresh_ids = set()
+    for event in fresh_events:
+        by_id.setdefault(event["id"], event)
+        fresh_ids.add(event["id"])
+    # Fresh ranges were just written to segments too, so hits are the events this call did not download
+    hits = sum(1 for event_id in by_id if event_id not in fresh_ids)
+    registry.inc("klaviyo_cache_events_total", hits, result="hit")
+    registry.inc("klaviyo_cache_events_total", len(by_id) - hits, result="miss")
+    return sorted(by_id.values(), key=lambda e: e["attributes"]["datetime"])
+
+def has_prior_order(request, metric_id, profile_id, timestamp):
+    """Whether a profile has a Placed Order event before `timestamp` (raw event datetime); a failed lookup says no"""
+    prior_filter = f'equals(metric_id,"{metric_id}"),less-than(datetime,{timestamp})'
+    response = request(f"profiles/{profile_id}/events", params={"filter": prior_filter})
+    return bool(response and response.get("data"))
+
+def new_customer_orders(request, metric_id, events):
+    """Ids of the events that are a profile's first order ever, with one prior-orders lookup per profile
+
+    An order is new when it is at its profile's earliest loaded datetime and the profile has no order before then;
+    several orders at that datetime are all new. Every later order has that earlier one before it, so each profile
+    is looked up once, at its earliest datetime, and the result is the same as asking before every order.
+    export_orders.CustomerStatus applies the same rule to a stream.
+    """
+    first_seen = {}
+    for event in events:
+        profile_id = event["relationships"]["profile"]["data"]["id"]
+        timestamp = parse_event_datetime(event["attributes"]["datetime"])
+        if profile_id not in first_seen or timestamp < first_seen[profile_id][0]:
+            first_seen[profile_id] = (timestamp, event["attributes"]["datetime"])
+
+    progress = Progress(logger, "Checking prior orders", events=len(events), profiles=len(first_seen))
+    sampler = Sampler(logger)
+    first_order_profiles = set()
+    for profile_id, (_, raw_timestamp) in first_seen.items():
+        sampler.debug("Checking prior events", profile_id=profile_id, before=raw_timestamp)
+        if not has_prior_order(request, metric_id, profile_id, raw_timestamp):
+            first_order_profiles.add(profile_id)
+        progress.update(lookups=1)
+    progress.done()
+
+    return {event["id"] for event in events
+            if event["relationships"]["profile"]["data"]["id"] in first_order_profiles
+            and parse_event_datetime(event["attributes"]["datetime"])
+            == first_seen[event["relationships"]["profile"]["data"]["id"]][0]}
@@ -0,0 +1,189 @@
+import os
+import argparse
+import logging
+from collections import OrderedDict, deque
+from dotenv import load_dotenv
+import klaviyo_client
+from daterange import add_date_range_args, date_range_from_args, parse_event_datetime
+from event_cache import has_prior_order, iter_event_pages
+from instrumentation import PROFILE_FILE, report_run, stage
+from logs import Progress, get_logger, log
+from tables import order_fact, order_fact_frame
+from writers import CHUNK_ROWS, OUTPUT_FORMATS, open_writer, run_dir, update_manifest
+
+load_dotenv()
+
+logger = get_logger("export")
+
+ORDER_FACTS_STEM = "order_facts"
+
+# Each output file holds at most this many orders; larger exports are split into numbered parts
+ROWS_PER_FILE = int(os.getenv("KLAVIYO_EXPORT_ROWS_PER_FILE", "1000000"))
+
+# Order ids remembered for deduplication; duplicates of an order arrive close together in time
+DEDUPE_WINDOW = 100000
+
+# Profiles whose first order is remembered; a forgotten profile costs another lookup, not a different status
+PROFILE_WINDOW = 100000
+
+class CustomerStatus:
+    """Classify orders as "new" or "recurring" while they stream by in time order
+
+    The rule is the revenue split's (event_cache.new_customer_orders): an order is "new" when it is at its profile's
+    first datetime in the window and the profile has no earlier Placed Order event, looked up once per profile.
+    Each profile's first datetime and status are remembered for its later orders, for the PROFILE_WINDOW most
+    recently seen profiles; a forgotten profile is looked up again at its next order, which has the first one
+    before it, so the status is the same. With lookups off, orders at a profile's first datetime in the window
+    count as "new", and every profile is remembered.
+    """
+
+    def __init__(self, request, metric_id, lookups=True):
+        self.request = request
+        self.metric_id = metric_id
+        self.lookups = lookups
+        # profile id -> (first order datetime, status of the orders at that datetime)
+        self.first_orders = OrderedDict()
+
+    def __call__(self, event):
+        profile_id = event["relationships"]["profile"]["data"]["id"]
+        timestamp = parse_event_datetime(event["attributes"]["datetime"])
+        first = self.first_orders.get(profile_id)
+        if first is None:
+            prior = self.lookups and has_prior_order(self.request, self.metric_id, profile_id,
+                                                     event["attributes"]["datetime"])
+            first = self.first_orders[profile_id] = (timestamp, "recurring" if prior else "new")
+            if self.lookups and len(self.first_orders) > PROFILE_WINDOW:
+                self.first_orders.popitem(last=False)
+        else:
+            self.first_orders.move_to_end(profile_id)
+        return first[1] if timestamp == first[0] else "recurring"
+
+def iter_order_facts(request, metric_id, date_range, lookups=True):
+    """Yield one order fact row per deduplicated Placed Order event, oldest first, a page at a time"""
+    classify = CustomerStatus(request, metric_id, lookups)
+    recent_ids, recent = set(), deque()
+    status = {}
+    for page in iter_event_pages(request, metric_id, *date_range, status=status, sort="datetime"):
+        for event in page:
+            order_id = event["attributes"]["properties"].get("OrderId", "")
+            if order_id in recent_ids:
+                continue
+            recent_ids.add(order_id)
+            recent.append(order_id)
+            if len(recent) > DEDUPE_WINDOW:
+                recent_ids.discard(recent.popleft())
+            yield order_fact(event, classify(event))
+    if not status.get("complete"):
+        raise RuntimeError("Event fetch stopped before the last page; the export is incomplete")
+
+class PartWriter:
+    """Write chunks to one file per format, starting new numbered parts every `rows_per_file` rows"""
+
+    def __init__(self, output_dir, stem, formats, compress=None, rows_per_file=ROWS_PER_FILE):
+        self.output_dir = output_dir
+        self.stem = stem
+        self.formats = formats
+        self.compress = compress
+        self.rows_per_file = rows_per_file
+        self.writers = []
+        self.paths = []
+        self.parts = 0
+        self.rows = 0
+
+    def _roll(self):
+        self.close()
+        stem = f"{self.stem}-{self.parts:05d}"
+        self.writers = [open_writer(self.output_dir, stem, fmt, self.compress) for fmt in self.formats]
+        self.parts += 1
+
+    def write_chunk(self, df):
+        while not df.empty:
+            if not self.writers or self.writers[0].rows >= self.rows_per_file:
+                self._roll()
+            part = df.iloc[:self.rows_per_file - self.writers[0].rows]
+            for writer in self.writers:
+                writer.write_chunk(part)
+            self.rows += len(part)
+            df = df.iloc[len(part):]
+
+    def close(self):
+        self.paths.extend(writer.commit() for writer in self.writers)
+        self.writers = []
+
+    def abort(self):
+        for writer in self.writers:
+            writer.abort()
+        self.writers = []
+
+def export_order_facts(api_key, metric_id, date_range, output_dir=None, formats=None, compress=None, lookups=True,
+                       rows_per_file=ROWS_PER_FILE):
+    """Stream order facts into chunked files in the run directory; only one chunk is held in memory at a time
+
+    Returns the written paths and lists them in the manifest.
+    """
+    output_dir = output_dir if output_dir is not None else run_dir()
+    os.makedirs(output_dir, exist_ok=True)
+
+    def request(endpoint, params=None):
+        return klaviyo_client.make_klaviyo_request(endpoint, api_key, params)
+
+    writer = PartWriter(output_dir, ORDER_FACTS_STEM, formats or OUTPUT_FORMATS, compress, rows_per_file)
+    progress = Progress(logger, "Exporting orders")
+    chunk = []
+    with stage("export"):
+        try:
+            for row in iter_order_facts(request, metric_id, date_range, lookups):
+                chunk.append(row)
+                if len(chunk) == CHUNK_ROWS:
+                    writer.write_chunk(order_fact_frame(chunk))
+                    progress.update(orders=len(chunk))
+                    chunk = []
+            if chunk:
+                writer.write_chunk(order_fact_frame(chunk))
+                progress.update(orders=len(chunk))
+            writer.close()
+        except BaseException:
+            writer.abort()
+            raise
+    progress.done("Exported orders")
+
+    update_manifest(output_dir, tables={ORDER_FACTS_STEM: {
+        "files": [os.path.basename(path) for path in writer.paths],
+        "rows": writer.rows,
+        "columns": {column: str(dtype) for column, dtype in order_fact_frame([]).dtypes.items()},
+        "customer_status": "prior_order_lookup" if lookups else "first_in_window",
+    }}, account=klaviyo_client.account_key(api_key))
+    return writer.paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Export one row per order with its attribution for warehouse loads")
+    add_date_range_args(parser)
+    parser.add_argument("--formats", nargs="+", choices=["parquet", "ndjson", "csv"], default=list(OUTPUT_FORMATS),
+                        help=f"Output formats (default: {' '.join(OUTPUT_FORMATS)})")
+    parser.add_argument("--rows-per-file", type=int, default=ROWS_PER_FILE,
+                        help=f"Orders per output file before a new part starts (default: {ROWS_PER_FILE})")
+    parser.add_argument("--no-lookups", action="store_true",
+                        help="Mark the orders at a profile's first datetime in the window as new without checking "
+                             "earlier orders")
+    args = parser.parse_args()
+
+    api_key = os.getenv("KLAVIYO_API_KEY")
+    if not api_key:
+        raise ValueError("No API key found. Please create a .env file with your KLAVIYO_API_KEY")
+
+    metrics = klaviyo_client.make_klaviyo_request("metrics", api_key)
+    metric_id = next((m["id"] for m in (metrics or {}).get("data", []) if m["attributes"]["name"] == "Placed Order"),
+                     None)
+    if not metric_id:
+        log(logger, logging.ERROR, "No Placed Order metric found")
+        return
+
+    paths = export_order_facts(api_key, metric_id, date_range_from_args(args), formats=args.formats,
+                               lookups=not args.no_lookups, rows_per_file=args.rows_per_file)
+    print(f"\nExport complete! Files saved to {run_dir()}:")
+    for path in paths:
+        print(f"- {path}")
+    report_run(os.path.join(run_dir(), PROFILE_FILE))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import os
+import re
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from memprofile import MEMORY_PROFILE, MEMORY_PROFILE_FILE, memory_profiler
+
+# Upper bounds of the request latency histogram buckets in milliseconds, plus one bucket above the last
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+PROFILE_FILE = "run_profile.json"
+
+def endpoint_name(endpoint):
+    """Group requests by route, e.g. every profiles/<id>/events lookup under profiles/{id}/events"""
+    return re.sub(r"^(profiles|campaigns|flows|metrics|events)/[^/]+", r"\1/{id}", endpoint.lstrip("/"))
+
+def _new_endpoint():
+    return {"requests": 0, "errors": 0, "rate_limited": 0, "retries": 0, "bytes": 0, "sleep_seconds": 0.0,
+            "latency_seconds": 0.0, "max_latency_ms": 0.0, "latency_histogram": [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+
+class RunProfile:
+    """Per-endpoint request metrics and per-stage timers for one run of the analyses"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self._clear()
+
+    def _clear(self):
+        with self.lock:
+            self.started = time.monotonic()
+            self.endpoints = {}
+            self.stages = {}
+
+    def reset(self):
+        """Start over for a new run of this process"""
+        self._clear()
+        # With KLAVIYO_MEMORY_PROFILE set, each run also gets a fresh memory profile
+        if MEMORY_PROFILE:
+            memory_profiler.stop()
+            memory_profiler.start()
+
+    def _endpoint(self, endpoint):
+        name = endpoint_name(endpoint)
+        if name not in self.endpoints:
+            self.endpoints[name] = _new_endpoint()
+        return self.endpoints[name]
+
+    def record_request(self, endpoint, status, latency, size):
+        """One HTTP response: its status, latency in seconds and body size in bytes"""
+        latency_ms = latency * 1000
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if latency_ms <= bound),
+                      len(LATENCY_BUCKETS_MS))
+        with self.lock:
+            stats = self._endpoint(endpoint)
+            stats["requests"] += 1
+            stats["bytes"] += size
+            stats["latency_seconds"] += latency
+            stats["max_latency_ms"] = max(stats["max_latency_ms"], latency_ms)
+            stats["latency_histogram"][bucket] += 1
+            if status == 429:
+                stats["rate_limited"] += 1
+            elif status != 200:
+                stats["errors"] += 1
+
+    def record_retry(self, endpoint):
+        with self.lock:
+            self._endpoint(endpoint)["retries"] += 1
+
+    def record_sleep(self, endpoint, seconds):
+        """Time spent waiting on the rate limiter (token bucket or Retry-After) before a request"""
+        if seconds > 0:
+            with self.lock:
+                self._endpoint(endpoint)["sleep_seconds"] += seconds
+
+    def _charge(self, name, seconds, finished=False):
+        with self.lock:
+            stats = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+            stats["seconds"] += seconds
+            stats["calls"] += int(finished)
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block as `name`; nested stages are exclusive, so the enclosing stage is paused meanwhile"""
+        stack = self.local.__dict__.setdefault("stack", [])
+        now = time.perf_counter()
+        if stack:
+            self._charge(stack[-1][0], now - stack[-1][1])
+        frame = [name, now]
+        stack.append(frame)
+        memory_profiler.enter(name)
+        try:
+            yield
+        finally:
+            memory_profiler.exit(name)
+            end = time.perf_counter()
+            stack.pop()
+            self._charge(name, end - frame[1], finished=True)
+            if stack:
+                stack[-1][1] = end
+
+    def report(self):
+        """Snapshot of the run as a JSON-serializable dict"""
+        with self.lock:
+            endpoints = {}
+            for name, stats in sorted(self.endpoints.items()):
+                buckets = [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+                endpoints[name] = {
+                    "requests": stats["requests"],
+                    "errors": stats["errors"],
+                    "rate_limited": stats["rate_limited"],
+                    "retries": stats["retries"],
+                    "bytes": stats["bytes"],
+                    "sleep_seconds": round(stats["sleep_seconds"], 3),
+                    "mean_latency_ms": round(stats["latency_seconds"] * 1000 / stats["requests"], 1)
+                    if stats["requests"] else None,
+                    "max_latency_ms": round(stats["max_latency_ms"], 1),
+                    "latency_histogram": dict(zip(buckets, stats["latency_histogram"])),
+                }
+            stages = {name: {"calls": s["calls"], "seconds": round(s["seconds"], 3)}
+                      for name, s in sorted(self.stages.items(), key=lambda item: -item[1]["seconds"])}
+            report = {"elapsed_seconds": round(time.monotonic() - self.started, 3),
+                      "endpoints": endpoints, "stages": stages}
+        if memory_profiler.active:
+            report["memory"] = memory_profiler.report()
+        return report
+
+# The profile of the current process; CLI runs reset it at the start and report it at the end
+run_profile = RunProfile()
+if MEMORY_PROFILE:
+    memory_profiler.start()
+
+_profile = contextvars.ContextVar("run_profile", default=None)
+
+def current_profile():
+    """The profile that requests and stages are recorded in: the one set by profiling(), else run_profile"""
+    return _profile.get() or run_profile
+
+@contextmanager
+def profiling(profile):
+    """Record into `profile` inside the block, e.g. one dashboard session's run, instead of the process profile"""
+    token = _profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _profile.reset(token)
+
+def stage(name):
+    return current_profile().stage(name)
+
+def timed_stage(name):
+    """Decorator form of stage()"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with current_profile().stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def format_report(report):
+    """Plain-text tables of a report: requests per endpoint, then time per stage"""
+    lines = [f"Run profile ({report['elapsed_seconds']:.1f}s)", "",
+             f"{'endpoint':<24} {'requests':>9} {'429s':>6} {'retries':>7} {'errors':>6} {'MB':>9} "
+             f"{'sleep s':>8} {'mean ms':>8} {'max ms':>8}"]
+    for name, s in report["endpoints"].items():
+        mean = f"{s['mean_latency_ms']:.1f}" if s["mean_latency_ms"] is not None else "-"
+        lines.append(f"{name:<24} {s['requests']:>9,} {s['rate_limited']:>6,} {s['retries']:>7,} {s['errors']:>6,} "
+                     f"{s['bytes'] / 2**20:>9.2f} {s['sleep_seconds']:>8.2f} {mean:>8} {s['max_latency_ms']:>8.1f}")
+    lines += ["", f"{'stage':<24} {'calls':>9} {'seconds':>9}"]
+    for name, s in report["stages"].items():
+        lines.append(f"{name:<24} {s['calls']:>9,} {s['seconds']:>9.2f}")
+    if "memory" in report:
+        memory = report["memory"]
+        lines += ["", f"Memory: peak traced {memory['peak_traced_bytes'] / 2**20:.1f} MB, "
+                      f"peak RSS {memory['peak_rss_bytes'] / 2**20:.1f} MB", "",
+                  f"{'stage':<24} {'peak MB':>9} {'retained MB':>12} {'peak RSS MB':>12}"]
+        for name, s in memory["stages"].items():
+            lines.append(f"{name:<24} {s['peak_traced_bytes'] / 2**20:>9.1f} {s['retained_bytes'] / 2**20:>12.1f} "
+                         f"{s['peak_rss_bytes'] / 2**20:>12.1f}")
+        lines += ["", "Largest live allocations:"]
+        lines += [f"  {site['size_bytes'] / 2**20:>8.2f} MB  {site['site']}" for site in memory["top_live_allocations"]]
+    return "\n".join(lines)
+
+def write_report(report, path=PROFILE_FILE):
+    """Save a report as JSON; a memory profile goes to its own file in the same directory"""
+    report = dict(report)
+    memory = report.pop("memory", None)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    if memory is not None:
+        with open(os.path.join(os.path.dirname(path), MEMORY_PROFILE_FILE), "w") as f:
+            json.dump(memory, f, indent=2)
+    return path
+
+def report_run(path=PROFILE_FILE):
+    """Print the current run profile and save it as JSON; called at the end of CLI runs"""
+    report = current_profile().report()
+    print("\n" + format_report(report))
+    print(f"\nRun profile saved to {write_report(report, path)}")
+    if "memory" in report:
+        print(f"Memory profile saved to {os.path.join(os.path.dirname(path), MEMORY_PROFILE_FILE)}")
+    return report
@@ -0,0 +1,153 @@
+import os
+import time
+import logging
+import hashlib
+import threading
+import requests
+from cassette import get_cassette
+from instrumentation import current_profile, endpoint_name
+from metrics import account_labels, registry
+from logs import get_logger, log
+
+logger = get_logger("client")
+
+# Point KLAVIYO_API_URL at a local mock_server.py to run without network or credentials
+KLAVIYO_API_URL = os.getenv("KLAVIYO_API_URL", "https://a.klaviyo.com/api").rstrip("/")
+KLAVIYO_TRACK_URL = f"{KLAVIYO_API_URL}/track"
+KLAVIYO_REVISION = "2025-01-15"
+
+# Client-side request budget per account; Klaviyo enforces its limits per API key
+MAX_REQUESTS_PER_SECOND = float(os.getenv("KLAVIYO_MAX_RPS", "10"))
+BURST = int(os.getenv("KLAVIYO_BURST", "10"))
+
+# Consecutive 429 responses tolerated for one request before giving up
+MAX_RATE_LIMIT_RETRIES = 10
+
+class RateLimiter:
+    """Token bucket for one account; a 429 pauses this account only"""
+
+    def __init__(self, rate=None, burst=None):
+        # Module settings are read at construction so callers (mock runs, benchmarks) can override them
+        self.rate = rate or MAX_REQUESTS_PER_SECOND
+        self.capacity = burst or BURST
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until this account may send another request; returns the seconds spent waiting"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        """Hold back every request for this account for `seconds` (from Retry-After)"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+# Per-account state, keyed by a fingerprint of the API key
+_limiters = {}
+_sessions = {}
+_state_lock = threading.Lock()
+
+def account_key(api_key):
+    """Stable, non-reversible identifier for an API key"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+def get_rate_limiter(api_key):
+    """Return the rate limiter shared by every request made with this API key"""
+    key = account_key(api_key)
+    with _state_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter()
+        return _limiters[key]
+
+def get_session(api_key):
+    """Return a pooled HTTP session for this API key"""
+    key = account_key(api_key)
+    with _state_lock:
+        if key not in _sessions:
+            session = requests.Session()
+            session.headers.update({
+                "Authorization": f"Klaviyo-API-Key {api_key}",
+                "Accept": "application/json",
+                "revision": KLAVIYO_REVISION
+            })
+            _sessions[key] = session
+        return _sessions[key]
+
+def make_klaviyo_request(endpoint, api_key, params=None, method="GET", json_body=None, use_track=False):
+    """Make a request to Klaviyo API with per-account rate limiting and enhanced error handling"""
+    url = KLAVIYO_TRACK_URL if use_track else f"{KLAVIYO_API_URL}/{endpoint.lstrip('/')}"
+    cassette = get_cassette()
+    replaying = cassette is not None and cassette.replaying
+    # A full-speed replay skips the rate limiter and Retry-After waits; a timed replay keeps them
+    throttled = not replaying or cassette.timed
+    limiter = get_rate_limiter(api_key)
+    profile = current_profile()
+
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        if attempt:
+            profile.record_retry(endpoint)
+        if throttled:
+            with account_labels(account_key(api_key)), registry.track("klaviyo_queue_depth", queue="rate_limiter"):
+                profile.record_sleep(endpoint, limiter.acquire())
+        started = time.monotonic()
+        if replaying:
+            response = cassette.play(method, endpoint, params, json_body, use_track)
+            if response is None:
+                log(logger, logging.ERROR, "No recorded response in cassette", method=method, endpoint=endpoint,
+                    cassette=cassette.path)
+                return None
+        else:
+            session = get_session(api_key)
+            try:
+                with account_labels(account_key(api_key)), registry.track("klaviyo_requests_in_flight"):
+                    if method == "POST":
+                        response = session.post(url, params=params, json=json_body)
+                    else:
+                        response = session.get(url, params=params)
+            except requests.exceptions.RequestException as e:
+                log(logger, logging.ERROR, "API request failed", endpoint=endpoint, error=str(e))
+                return None
+            if cassette is not None:
+                cassette.record(method, endpoint, params, json_body, use_track, response,
+                                time.monotonic() - started)
+        profile.record_request(endpoint, response.status_code, time.monotonic() - started, len(response.content))
+        with account_labels(account_key(api_key)):
+            registry.inc("klaviyo_requests_total", endpoint=endpoint_name(endpoint), status=response.status_code)
+            if response.status_code == 429:
+                registry.inc("klaviyo_rate_limited_total")
+
+        if response.status_code == 429:
+            retry_after = int(response.headers.get("Retry-After", 60))
+            log(logger, logging.WARNING, "Rate limit reached", endpoint=endpoint, retry_after_s=retry_after)
+            if throttled:
+                limiter.pause(retry_after)
+            continue
+
+        if response.status_code != 200:
+            log(logger, logging.ERROR, "Error response", endpoint=endpoint, status=response.status_code,
+                body=response.text[:500])
+            return None
+
+        return response.json() if not use_track else response.text
+
+    log(logger, logging.ERROR, "Giving up after rate-limit retries", endpoint=endpoint, retries=MAX_RATE_LIMIT_RETRIES)
+    return None
+
+def fetch_metric_ids(api_key, names):
+    """Metric name -> id for every name in `names` that the account has, from one /metrics request"""
+    metrics = make_klaviyo_request("metrics", api_key)
+    return {m["attributes"]["name"]: m["id"] for m in (metrics or {}).get("data", []) if m["attributes"]["name"] in names}
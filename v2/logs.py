@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+
+# DEBUG adds per-page and per-lookup detail; INFO (default) keeps hot loops down to periodic progress lines
+LOG_LEVEL = os.getenv("KLAVIYO_LOG_LEVEL", "INFO").upper()
+
+# "text" for people, "json" for one JSON object per line
+LOG_FORMAT = os.getenv("KLAVIYO_LOG_FORMAT", "text")
+
+# At DEBUG, hot loops log one payload in this many iterations
+DEBUG_SAMPLE_EVERY = int(os.getenv("KLAVIYO_LOG_SAMPLE_EVERY", "100"))
+
+# Minimum seconds between two progress lines of the same loop
+PROGRESS_INTERVAL = float(os.getenv("KLAVIYO_LOG_PROGRESS_SECONDS", "5"))
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s", "%H:%M:%S")
+
+    def format(self, record):
+        fields = dict(getattr(record, "fields", {}))
+        payload = fields.pop("payload", None)
+        line = super().format(record) + "".join(f" {k}={v}" for k, v in fields.items())
+        if payload is not None:
+            line += "\n" + json.dumps(payload, indent=2, default=str)
+        return line
+
+_configured = False
+_configure_lock = threading.Lock()
+
+def configure_logging(level=None, fmt=None):
+    """Attach one stderr handler to the klaviyo logger tree; later calls only change level and format"""
+    global _configured
+    root = logging.getLogger("klaviyo")
+    with _configure_lock:
+        if not _configured:
+            root.addHandler(logging.StreamHandler())
+            root.propagate = False
+            _configured = True
+        root.setLevel(level or LOG_LEVEL)
+        root.handlers[0].setFormatter(JsonFormatter() if (fmt or LOG_FORMAT) == "json" else TextFormatter())
+    return root
+
+def get_logger(name):
+    if not _configured:
+        configure_logging()
+    return logging.getLogger(f"klaviyo.{name}")
+
+def log(logger, level, msg, **fields):
+    """Log `msg` with structured fields (rendered as key=value or JSON keys)"""
+    if logger.isEnabledFor(level):
+        logger.log(level, msg, extra={"fields": fields})
+
+class Sampler:
+    """Log a debug payload for one in `every` calls; the payload is only built when it is logged"""
+
+    def __init__(self, logger, every=DEBUG_SAMPLE_EVERY):
+        self.logger = logger
+        self.every = max(every, 1)
+        self.count = 0
+
+    def debug(self, msg, payload=None, **fields):
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        self.count += 1
+        if (self.count - 1) % self.every:
+            return
+        if callable(payload):
+            payload = payload()
+        extra = {"sample": self.count, "sampled_every": self.every, **fields}
+        if payload is not None:
+            extra["payload"] = payload
+        log(self.logger, logging.DEBUG, msg, **extra)
+
+class Progress:
+    """Counters for a long loop, logged at INFO at most once per interval and once at the end"""
+
+    def __init__(self, logger, msg, interval=PROGRESS_INTERVAL, **fields):
+        self.logger = logger
+        self.msg = msg
+        self.interval = interval
+        self.fields = fields
+        self.counters = {}
+        self.started = self.last = time.monotonic()
+
+    def update(self, **counts):
+        for name, value in counts.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.last = now
+            log(self.logger, logging.INFO, self.msg, **self.fields, **self.counters,
+                elapsed_s=round(now - self.started, 1))
+
+    def done(self, msg=None, level=logging.INFO):
+        log(self.logger, level, msg or f"{self.msg} done", **self.fields, **self.counters,
+            elapsed_s=round(time.monotonic() - self.started, 1))
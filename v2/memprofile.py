@@ -0,0 +1,155 @@
+import os
+import time
+import resource
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# Set KLAVIYO_MEMORY_PROFILE=1 to profile memory per stage in CLI and dashboard runs (slows them down 2-3x)
+MEMORY_PROFILE = os.getenv("KLAVIYO_MEMORY_PROFILE", "") not in ("", "0")
+
+MEMORY_PROFILE_FILE = "memory_profile.json"
+
+# Allocation sites listed per stage and for the whole run
+TOP_SITES = 10
+
+# How often the background thread reads the process RSS
+RSS_SAMPLE_SECONDS = 0.05
+
+# Live allocation sites are only re-captured for an outermost stage when its peak grew by at least this much
+SNAPSHOT_GROWTH_BYTES = 1024 * 1024
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def current_rss_bytes():
+    """Resident set size now (Linux /proc), falling back to the process's peak elsewhere"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def top_allocations(snapshot, limit=TOP_SITES):
+    """Largest allocation sites (file:line) in a tracemalloc snapshot"""
+    return [{"site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+             "size_bytes": stat.size, "blocks": stat.count}
+            for stat in snapshot.statistics("lineno")[:limit]]
+
+class MemoryProfiler:
+    """tracemalloc peaks and retained bytes plus sampled RSS, per stage
+
+    peak_traced_bytes is the process-wide traced peak while the stage ran, peak_growth_bytes the part of it
+    above what was allocated when the stage started, and retained_bytes what the stage left allocated.
+    Stages nest inclusively: a stage's peak covers the stages inside it. Meant for single-threaded runs,
+    since tracemalloc's peak is process-wide.
+    """
+
+    def __init__(self, top=TOP_SITES):
+        self.top = top
+        self.lock = threading.Lock()
+        self.active = False
+
+    def start(self):
+        if self.active:
+            return
+        self.stages = {}
+        self.stack = []
+        self.rss_peak = self.run_rss_peak = current_rss_bytes()
+        self.started = time.monotonic()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self.active = True
+        threading.Thread(target=self._sample_rss, daemon=True).start()
+
+    def _sample_rss(self):
+        while self.active:
+            rss = current_rss_bytes()
+            with self.lock:
+                self.rss_peak = max(self.rss_peak, rss)
+                self.run_rss_peak = max(self.run_rss_peak, rss)
+            time.sleep(RSS_SAMPLE_SECONDS)
+
+    def _take_peaks(self):
+        """Traced and RSS peaks since the last call, then restart both"""
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        with self.lock:
+            rss_peak = max(self.rss_peak, current_rss_bytes())
+            self.rss_peak = 0
+        return traced_peak, rss_peak
+
+    def enter(self, name):
+        if not self.active:
+            return
+        traced_peak, rss_peak = self._take_peaks()
+        if self.stack:
+            parent = self.stack[-1]
+            parent["peak"] = max(parent["peak"], traced_peak)
+            parent["rss_peak"] = max(parent["rss_peak"], rss_peak)
+        self.stack.append({"name": name, "start": tracemalloc.get_traced_memory()[0], "peak": 0, "rss_peak": 0})
+
+    def exit(self, name):
+        if not self.active or not self.stack:
+            return
+        traced_peak, rss_peak = self._take_peaks()
+        frame = self.stack.pop()
+        frame["peak"] = max(frame["peak"], traced_peak)
+        frame["rss_peak"] = max(frame["rss_peak"], rss_peak)
+        if self.stack:
+            parent = self.stack[-1]
+            parent["peak"] = max(parent["peak"], frame["peak"])
+            parent["rss_peak"] = max(parent["rss_peak"], frame["rss_peak"])
+
+        retained = tracemalloc.get_traced_memory()[0] - frame["start"]
+        growth = frame["peak"] - frame["start"]
+        stats = self.stages.setdefault(name, {"calls": 0, "peak_traced_bytes": 0, "peak_growth_bytes": 0,
+                                              "retained_bytes": 0, "peak_rss_bytes": 0, "top_live_allocations": []})
+        stats["calls"] += 1
+        stats["peak_growth_bytes"] = max(stats["peak_growth_bytes"], growth)
+        stats["retained_bytes"] += retained
+        stats["peak_rss_bytes"] = max(stats["peak_rss_bytes"], frame["rss_peak"])
+        # Snapshots walk the whole heap, so nested stages skip them rather than slow their enclosing stage
+        grew = frame["peak"] >= stats["peak_traced_bytes"] + SNAPSHOT_GROWTH_BYTES or not stats["top_live_allocations"]
+        if grew and not self.stack:
+            stats["top_live_allocations"] = top_allocations(tracemalloc.take_snapshot(), self.top)
+        stats["peak_traced_bytes"] = max(stats["peak_traced_bytes"], frame["peak"])
+        return {"peak_traced_bytes": frame["peak"], "peak_growth_bytes": growth, "retained_bytes": retained,
+                "peak_rss_bytes": frame["rss_peak"]}
+
+    @contextmanager
+    def track(self, name):
+        """Profile a block as one stage call; yields a dict filled with that call's numbers on exit"""
+        result = {}
+        self.enter(name)
+        try:
+            yield result
+        finally:
+            result.update(self.exit(name) or {})
+
+    def report(self):
+        """Per-stage numbers plus the run's peaks and the allocation sites still alive now"""
+        current, peak = tracemalloc.get_traced_memory()
+        with self.lock:
+            run_rss_peak = max(self.run_rss_peak, current_rss_bytes())
+        stage_peaks = [s["peak_traced_bytes"] for s in self.stages.values()]
+        return {
+            "elapsed_seconds": round(time.monotonic() - self.started, 3),
+            "peak_traced_bytes": max([peak] + stage_peaks),
+            "current_traced_bytes": current,
+            "peak_rss_bytes": run_rss_peak,
+            "stages": dict(sorted(self.stages.items(), key=lambda item: -item[1]["peak_traced_bytes"])),
+            "top_live_allocations": top_allocations(tracemalloc.take_snapshot(), self.top),
+        }
+
+    def stop(self):
+        """Stop profiling and return the final report"""
+        if not self.active:
+            return None
+        report = self.report()
+        self.active = False
+        tracemalloc.stop()
+        return report
+
+# Shared by the stage timers in instrumentation.py
+memory_profiler = MemoryProfiler()
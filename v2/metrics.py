@@ -0,0 +1,203 @@
+import os
+import time
+import resource
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Default port of the /metrics endpoint
+METRICS_PORT = int(os.getenv("KLAVIYO_METRICS_PORT", "9464"))
+
+# Window for the requests/s and events/s gauges, computed from counter samples taken at each scrape
+RATE_WINDOW_SECONDS = 60
+
+# name -> (type, help)
+METRICS = {
+    "klaviyo_requests_total": ("counter", "HTTP responses from the Klaviyo API by endpoint and status"),
+    "klaviyo_requests_in_flight": ("gauge", "Requests currently waiting for a response"),
+    "klaviyo_rate_limited_total": ("counter", "429 responses"),
+    "klaviyo_pages_total": ("counter", "Pages of /events processed"),
+    "klaviyo_events_total": ("counter", "Events fetched from the API"),
+    "klaviyo_cache_events_total": ("counter", "Events served by the event cache (hit) or fetched for it (miss)"),
+    "klaviyo_queue_depth": ("gauge", "Work waiting in a queue: accounts in the batch pool, requests at the rate limiter"),
+    "klaviyo_requests_per_second": ("gauge", f"Responses per second over the last {RATE_WINDOW_SECONDS}s"),
+    "klaviyo_events_per_second": ("gauge", f"Events fetched per second over the last {RATE_WINDOW_SECONDS}s"),
+    "klaviyo_cache_hit_ratio": ("gauge", "Share of events served from the event cache"),
+    "klaviyo_peak_rss_bytes": ("gauge", "Peak resident set size of each process"),
+}
+
+_labels = contextvars.ContextVar("metric_labels", default={})
+
+@contextmanager
+def metric_labels(**labels):
+    """Attach labels (account, feature) to every metric recorded inside the block"""
+    token = _labels.set({**_labels.get(), **labels})
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+def account_labels(account):
+    """metric_labels naming the account, unless the caller already did (e.g. with the batch account name)"""
+    return metric_labels() if _labels.get().get("account") else metric_labels(account=account)
+
+def _series(name, labels):
+    merged = {"account": "", "feature": "", **_labels.get(), **labels}
+    return name, tuple(sorted((k, str(v)) for k, v in merged.items()))
+
+def _peak_rss_bytes():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class Registry:
+    """Counters and gauges keyed by (name, labels), plus the latest snapshots forwarded by worker processes"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.remote = {}
+        self.samples = deque()
+
+    def inc(self, name, value=1, **labels):
+        key = _series(name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def dec(self, name, value=1, **labels):
+        self.inc(name, -value, **labels)
+
+    @contextmanager
+    def track(self, name, **labels):
+        """Gauge that counts how many callers are inside the block"""
+        self.inc(name, **labels)
+        try:
+            yield
+        finally:
+            self.dec(name, **labels)
+
+    def snapshot(self):
+        """This process's series, with its peak RSS; picklable so workers can forward it"""
+        with self.lock:
+            values = dict(self.values)
+        values[("klaviyo_peak_rss_bytes", (("process", str(os.getpid())),))] = _peak_rss_bytes()
+        return values
+
+    def merge(self, source, snapshot):
+        with self.lock:
+            self.remote[source] = snapshot
+
+    def collect(self):
+        """Local and forwarded series summed, plus the derived rate and ratio gauges"""
+        totals = {}
+        with self.lock:
+            snapshots = list(self.remote.values())
+        for snapshot in [self.snapshot()] + snapshots:
+            for key, value in snapshot.items():
+                totals[key] = totals.get(key, 0) + value
+
+        now = time.monotonic()
+        with self.lock:
+            self.samples.append((now, totals))
+            while len(self.samples) > 1 and now - self.samples[0][0] > RATE_WINDOW_SECONDS:
+                self.samples.popleft()
+            oldest_time, oldest = self.samples[0]
+        elapsed = now - oldest_time
+
+        rates = {"klaviyo_requests_total": "klaviyo_requests_per_second",
+                 "klaviyo_events_total": "klaviyo_events_per_second"}
+        derived, cache = {}, {}
+        for (name, labels), value in totals.items():
+            label_dict = dict(labels)
+            scope = (("account", label_dict.get("account", "")), ("feature", label_dict.get("feature", "")))
+            if name in rates:
+                rate = (value - oldest.get((name, labels), 0)) / elapsed if elapsed > 0 else 0.0
+                derived[(rates[name], scope)] = derived.get((rates[name], scope), 0) + rate
+            elif name == "klaviyo_cache_events_total":
+                hits, seen = cache.get(scope, (0, 0))
+                cache[scope] = (hits + (value if label_dict.get("result") == "hit" else 0), seen + value)
+        for scope, (hits, seen) in cache.items():
+            derived[("klaviyo_cache_hit_ratio", scope)] = hits / seen if seen else 0.0
+        totals.update(derived)
+        return totals
+
+    def render(self):
+        """Prometheus text exposition format"""
+        by_name = {}
+        for (name, labels), value in self.collect().items():
+            by_name.setdefault(name, []).append((labels, value))
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            if name not in by_name:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(by_name[name]):
+                rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                lines.append(f"{name}{{{rendered}}} {_format(value)}" if rendered else f"{name} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+def _format(value):
+    return str(int(value)) if float(value).is_integer() else repr(round(float(value), 6))
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+# Metrics of this process (and, in the batch parent, of its workers)
+registry = Registry()
+
+def start_metrics_server(port=METRICS_PORT, host="127.0.0.1"):
+    """Serve GET /metrics from a background thread; returns the server"""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+_forward_queue = None
+
+def forward_metrics(queue, interval=1.0):
+    """Worker process initializer: push this process's snapshot to the parent every `interval` seconds"""
+    global _forward_queue
+    _forward_queue = queue
+    # A forked worker starts with a copy of the parent's series; the parent already reports those
+    with registry.lock:
+        registry.values.clear()
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            flush_metrics()
+    threading.Thread(target=loop, daemon=True).start()
+
+def flush_metrics():
+    """Send this worker's current snapshot now; a no-op outside forwarding workers"""
+    if _forward_queue is not None:
+        _forward_queue.put((os.getpid(), registry.snapshot()))
+
+def receive_metrics(queue):
+    """In the parent: merge snapshots forwarded by workers until a None arrives"""
+    def loop():
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            registry.merge(*item)
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,455 @@
+import os
+import re
+import json
+import time
+import random
+import base64
+import argparse
+import threading
+from collections import defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, urlencode
+import numpy as np
+import pandas as pd
+from synthetic import generate_dataset
+
+# Flat event columns -> the Klaviyo property name they are served as
+EVENT_PROPERTY_COLUMNS = {
+    "value": "$value",
+    "order_id": "OrderId",
+    "attributed_message": "$attributed_message",
+    "attributed_flow": "$attributed_flow",
+    "message": "$message",
+    "flow": "$flow",
+}
+
+# metric-aggregates "by" dimensions the mock can group on
+AGGREGATE_DIMENSIONS = {
+    "$attributed_message": "attributed_message",
+    "$attributed_flow": "attributed_flow",
+    "$message": "message",
+    "$flow": "flow",
+}
+
+INTERVAL_PERIODS = {"hour": "h", "day": "D", "week": "W-SUN", "month": "M"}
+
+# Bounded cache of resolved filters so deep pagination does not re-filter the whole table per page
+QUERY_CACHE_SIZE = 32
+
+def load_dataset(fixtures_dir):
+    """Load a fixture directory: metrics/campaigns/flows JSON plus events and order_items Parquet"""
+    def read_json(name):
+        with open(os.path.join(fixtures_dir, name)) as f:
+            return json.load(f)
+
+    events = pd.read_parquet(os.path.join(fixtures_dir, "events.parquet"))
+    items_path = os.path.join(fixtures_dir, "order_items.parquet")
+    items = pd.read_parquet(items_path) if os.path.exists(items_path) else None
+    return {
+        "metrics": read_json("metrics.json"),
+        "campaigns": read_json("campaigns.json"),
+        "flows": read_json("flows.json"),
+        "events": events,
+        "order_items": items,
+    }
+
+def parse_filter(filter_str):
+    """Parse a Klaviyo filter like equals(metric_id,"X"),less-than(datetime,...) into (op, field, value) tuples"""
+    if not filter_str:
+        return []
+    return [(op, field.strip(), value.strip().strip("'\""))
+            for op, field, value in re.findall(r"([a-z-]+)\(([^,()]+),([^()]*)\)", filter_str)]
+
+def parse_timestamp(value):
+    """Parse a filter datetime into a naive UTC pandas Timestamp"""
+    ts = pd.Timestamp(value)
+    return ts.tz_convert(None) if ts.tzinfo is not None else ts
+
+def encode_cursor(offset):
+    return base64.urlsafe_b64encode(f"offset:{offset}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return int(base64.urlsafe_b64decode(padded).decode().split(":", 1)[1])
+
+class MockKlaviyo:
+    """In-memory Klaviyo account with configurable latency, paging, throttling and failures"""
+
+    def __init__(self, dataset, page_size=200, latency_ms=0.0, jitter_ms=0.0, rate_limit=0.0, burst=None,
+                 retry_after=1, throttle_rate=0.0, error_rate=0.0, error_status=500, seed=None):
+        self.metrics = dataset["metrics"]
+        self.campaigns = dataset["campaigns"]
+        self.flows = dataset["flows"]
+        events = dataset["events"].copy()
+        events["datetime"] = pd.to_datetime(events["datetime"], utc=True).dt.tz_convert(None)
+        self.events = events.sort_values("datetime", kind="stable", ignore_index=True)
+        self.datetimes = self.events["datetime"].to_numpy()
+        self.items = self._index_items(dataset.get("order_items"))
+        self.profile_index = None
+
+        self.page_size = page_size
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.rate_limit = rate_limit
+        self.burst = burst or max(rate_limit, 1)
+        self.retry_after = retry_after
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.query_cache = {}
+        self.reset_stats()
+
+    def _index_items(self, items):
+        """Sort order items by event id so a page can look its items up with a binary search"""
+        if items is None or items.empty:
+            return None
+        items = items.sort_values("event_id", kind="stable", ignore_index=True)
+        return {
+            "event_id": items["event_id"].to_numpy().astype(str),
+            "records": items[["product_id", "product_name", "quantity", "item_price", "category"]].to_numpy(),
+        }
+
+    def _items_for(self, event_id):
+        if self.items is None:
+            return None
+        lo = np.searchsorted(self.items["event_id"], event_id, side="left")
+        hi = np.searchsorted(self.items["event_id"], event_id, side="right")
+        return [{"ProductID": product_id, "ProductName": name, "Quantity": int(quantity),
+                 "ItemPrice": float(price), "Categories": [category]}
+                for product_id, name, quantity, price, category in self.items["records"][lo:hi]] or None
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {"requests": defaultdict(int), "statuses": defaultdict(int), "bytes_sent": 0}
+
+    def stats_snapshot(self):
+        with self.lock:
+            return {"requests": dict(self.stats["requests"]), "statuses": dict(self.stats["statuses"]),
+                    "bytes_sent": self.stats["bytes_sent"]}
+
+    def record(self, endpoint, status, size):
+        with self.lock:
+            self.stats["requests"][endpoint] += 1
+            self.stats["statuses"][str(status)] += 1
+            self.stats["bytes_sent"] += size
+
+    def admit(self, api_key):
+        """Apply the per-key token bucket and injected faults; returns (status, headers) for a rejection or None"""
+        if self.rate_limit > 0:
+            with self.lock:
+                tokens, updated = self.buckets.get(api_key, (self.burst, time.monotonic()))
+                now = time.monotonic()
+                tokens = min(self.burst, tokens + (now - updated) * self.rate_limit)
+                allowed = tokens >= 1
+                self.buckets[api_key] = (tokens - 1 if allowed else tokens, now)
+            if not allowed:
+                return 429, {"Retry-After": str(self.retry_after)}
+        if self.throttle_rate and self.random.random() < self.throttle_rate:
+            return 429, {"Retry-After": str(self.retry_after)}
+        if self.error_rate and self.random.random() < self.error_rate:
+            return self.error_status, {}
+        return None
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(max(self.latency + self.random.uniform(-self.jitter, self.jitter), 0))
+
+    # --- query helpers -------------------------------------------------------------------------
+
+    def _cached(self, key, compute):
+        with self.lock:
+            if key in self.query_cache:
+                return self.query_cache[key]
+        result = compute()
+        with self.lock:
+            if len(self.query_cache) >= QUERY_CACHE_SIZE:
+                self.query_cache.pop(next(iter(self.query_cache)))
+            self.query_cache[key] = result
+        return result
+
+    def _event_positions(self, filters, candidates=None):
+        """Row positions (ascending datetime) matching metric_id/datetime/profile filters"""
+        lo, hi = 0, len(self.events)
+        metric_id = None
+        for op, field, value in filters:
+            if field == "metric_id" and op == "equals":
+                metric_id = value
+            elif field == "datetime":
+                ts = np.datetime64(parse_timestamp(value))
+                if op == "greater-or-equal":
+                    lo = max(lo, np.searchsorted(self.datetimes, ts, side="left"))
+                elif op == "greater-than":
+                    lo = max(lo, np.searchsorted(self.datetimes, ts, side="right"))
+                elif op == "less-than":
+                    hi = min(hi, np.searchsorted(self.datetimes, ts, side="left"))
+                elif op == "less-or-equal":
+                    hi = min(hi, np.searchsorted(self.datetimes, ts, side="right"))
+        if candidates is None:
+            positions = np.arange(lo, max(lo, hi))
+        else:
+            positions = candidates[(candidates >= lo) & (candidates < hi)]
+        if metric_id is not None:
+            positions = positions[self.events["metric_id"].to_numpy()[positions] == metric_id]
+        return positions
+
+    def _profile_positions(self, profile_id):
+        if self.profile_index is None:
+            with self.lock:
+                if self.profile_index is None:
+                    self.profile_index = {k: np.sort(v) for k, v in self.events.groupby("profile_id").indices.items()}
+        return self.profile_index.get(profile_id, np.array([], dtype=np.int64))
+
+    def serialize_events(self, positions):
+        page = self.events.iloc[positions]
+        stamps = page["datetime"].dt.strftime("%Y-%m-%dT%H:%M:%S+00:00").tolist()
+        present = [c for c in EVENT_PROPERTY_COLUMNS if c in page.columns]
+        columns = {c: page[c].tolist() for c in present}
+        data = []
+        for i, (event_id, metric_id, profile_id) in enumerate(
+                zip(page["event_id"], page["metric_id"], page["profile_id"])):
+            properties = {}
+            for column in present:
+                value = columns[column][i]
+                if value is not None and value == value:  # skip None/NaN
+                    properties[EVENT_PROPERTY_COLUMNS[column]] = value
+            items = self._items_for(event_id)
+            if items:
+                properties["Items"] = items
+            data.append({
+                "type": "event",
+                "id": event_id,
+                "attributes": {
+                    "datetime": stamps[i],
+                    # The pipelines read `properties`; the mock serves exactly that shape
+                    "properties": properties,
+                },
+                "relationships": {
+                    "metric": {"data": {"type": "metric", "id": metric_id}},
+                    "profile": {"data": {"type": "profile", "id": profile_id}},
+                },
+            })
+        return data
+
+    def page(self, base_url, path, params, items, total):
+        """Slice one page out of `items` (a sequence or positions) and build the JSON:API links"""
+        cursor = params.get("page[cursor]")
+        offset = decode_cursor(cursor) if cursor else 0
+        page_size = int(params.get("page[size]", self.page_size))
+        chunk = items[offset:offset + page_size]
+        next_link = None
+        if offset + page_size < total:
+            next_params = {k: v for k, v in params.items() if k != "page[cursor]"}
+            next_params["page[cursor]"] = encode_cursor(offset + page_size)
+            next_link = f"{base_url}{path}?{urlencode(next_params)}"
+        return chunk, {"self": f"{base_url}{path}", "next": next_link, "prev": None}
+
+    # --- endpoints -----------------------------------------------------------------------------
+
+    def get_metrics(self, base_url, path, params):
+        chunk, links = self.page(base_url, path, params, self.metrics, len(self.metrics))
+        return {"data": chunk, "links": links}
+
+    def _filter_updated(self, records, filters, field):
+        selected = records
+        for op, name, value in filters:
+            if name != field:
+                continue
+            ts = parse_timestamp(value)
+            if op == "greater-or-equal":
+                selected = [r for r in selected if parse_timestamp(r["attributes"][field]) >= ts]
+            elif op == "less-than":
+                selected = [r for r in selected if parse_timestamp(r["attributes"][field]) < ts]
+        return selected
+
+    def get_campaigns(self, base_url, path, params):
+        filters = parse_filter(params.get("filter"))
+        selected = self._cached(("campaigns", params.get("filter")),
+                                lambda: self._filter_updated(self.campaigns, filters, "updated_at"))
+        chunk, links = self.page(base_url, path, params, selected, len(selected))
+        return {"data": chunk, "links": links}
+
+    def get_flows(self, base_url, path, params):
+        filters = parse_filter(params.get("filter"))
+        selected = self._cached(("flows", params.get("filter"), params.get("sort")), lambda: sorted(
+            self._filter_updated(self.flows, filters, "updated"),
+            key=lambda f: f["attributes"]["updated"], reverse=params.get("sort") == "-updated"))
+        chunk, links = self.page(base_url, path, params, selected, len(selected))
+        return {"data": chunk, "links": links}
+
+    def get_events(self, base_url, path, params):
+        filters = parse_filter(params.get("filter"))
+        positions = self._cached(("events", params.get("filter")), lambda: self._event_positions(filters))
+        chunk, links = self.page(base_url, path, params, positions, len(positions))
+        return {"data": self.serialize_events(chunk), "links": links}
+
+    def get_profile_events(self, base_url, path, params, profile_id):
+        filters = parse_filter(params.get("filter"))
+        positions = self._event_positions(filters, self._profile_positions(profile_id))
+        chunk, links = self.page(base_url, path, params, positions, len(positions))
+        return {"data": self.serialize_events(chunk), "links": links}
+
+    def post_metric_aggregates(self, body):
+        attributes = body["data"]["attributes"]
+        filters = [f for expr in attributes.get("filter", []) for f in parse_filter(expr)]
+        filters.append(("equals", "metric_id", attributes["metric_id"]))
+        positions = self._event_positions(filters)
+        frame = self.events.iloc[positions]
+
+        # One bucket per interval period between the datetime filters, like Klaviyo's `dates` array
+        period = INTERVAL_PERIODS[attributes.get("interval", "day")]
+        bounds = {op: parse_timestamp(v) for op, f, v in filters if f == "datetime"}
+        start = bounds.get("greater-or-equal", frame["datetime"].min() if len(frame) else pd.Timestamp("1970-01-01"))
+        end = bounds.get("less-than", frame["datetime"].max() + pd.Timedelta(1, "ns") if len(frame) else start)
+        buckets = pd.period_range(start, max(end - pd.Timedelta(1, "ns"), start), freq=period).start_time
+        bucket_index = np.searchsorted(buckets.to_numpy(), frame["datetime"].to_numpy(), side="right") - 1
+
+        dims = [AGGREGATE_DIMENSIONS[d] for d in attributes.get("by", [])]
+        grouped = frame.assign(_bucket=bucket_index)
+        for column in dims:
+            grouped[column] = grouped[column].fillna("") if column in grouped else ""
+        keys = dims + ["_bucket"]
+        measurements = attributes.get("measurements", ["count"])
+        agg = grouped.groupby(keys, dropna=False).agg(
+            sum_value=("value", "sum") if "value" in grouped else ("event_id", "size"),
+            count=("event_id", "size"),
+            unique=("profile_id", "nunique"),
+        )
+
+        data = []
+        combos = agg.reset_index().groupby(dims, dropna=False) if dims else [((), agg.reset_index())]
+        for dim_values, part in combos:
+            dim_values = dim_values if isinstance(dim_values, tuple) else (dim_values,)
+            series = {}
+            for measurement in measurements:
+                values = np.zeros(len(buckets))
+                values[part["_bucket"].to_numpy()] = part[measurement].to_numpy()
+                series[measurement] = [round(float(v), 2) for v in values]
+            data.append({"dimensions": [str(v) for v in dim_values], "measurements": series})
+        return {"data": {"type": "metric-aggregate", "id": "mock", "attributes": {
+            "dates": [b.isoformat() + "+00:00" for b in buckets],
+            "data": data,
+        }}}
+
+def make_handler(mock, api_prefix="/api"):
+    """Build a request handler class bound to one MockKlaviyo instance"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out as separate writes; with Nagle on, keep-alive clients stall ~40ms per request
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, endpoint, status, payload, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/vnd.api+json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+            mock.record(endpoint, status, len(body))
+
+        def error(self, endpoint, status, detail, headers=None):
+            self.send_json(endpoint, status, {"errors": [{"status": status, "detail": detail}]}, headers)
+
+        def dispatch(self, method):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if url.path == "/__stats":
+                return self.send_json("__stats", 200, mock.stats_snapshot())
+            if url.path == "/__reset" and method == "POST":
+                mock.reset_stats()
+                return self.send_json("__reset", 200, {"ok": True})
+            if not url.path.startswith(api_prefix):
+                return self.error("unknown", 404, f"Unknown path {url.path}")
+
+            route = url.path[len(api_prefix):].strip("/")
+            endpoint = "profiles/{id}/events" if re.fullmatch(r"profiles/[^/]+/events", route) else route
+            auth = self.headers.get("Authorization", "")
+            if not auth.startswith("Klaviyo-API-Key "):
+                return self.error(endpoint, 401, "Missing or malformed Authorization header")
+
+            rejection = mock.admit(auth)
+            if rejection is not None:
+                status, headers = rejection
+                return self.error(endpoint, status, "Injected failure" if status != 429 else "Throttled", headers)
+            mock.delay()
+
+            base_url = f"http://{self.headers.get('Host')}{api_prefix}"
+            path = f"/{route}"
+            try:
+                if method == "GET" and route == "metrics":
+                    payload = mock.get_metrics(base_url, path, params)
+                elif method == "GET" and route == "campaigns":
+                    payload = mock.get_campaigns(base_url, path, params)
+                elif method == "GET" and route == "flows":
+                    payload = mock.get_flows(base_url, path, params)
+                elif method == "GET" and route == "events":
+                    payload = mock.get_events(base_url, path, params)
+                elif method == "GET" and endpoint == "profiles/{id}/events":
+                    payload = mock.get_profile_events(base_url, path, params, route.split("/")[1])
+                elif method == "POST" and route == "metric-aggregates":
+                    length = int(self.headers.get("Content-Length", 0))
+                    payload = mock.post_metric_aggregates(json.loads(self.rfile.read(length)))
+                else:
+                    return self.error(endpoint, 404, f"No mock for {method} {url.path}")
+            except (KeyError, ValueError) as e:
+                return self.error(endpoint, 400, f"Bad request: {str(e)}")
+            self.send_json(endpoint, 200, payload)
+
+        def do_GET(self):
+            self.dispatch("GET")
+
+        def do_POST(self):
+            self.dispatch("POST")
+
+    return Handler
+
+def start_mock_server(mock, host="127.0.0.1", port=0):
+    """Serve a MockKlaviyo in a background thread; returns (server, base API URL)"""
+    server = ThreadingHTTPServer((host, port), make_handler(mock))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/api"
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Klaviyo API used by the analyses")
+    parser.add_argument("--fixtures", help="Fixture directory from synthetic.py (default: a small generated account)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--page-size", type=int, default=200, help="Records per page (default: 200)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Added latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Uniform +/- jitter on the latency")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Requests/second per API key before 429 (0 = off)")
+    parser.add_argument("--burst", type=float, help="Token bucket size for --rate-limit (default: the rate)")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Probability of a random 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of an injected error response")
+    parser.add_argument("--error-status", type=int, default=500, help="Status code of injected errors")
+    parser.add_argument("--seed", type=int, help="Seed for jitter and fault injection")
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.fixtures) if args.fixtures else generate_dataset(
+        orders=500, campaigns=5, flows=2, products=20, days=120, recipients_per_campaign=100, flow_touches=200)
+    mock = MockKlaviyo(dataset, page_size=args.page_size, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                       rate_limit=args.rate_limit, burst=args.burst, retry_after=args.retry_after,
+                       throttle_rate=args.throttle_rate, error_rate=args.error_rate,
+                       error_status=args.error_status, seed=args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(mock))
+    print(f"Mock Klaviyo API with {len(mock.events)} events on http://{args.host}:{args.port}/api")
+    print(f"Run the analyses with KLAVIYO_API_URL=http://{args.host}:{args.port}/api; stats at /__stats")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
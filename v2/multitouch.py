@@ -0,0 +1,195 @@
+import os
+import argparse
+from datetime import timedelta
+from functools import partial
+from dotenv import load_dotenv
+import numpy as np
+import pandas as pd
+from daterange import add_date_range_args, date_range_from_args
+from event_cache import fetch_events
+from instrumentation import PROFILE_FILE, report_run, stage, timed_stage
+from klaviyo_client import account_key, fetch_metric_ids, make_klaviyo_request
+from tables import acquisition_source, order_frame
+from writers import result_paths, run_dir, update_manifest, write_results
+
+load_dotenv()
+
+MULTI_TOUCH_STEM = "multi_touch_attribution"
+
+# Touch metric -> touch type
+TOUCH_METRICS = {
+    "Received Email": "received",
+    "Opened Email": "opened",
+    "Clicked Email": "clicked",
+}
+
+# Touches up to this many days before an order share its revenue
+LOOKBACK_DAYS = float(os.getenv("KLAVIYO_ATTRIBUTION_LOOKBACK_DAYS", "5"))
+
+# In the time-decay model a touch this many days older than another gets half its weight
+HALF_LIFE_DAYS = 1.0
+
+# Position-based (U-shaped) model: share of the first and of the last touch; the middle touches split the rest
+POSITION_ENDS = 0.4
+
+# "property" is the single-touch attribution stored on the order ($attributed_message, else $attributed_flow)
+MODELS = ("property", "first_touch", "last_touch", "linear", "time_decay", "position_based")
+
+# Orders joined with their touches per step, which bounds the memory of the order x touch pairs
+ORDER_CHUNK = 200000
+
+UNATTRIBUTED = "unattributed"
+
+def touch_frame(events_by_type):
+    """Email touches, sorted by time, from {touch type: events} of the Received/Opened/Clicked Email metrics
+
+    A touch belongs to its campaign ($message) or else its flow ($flow), as order attribution does.
+    """
+    rows = [(event["relationships"]["profile"]["data"]["id"], event["attributes"]["datetime"],
+             properties.get("$message") or None, properties.get("$flow") or None, touch)
+            for touch, events in events_by_type.items() for event in events
+            for properties in (event["attributes"]["properties"],)]
+    frame = pd.DataFrame(rows, columns=["profile_id", "datetime", "campaign_id", "flow_id", "touch"])
+    frame["datetime"] = pd.to_datetime(frame["datetime"], utc=True, format="ISO8601").dt.tz_localize(None)
+    frame["source_id"] = acquisition_source(frame)
+    return frame.sort_values("datetime", kind="stable", ignore_index=True)
+
+def _pair_weights(offsets, counts, age_days, half_life_days):
+    """Weights of each order x touch pair under every touch model
+
+    `offsets` is each pair's position among its order's touches (oldest first) and `counts` the order's number of
+    touches, repeated per pair. Weights sum to 1 per order.
+    """
+    first, last = offsets == 0, offsets == counts - 1
+    decay = np.exp2(-age_days / half_life_days)
+    order_starts = np.flatnonzero(first)
+    decay_totals = np.repeat(np.add.reduceat(decay, order_starts), counts[order_starts]) if len(decay) else decay
+    middle = (1 - 2 * POSITION_ENDS) / np.maximum(counts - 2, 1)
+    position = np.where(counts == 1, 1.0, np.where(counts == 2, 0.5, np.where(first | last, POSITION_ENDS, middle)))
+    return {
+        "first_touch": first.astype(float),
+        "last_touch": last.astype(float),
+        "linear": 1.0 / counts,
+        "time_decay": decay / decay_totals,
+        "position_based": position,
+    }
+
+def multi_touch_attribution(orders, touches, lookback_days=LOOKBACK_DAYS, half_life_days=HALF_LIFE_DAYS):
+    """Revenue and conversions per campaign/flow under every model in MODELS
+
+    Each order is joined with its profile's touches in the `lookback_days` before it (inclusive of the order time)
+    by binary search over touches sorted by (profile, time), the sorted-array form of an as-of join. Orders
+    without a touch go to "unattributed" in every touch model. Returns a long frame: source_id, model, conversions
+    (fractional orders) and revenue.
+    """
+    columns = ["source_id", "model", "conversions", "revenue"]
+    if orders.empty:
+        return pd.DataFrame(columns=columns)
+    profile_codes, profiles = pd.factorize(pd.concat([orders["profile_id"], touches["profile_id"]], ignore_index=True))
+    order_profiles, touch_profiles = profile_codes[:len(orders)], profile_codes[len(orders):]
+    source_codes, sources = pd.factorize(pd.concat([touches["source_id"], pd.Series([UNATTRIBUTED])],
+                                                   ignore_index=True))
+    unattributed = source_codes[-1]
+    source_codes = source_codes[:-1]
+
+    # (profile, seconds) packed into one sortable integer
+    epoch = min(orders["datetime"].min(), touches["datetime"].min()) if len(touches) else orders["datetime"].min()
+    order_seconds = ((orders["datetime"] - epoch) // pd.Timedelta(seconds=1)).to_numpy(np.int64)
+    touch_seconds = ((touches["datetime"] - epoch) // pd.Timedelta(seconds=1)).to_numpy(np.int64)
+    touch_keys = (touch_profiles.astype(np.int64) << 32) | touch_seconds
+    by_key = np.argsort(touch_keys, kind="stable")
+    touch_keys, touch_seconds, source_codes = touch_keys[by_key], touch_seconds[by_key], source_codes[by_key]
+    order_keys = (order_profiles.astype(np.int64) << 32) | order_seconds
+    lookback = int(lookback_days * 86400)
+    hi = np.searchsorted(touch_keys, order_keys, side="right")
+    lo = np.searchsorted(touch_keys, order_keys - np.minimum(order_seconds, lookback), side="left")
+    counts = hi - lo
+    values = orders["value"].to_numpy(float)
+
+    models = MODELS[1:]
+    revenue = {model: np.zeros(len(sources)) for model in models}
+    conversions = {model: np.zeros(len(sources)) for model in models}
+    untouched = counts == 0
+    for model in models:
+        revenue[model][unattributed] += values[untouched].sum()
+        conversions[model][unattributed] += untouched.sum()
+
+    for start in range(0, len(orders), ORDER_CHUNK):
+        chunk_counts = counts[start:start + ORDER_CHUNK]
+        touched = np.flatnonzero(chunk_counts) + start
+        if not len(touched):
+            continue
+        touched_counts = counts[touched]
+        pair_orders = np.repeat(touched, touched_counts)
+        pair_counts = np.repeat(touched_counts, touched_counts)
+        # Position of each pair within its order's run of touches
+        run_starts = np.cumsum(touched_counts) - touched_counts
+        offsets = np.arange(len(pair_orders)) - np.repeat(run_starts, touched_counts)
+        pair_touches = lo[pair_orders] + offsets
+        age_days = (order_seconds[pair_orders] - touch_seconds[pair_touches]) / 86400
+        pair_sources = source_codes[pair_touches]
+        for model, weights in _pair_weights(offsets, pair_counts, age_days, half_life_days).items():
+            revenue[model] += np.bincount(pair_sources, weights=weights * values[pair_orders], minlength=len(sources))
+            conversions[model] += np.bincount(pair_sources, weights=weights, minlength=len(sources))
+
+    frames = [pd.DataFrame({"source_id": sources, "model": model, "conversions": conversions[model],
+                            "revenue": revenue[model]}) for model in models]
+    # The stored single-touch attribution, for comparison
+    stored = orders.assign(source_id=acquisition_source(orders)).groupby("source_id")["value"].agg(["size", "sum"])
+    frames.insert(0, pd.DataFrame({"source_id": stored.index.astype(object), "model": "property",
+                                   "conversions": stored["size"].to_numpy(float), "revenue": stored["sum"].to_numpy()}))
+    table = pd.concat(frames, ignore_index=True)
+    table = table[(table["conversions"] > 0) | (table["revenue"] != 0)]
+    return table.sort_values(["model", "revenue"], ascending=[True, False], ignore_index=True)[columns]
+
+def model_comparison(table):
+    """Revenue per campaign/flow with one column per model"""
+    return table.pivot(index="source_id", columns="model", values="revenue").reindex(columns=list(MODELS)).fillna(0.0)
+
+@timed_stage("aggregate")
+def get_multi_touch_attribution(api_key, date_range, touch_types=tuple(TOUCH_METRICS.values()),
+                                lookback_days=LOOKBACK_DAYS, half_life_days=HALF_LIFE_DAYS):
+    """Fetch orders and touches (through the event cache) and run every attribution model"""
+    metric_ids = fetch_metric_ids(api_key, {"Placed Order", *TOUCH_METRICS})
+    if "Placed Order" not in metric_ids:
+        print("No Placed Order metric found")
+        return None
+    request = partial(make_klaviyo_request, api_key=api_key)
+    orders = order_frame(fetch_events(request, api_key, metric_ids["Placed Order"], date_range))
+    # Touches reach back one lookback window before the first order
+    touch_range = (date_range[0] - timedelta(days=lookback_days), date_range[1])
+    events_by_type = {touch: fetch_events(request, api_key, metric_ids[name], touch_range)
+                      for name, touch in TOUCH_METRICS.items() if touch in touch_types and name in metric_ids}
+    with stage("multi_touch"):
+        return multi_touch_attribution(orders, touch_frame(events_by_type), lookback_days, half_life_days)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare single- and multi-touch attribution models")
+    add_date_range_args(parser)
+    parser.add_argument("--touches", nargs="+", choices=list(TOUCH_METRICS.values()),
+                        default=list(TOUCH_METRICS.values()), help="Email events that count as touches (default: all)")
+    parser.add_argument("--lookback-days", type=float, default=LOOKBACK_DAYS,
+                        help=f"Days before an order that touches count (default: {LOOKBACK_DAYS:g})")
+    parser.add_argument("--half-life-days", type=float, default=HALF_LIFE_DAYS,
+                        help=f"Half-life of the time-decay model (default: {HALF_LIFE_DAYS:g})")
+    args = parser.parse_args()
+
+    api_key = os.getenv("KLAVIYO_API_KEY")
+    if not api_key:
+        raise ValueError("No API key found. Please create a .env file with your KLAVIYO_API_KEY")
+    table = get_multi_touch_attribution(api_key, date_range_from_args(args), args.touches, args.lookback_days,
+                                        args.half_life_days)
+    if table is None or table.empty:
+        print("No data retrieved - no orders in the window")
+    else:
+        write_results(table, MULTI_TOUCH_STEM)
+        update_manifest(account=account_key(api_key))
+        print(f"\nAttribution comparison complete! Results saved to {run_dir()}:")
+        for path in result_paths(MULTI_TOUCH_STEM):
+            print(f"- {path}")
+        comparison = model_comparison(table)
+        print(comparison.loc[comparison.sum(axis=1).sort_values(ascending=False).index].head(20).round(2).to_string())
+    report_run(os.path.join(run_dir(), PROFILE_FILE))
+
+if __name__ == "__main__":
+    main()
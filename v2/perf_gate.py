@@ -0,0 +1,138 @@
+import sys
+import copy
+import json
+import argparse
+from benchmark import MAX_PROFILE_LOOKUPS, BENCH_FIXTURES_DIR, run_benchmarks
+
+BASELINE_FILE = "benchmark_baseline.json"
+
+# Allowed growth over the baseline; time and memory are relative, request counts are absolute extra calls.
+# The floors are the smallest absolute growth that counts, so short stages do not fail on run-to-run noise
+# (sub-second stages vary by a few tenths of a second between identical runs).
+DEFAULT_TOLERANCES = {
+    "time": 0.25,
+    "time_floor_seconds": 0.35,
+    "memory": 0.25,
+    "memory_floor_bytes": 1024 * 1024,
+    "requests": 0,
+}
+
+def stage_tolerances(tolerances, stage):
+    """Tolerances for one stage: defaults, then the file's global values, then its per-stage overrides"""
+    merged = dict(DEFAULT_TOLERANCES)
+    merged.update({k: v for k, v in tolerances.items() if k != "stages"})
+    merged.update(tolerances.get("stages", {}).get(stage, {}))
+    return merged
+
+def _key(record):
+    return record["pipeline"], record["orders"], record["stage"]
+
+def _pct(old, new):
+    return f"{(new - old) / old:+.0%}" if old else "new"
+
+def compare(baseline, current, tolerances):
+    """Return (regressions, notes) as lists of readable lines, comparing current results with the baseline"""
+    regressions, notes = [], []
+    current_by_key = {_key(r): r for r in current["results"]}
+    base_measure = baseline.get("config", {}).get("memory_measure")
+    new_measure = current.get("config", {}).get("memory_measure")
+    compare_memory = base_measure is not None and base_measure == new_measure
+    if not compare_memory and new_measure is not None:
+        regressions.append(f"peak memory was measured as {base_measure or 'an older measure'} in the baseline and as "
+                           f"{new_measure} now; refresh it with --update-baseline")
+    baseline_keys = {_key(r) for r in baseline["results"]}
+    # A stage the baseline does not have cannot be checked, so it fails until the baseline is refreshed
+    for new in current["results"]:
+        if _key(new) not in baseline_keys:
+            pipeline, orders, stage = _key(new)
+            regressions.append(f"{pipeline} {orders:,} {stage}: not in the baseline ({new['status']}); "
+                               f"refresh it with --update-baseline")
+    for base in baseline["results"]:
+        pipeline, orders, stage = _key(base)
+        label = f"{pipeline} {orders:,} {stage}"
+        new = current_by_key.get(_key(base))
+        if new is None:
+            regressions.append(f"{label}: not run")
+            continue
+        if base["status"] != new["status"]:
+            # A stage that stopped running ok is broken, however fast it is; one that started is an improvement
+            (notes if new["status"] == "ok" else regressions).append(f"{label}: {base['status']} -> {new['status']}")
+        if base["status"] != "ok" or new["status"] != "ok":
+            continue
+        tol = stage_tolerances(tolerances, stage)
+
+        old_t, new_t = base["wall_seconds"], new["wall_seconds"]
+        if new_t > old_t * (1 + tol["time"]) and new_t - old_t > tol["time_floor_seconds"]:
+            regressions.append(f"{label}: wall time {old_t:.3f}s -> {new_t:.3f}s "
+                               f"({_pct(old_t, new_t)}, limit +{tol['time']:.0%})")
+
+        old_m, new_m = base.get("peak_memory_bytes"), new.get("peak_memory_bytes")
+        if compare_memory and old_m is not None and new_m is not None and new_m > old_m * (1 + tol["memory"]) \
+                and new_m - old_m > tol["memory_floor_bytes"]:
+            regressions.append(f"{label}: peak memory {old_m / 2**20:.1f} MiB -> {new_m / 2**20:.1f} MiB "
+                               f"({_pct(old_m, new_m)}, limit +{tol['memory']:.0%})")
+
+        old_r, new_r = base["request_count"], new["request_count"]
+        if new_r - old_r > tol["requests"]:
+            endpoints = sorted(set(base["requests"]) | set(new["requests"]))
+            changes = ", ".join(f"{e} {base['requests'].get(e, 0):,} -> {new['requests'].get(e, 0):,}"
+                                for e in endpoints if base["requests"].get(e, 0) != new["requests"].get(e, 0))
+            regressions.append(f"{label}: requests {old_r:,} -> {new_r:,} ({changes})")
+        elif new_r < old_r:
+            notes.append(f"{label}: requests {old_r:,} -> {new_r:,}")
+    return regressions, notes
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmarks and fail if they regress against the baseline")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help=f"Baseline results (default: {BASELINE_FILE})")
+    parser.add_argument("--results", help="Compare an existing benchmark.py output instead of running the benchmarks")
+    parser.add_argument("--fixtures-dir", default=BENCH_FIXTURES_DIR)
+    parser.add_argument("--time-tolerance", type=float, help="Allowed relative wall-time growth (default: 0.25)")
+    parser.add_argument("--memory-tolerance", type=float, help="Allowed relative peak-memory growth (default: 0.25)")
+    parser.add_argument("--request-tolerance", type=int, help="Allowed extra requests per stage (default: 0)")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Write the new results as the baseline, keeping its tolerances")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    # Command-line overrides apply to this run only; --update-baseline keeps the committed tolerances
+    tolerances = copy.deepcopy(baseline.get("tolerances", {}))
+    for name, value in (("time", args.time_tolerance), ("memory", args.memory_tolerance),
+                        ("requests", args.request_tolerance)):
+        if value is not None:
+            tolerances[name] = value
+            for overrides in tolerances.get("stages", {}).values():
+                overrides.pop(name, None)
+
+    if args.results:
+        with open(args.results) as f:
+            current = json.load(f)
+    else:
+        config = baseline["config"]
+        current = run_benchmarks(config["sizes"], config["pipelines"], args.fixtures_dir, config["page_size"],
+                                 config["latency_ms"], config["track_memory"],
+                                 config.get("max_lookups", MAX_PROFILE_LOOKUPS))
+
+    if args.update_baseline:
+        current.pop("memory_profiles", None)
+        current["tolerances"] = baseline.get("tolerances", {})
+        with open(args.baseline, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"\nBaseline updated: {args.baseline}")
+        return
+
+    regressions, notes = compare(baseline, current, tolerances)
+    if notes:
+        print("\nChanges within tolerance:")
+        for line in notes:
+            print(f"  {line}")
+    if regressions:
+        print(f"\n{len(regressions)} performance regression(s) against {args.baseline}:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"\nNo performance regressions against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
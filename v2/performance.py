@@ -0,0 +1,126 @@
+import os
+import argparse
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import numpy as np
+from daterange import add_date_range_args, date_range_from_args, resolve_date_range, to_klaviyo_datetime
+from instrumentation import PROFILE_FILE, report_run, stage, timed_stage
+from klaviyo_client import account_key, fetch_metric_ids, make_klaviyo_request
+from tables import aggregate_totals, campaign_dimension
+from writers import result_paths, run_dir, update_manifest, write_results
+
+load_dotenv()
+
+PERFORMANCE_STEM = "campaign_performance"
+
+# Metric -> ("by" dimensions, {measurement: report column}); each metric is one metric-aggregates query
+PERFORMANCE_METRICS = {
+    "Received Email": (["$message", "$flow"], {"count": "recipients"}),
+    "Opened Email": (["$message", "$flow"], {"unique": "opens"}),
+    "Clicked Email": (["$message", "$flow"], {"unique": "clicks"}),
+    "Placed Order": (["$attributed_message", "$attributed_flow"], {"unique": "conversions", "sum_value": "revenue"}),
+}
+
+# Unique counts are per interval and the report sums the intervals, so a wide interval keeps a profile that opens
+# on several days from counting more than once
+AGGREGATE_INTERVAL = "month"
+
+# metric-aggregates queries in flight at once; every one still takes a token from the account's rate limiter
+AGGREGATE_WORKERS = 4
+
+COUNT_COLUMNS = ["recipients", "opens", "clicks", "conversions", "revenue"]
+
+def aggregate_query(metric_id, by, measurements, date_range=None):
+    """metric-aggregates request body for one metric over the date range"""
+    start, end = resolve_date_range(date_range)
+    return {"data": {"type": "metric-aggregate", "attributes": {
+        "measurements": list(measurements),
+        "interval": AGGREGATE_INTERVAL,
+        "filter": [f"greater-or-equal(datetime,{to_klaviyo_datetime(start)})",
+                   f"less-than(datetime,{to_klaviyo_datetime(end)})"],
+        "by": list(by),
+        "metric_id": metric_id,
+    }}}
+
+@timed_stage("fetch")
+def fetch_metric_aggregates(api_key, queries):
+    """Run metric-aggregates requests concurrently; {name: request body} -> {name: series (None if it failed)}
+
+    The requests share the account's rate limiter, so the concurrency only overlaps their latency.
+    """
+    def run(body):
+        response = make_klaviyo_request("metric-aggregates", api_key, method="POST", json_body=body)
+        return response["data"]["attributes"]["data"] if response and "data" in response else None
+
+    with ThreadPoolExecutor(max_workers=AGGREGATE_WORKERS) as executor:
+        # Each worker runs in a copy of this context so metric labels (account, feature) carry over
+        futures = {name: executor.submit(contextvars.copy_context().run, run, body) for name, body in queries.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+def campaign_performance(campaigns, flows, aggregates):
+    """One row per campaign and flow: recipients, unique opens and clicks, conversions, revenue and their rates
+
+    `aggregates` maps metric names in PERFORMANCE_METRICS to their metric-aggregates series; missing metrics leave
+    their columns at zero. Rates are fractions of recipients and NaN for sources without recipients.
+    """
+    columns = {}
+    for name, (_, measurements) in PERFORMANCE_METRICS.items():
+        for measurement, column in measurements.items():
+            columns[column] = aggregate_totals(aggregates.get(name) or [], measurement)
+    ids = [source_id for totals in columns.values() for source_id in totals]
+    table = campaign_dimension(campaigns, flows, dict.fromkeys(ids))
+    for column in COUNT_COLUMNS:
+        table[column] = table["campaign_id"].map(columns.get(column, {})).fillna(0.0).astype(float)
+    recipients = table["recipients"].where(table["recipients"] > 0, np.nan)
+    table["open_rate"] = table["opens"] / recipients
+    table["click_rate"] = table["clicks"] / recipients
+    table["conversion_rate"] = table["conversions"] / recipients
+    table["revenue_per_recipient"] = table["revenue"] / recipients
+    return table.sort_values(["revenue", "recipients"], ascending=False, ignore_index=True)
+
+@timed_stage("aggregate")
+def get_campaign_performance(api_key, date_range=None):
+    """Resolve the metrics in one /metrics request, fetch their aggregates concurrently and join them"""
+    # Imported here, as in store.py: app.py is the dashboard module
+    from app import get_campaigns_and_flows
+    metric_ids = fetch_metric_ids(api_key, set(PERFORMANCE_METRICS))
+    if not metric_ids:
+        print("None of the email or order metrics were found")
+        return None
+    missing = [name for name in PERFORMANCE_METRICS if name not in metric_ids]
+    if missing:
+        print(f"Metrics not found, their columns stay zero: {', '.join(missing)}")
+    queries = {name: aggregate_query(metric_ids[name], by, measurements, date_range)
+               for name, (by, measurements) in PERFORMANCE_METRICS.items() if name in metric_ids}
+    aggregates = fetch_metric_aggregates(api_key, queries)
+    failed = [name for name, series in aggregates.items() if series is None]
+    if failed:
+        raise RuntimeError(f"metric-aggregates failed for {', '.join(failed)}; the report would undercount")
+    campaigns, flows = get_campaigns_and_flows(api_key, date_range)
+    with stage("performance"):
+        return campaign_performance(campaigns, flows, aggregates)
+
+def main():
+    parser = argparse.ArgumentParser(description="Recipients, opens, clicks, conversions and revenue per recipient "
+                                                 "for each campaign and flow")
+    add_date_range_args(parser)
+    args = parser.parse_args()
+
+    api_key = os.getenv("KLAVIYO_API_KEY")
+    if not api_key:
+        raise ValueError("No API key found. Please create a .env file with your KLAVIYO_API_KEY")
+    table = get_campaign_performance(api_key, date_range_from_args(args))
+    if table is None or table.empty:
+        print("No data retrieved - no campaigns, flows or events in the window")
+    else:
+        write_results(table, PERFORMANCE_STEM)
+        update_manifest(account=account_key(api_key))
+        print(f"\nCampaign performance complete! Results saved to {run_dir()}:")
+        for path in result_paths(PERFORMANCE_STEM):
+            print(f"- {path}")
+        print(table.head(20).drop(columns=["send_time"]).round(4).to_string(index=False))
+    report_run(os.path.join(run_dir(), PROFILE_FILE))
+
+if __name__ == "__main__":
+    main()
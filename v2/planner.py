@@ -0,0 +1,282 @@
+import os
+import json
+import math
+import time
+import argparse
+from datetime import timedelta
+from dotenv import load_dotenv
+import klaviyo_client
+from klaviyo_client import make_klaviyo_request
+from daterange import add_date_range_args, date_range_from_args, parse_event_datetime, to_klaviyo_datetime
+from event_cache import cache_gaps, next_page_cursor
+from batch import load_accounts
+from precompute import FEATURES
+
+load_dotenv()
+
+PLAN_FILE = "request_plan.json"
+
+# raw_events: crawl the whole window; incremental: only what the event cache lacks; aggregates: server-side sums
+STRATEGIES = ("raw_events", "incremental", "aggregates")
+
+def _timed_request(latencies, kind, endpoint, api_key, **kwargs):
+    started = time.monotonic()
+    response = make_klaviyo_request(endpoint, api_key, **kwargs)
+    latencies.setdefault(kind, []).append(time.monotonic() - started)
+    return response
+
+def _count_pages(latencies, endpoint, api_key, params):
+    """Page through a list endpoint; returns (pages, items)"""
+    pages = items = 0
+    params = dict(params)
+    while True:
+        response = _timed_request(latencies, "list", endpoint, api_key, params=params)
+        if response is None or "data" not in response:
+            break
+        pages += 1
+        items += len(response["data"])
+        cursor = next_page_cursor(response)
+        if cursor is None:
+            break
+        params["page[cursor]"] = cursor
+    return pages, items
+
+def _events_in(ranges, days, counts):
+    """Events falling in `ranges`, from daily counts, prorating days a range only partly covers"""
+    total = 0.0
+    for day, count in zip(days, counts):
+        day_end = day + timedelta(days=1)
+        for range_start, range_end in ranges:
+            overlap = (min(day_end, range_end) - max(day, range_start)).total_seconds()
+            if overlap > 0:
+                total += count * overlap / 86400
+    return round(total)
+
+def probe_account(api_key, date_range):
+    """Cheap requests that size a run: list pages, daily order counts, one events page and one profile lookup
+
+    The first events page also gives the page size and a sample of profiles per order.
+    """
+    start, end = date_range
+    latencies = {}
+    metrics = _timed_request(latencies, "list", "metrics", api_key)
+    metric_id = next((m["id"] for m in (metrics or {}).get("data", []) if m["attributes"]["name"] == "Placed Order"),
+                     None)
+    if not metric_id:
+        return {"metric_id": None, "probe_requests": 1}
+
+    start_date, end_date = to_klaviyo_datetime(start), to_klaviyo_datetime(end)
+    campaign_pages, campaigns = _count_pages(latencies, "campaigns", api_key, {
+        "filter": f"equals(messages.channel,'email'),greater-or-equal(updated_at,{start_date})"})
+    flow_pages, flows = _count_pages(latencies, "flows", api_key, {
+        "filter": f"greater-or-equal(updated,{start_date})", "sort": "updated"})
+
+    json_body = {"data": {"type": "metric-aggregate", "attributes": {
+        "measurements": ["count"],
+        "interval": "day",
+        "filter": [f"greater-or-equal(datetime,{start_date})", f"less-than(datetime,{end_date})"],
+        "metric_id": metric_id,
+    }}}
+    aggregate = _timed_request(latencies, "aggregate", "metric-aggregates", api_key, method="POST", json_body=json_body)
+    attributes = aggregate["data"]["attributes"] if aggregate and "data" in aggregate else {"dates": [], "data": []}
+    days = [parse_event_datetime(d) for d in attributes["dates"]]
+    counts = [sum(series["measurements"]["count"][i] for series in attributes["data"]) for i in range(len(days))]
+    total_events = round(sum(counts))
+
+    events_filter = (f'equals(metric_id,"{metric_id}"),'
+                     f'greater-or-equal(datetime,{start_date}),less-than(datetime,{end_date})')
+    first_page = _timed_request(latencies, "events", "events", api_key, params={"filter": events_filter})
+    first_events = first_page["data"] if first_page and "data" in first_page else []
+    # A single page holds everything; otherwise its length is the server's page size
+    if first_page and next_page_cursor(first_page) is not None:
+        events_per_page = len(first_events)
+    else:
+        events_per_page = max(total_events, len(first_events), 1)
+    # The revenue split looks up each ordering profile once. The first page spans a short stretch of the window,
+    # where fewer customers have ordered again, so its profiles per order lean high rather than low
+    sampled_profiles = len({e["relationships"]["profile"]["data"]["id"] for e in first_events})
+    profiles = min(total_events, math.ceil(total_events * sampled_profiles / len(first_events))) if first_events else 0
+
+    if first_events:
+        event = first_events[0]
+        profile_id = event["relationships"]["profile"]["data"]["id"]
+        _timed_request(latencies, "lookup", f"profiles/{profile_id}/events", api_key, params={
+            "filter": f'equals(metric_id,"{metric_id}"),less-than(datetime,{event["attributes"]["datetime"]})'})
+
+    gaps = cache_gaps(api_key, metric_id, date_range)
+    mean_list = sum(latencies["list"]) / len(latencies["list"])
+    return {
+        "metric_id": metric_id,
+        "campaigns": campaigns,
+        "flows": flows,
+        "campaign_pages": campaign_pages,
+        "flow_pages": flow_pages,
+        "events": total_events,
+        "events_per_page": events_per_page,
+        "profiles": profiles,
+        "cache_gaps": [[gap_start.isoformat(), gap_end.isoformat()] for gap_start, gap_end in gaps],
+        "cache_gap_events": [_events_in([gap], days, counts) for gap in gaps],
+        # Kinds never probed (no events, so no lookup) fall back to the list latency
+        "latency_seconds": {kind: round(sum(latencies.get(kind, [])) / len(latencies[kind]), 4)
+                            if latencies.get(kind) else round(mean_list, 4)
+                            for kind in ("list", "aggregate", "events", "lookup")},
+        "probe_requests": sum(len(values) for values in latencies.values()),
+    }
+
+def estimate_time(requests, latency, rate=None, burst=None):
+    """Wall time of sequential requests through one account's token bucket; returns (wall, rate-limit wait)"""
+    rate = rate or klaviyo_client.MAX_REQUESTS_PER_SECOND
+    burst = burst or klaviyo_client.BURST
+    total = sum(requests.values())
+    if not total:
+        return 0.0, 0.0
+    busy = sum(count * latency[kind] for kind, count in requests.items())
+    # Past the burst, request i cannot start before (i - burst) / rate
+    throttled = max(total - burst, 0) / rate + busy / total
+    wall = max(busy, throttled)
+    return wall, wall - busy
+
+def _pages(events, per_page):
+    return max(1, math.ceil(events / per_page))
+
+def feature_requests(feature, strategy, probes):
+    """Requests by kind for one feature under one strategy, with whether the result matches a full crawl
+
+    Returns None when the strategy cannot produce the feature at all.
+    """
+    lists = 1 + (probes["campaign_pages"] + probes["flow_pages"] if feature != "revenue_share" else 0)
+    if strategy == "raw_events":
+        events_pages = _pages(probes["events"], probes["events_per_page"])
+    else:
+        events_pages = sum(_pages(n, probes["events_per_page"]) for n in probes["cache_gap_events"])
+
+    if strategy == "aggregates":
+        if feature == "revenue_attribution":
+            return {"requests": {"list": lists, "aggregate": 1}, "exact": False,
+                    "note": "totals per campaign and flow only; the new vs. recurring split needs per-profile lookups"}
+        if feature == "revenue_share":
+            return {"requests": {"list": lists, "aggregate": 1}, "exact": False,
+                    "note": "daily sums grouped by attributed message/flow; duplicate OrderIds are not removed"}
+        return None
+
+    requests = {"list": lists, "events": events_pages}
+    if feature == "revenue_attribution":
+        # get_revenue_data, then one prior-orders lookup per ordering profile
+        requests.update(aggregate=1, lookup=probes["profiles"])
+    return {"requests": requests, "exact": True, "note": ""}
+
+def plan_account(api_key, date_range, features=tuple(FEATURES), rate=None, burst=None):
+    """Probe one account and estimate every feature under every strategy"""
+    probes = probe_account(api_key, date_range)
+    plan = {"probes": probes, "features": {}}
+    if probes["metric_id"] is None:
+        plan["error"] = "No Placed Order metric found"
+        return plan
+
+    for feature in features:
+        strategies = {}
+        for strategy in STRATEGIES:
+            estimate = feature_requests(feature, strategy, probes)
+            if estimate is None:
+                continue
+            wall, wait = estimate_time(estimate["requests"], probes["latency_seconds"], rate, burst)
+            strategies[strategy] = {**estimate, "total_requests": sum(estimate["requests"].values()),
+                                    "rate_limit_wait_seconds": round(wait, 1),
+                                    "wall_seconds": round(wall, 1)}
+        exact = {name: s for name, s in strategies.items() if s["exact"]}
+        recommended = min(exact or strategies, key=lambda name: strategies[name]["wall_seconds"])
+        cheapest = min(strategies, key=lambda name: strategies[name]["wall_seconds"])
+        plan["features"][feature] = {"strategies": strategies, "recommended": recommended,
+                                     "cheapest": cheapest}
+
+    # A run fetches events once: the first feature fills the event cache and the others read it
+    run_requests, events_paid = {}, False
+    for feature, result in plan["features"].items():
+        requests = dict(result["strategies"][result["recommended"]]["requests"])
+        if "events" in requests:
+            if events_paid:
+                requests["events"] = 0
+            events_paid = True
+        for kind, count in requests.items():
+            run_requests[kind] = run_requests.get(kind, 0) + count
+    wall, wait = estimate_time(run_requests, probes["latency_seconds"], rate, burst)
+    plan["run"] = {"requests": run_requests, "total_requests": sum(run_requests.values()),
+                   "rate_limit_wait_seconds": round(wait, 1), "wall_seconds": round(wall, 1)}
+    return plan
+
+def schedule_batch(seconds_by_account, workers):
+    """Estimated batch wall time: longest accounts first, each onto the least loaded worker"""
+    loads = [0.0] * max(1, min(workers, len(seconds_by_account) or 1))
+    for seconds in sorted(seconds_by_account.values(), reverse=True):
+        loads[loads.index(min(loads))] += seconds
+    return max(loads)
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+
+def format_plan(name, plan):
+    """Plain-text table of one account's plan; the recommended strategy of each feature is starred"""
+    if "error" in plan:
+        return f"{name}: {plan['error']}"
+    probes = plan["probes"]
+    lines = [f"{name}: {probes['events']:,} orders from about {probes['profiles']:,} profiles, "
+             f"{probes['campaigns']:,} campaigns, {probes['flows']:,} flows, "
+             f"{probes['events_per_page']:,} events/page, {sum(probes['cache_gap_events']):,} orders not cached "
+             f"({probes['probe_requests']} probe requests)", "",
+             f"  {'feature':<22} {'strategy':<13} {'requests':>10} {'limiter wait':>13} {'wall time':>10}"]
+    for feature, result in plan["features"].items():
+        for strategy, s in result["strategies"].items():
+            mark = "*" if strategy == result["recommended"] else " "
+            lines.append(f"{mark} {feature:<22} {strategy:<13} {s['total_requests']:>10,} "
+                         f"{format_duration(s['rate_limit_wait_seconds']):>13} {format_duration(s['wall_seconds']):>10}"
+                         + (f"  ({s['note']})" if s["note"] else ""))
+    run = plan["run"]
+    lines += ["", f"  Recommended run: {run['total_requests']:,} requests, "
+                  f"{format_duration(run['rate_limit_wait_seconds'])} waiting on the rate limiter, "
+                  f"about {format_duration(run['wall_seconds'])}"]
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate API requests and run time before running the analyses")
+    add_date_range_args(parser)
+    parser.add_argument("--accounts", help="CSV or JSON accounts file as for batch.py (default: KLAVIYO_API_KEY)")
+    parser.add_argument("--features", nargs="+", choices=list(FEATURES), default=list(FEATURES),
+                        help="Analyses to plan (default: all)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Batch worker processes to schedule accounts on (default: number of CPUs)")
+    parser.add_argument("--output", default=PLAN_FILE, help=f"Plan JSON (default: {PLAN_FILE})")
+    args = parser.parse_args()
+
+    if args.accounts:
+        accounts = load_accounts(args.accounts)
+    else:
+        api_key = os.getenv("KLAVIYO_API_KEY")
+        if not api_key:
+            raise ValueError("No API key found. Please create a .env file with your KLAVIYO_API_KEY")
+        accounts = [{"name": "default", "api_key": api_key}]
+
+    date_range = date_range_from_args(args)
+    plans = {}
+    for account in accounts:
+        plans[account["name"]] = plan_account(account["api_key"], date_range, args.features)
+        print(format_plan(account["name"], plans[account["name"]]) + "\n")
+
+    seconds = {name: plan["run"]["wall_seconds"] for name, plan in plans.items() if "run" in plan}
+    batch_seconds = schedule_batch(seconds, args.workers)
+    if len(accounts) > 1:
+        print(f"Batch of {len(seconds)} accounts on {args.workers} workers: about {format_duration(batch_seconds)}")
+
+    with open(args.output, "w") as f:
+        json.dump({"date_range": [d.isoformat() for d in date_range], "features": args.features,
+                   "max_requests_per_second": klaviyo_client.MAX_REQUESTS_PER_SECOND, "burst": klaviyo_client.BURST,
+                   "workers": args.workers, "batch_wall_seconds": round(batch_seconds, 1), "accounts": plans},
+                  f, indent=2)
+    print(f"Plan saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import os
+import time
+import argparse
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from app import revenue_attribution_analysis, product_attribution_analysis, revenue_share_analysis
+from artifacts import ARTIFACTS_DIR, write_artifacts, prune_artifacts
+from daterange import add_date_range_args, date_range_from_args
+from instrumentation import format_report, run_profile, write_report
+from metrics import METRICS_PORT, metric_labels, start_metrics_server
+from store import STORE_PATH, sync_store
+from writers import new_run
+
+load_dotenv()
+
+# Artifact name -> analysis entry point
+FEATURES = {
+    "revenue_attribution": revenue_attribution_analysis,
+    "product_attribution": product_attribution_analysis,
+    "revenue_share": revenue_share_analysis,
+}
+
+def run_precompute(api_key, date_range, features=tuple(FEATURES), output_dir=ARTIFACTS_DIR, store_path=None):
+    """Run the selected analyses once and publish their results as a new artifact run
+
+    With `store_path`, the same window is also loaded into the SQLite store; its events come from the event cache.
+    """
+    run_profile.reset()
+    new_run()
+    frames = {}
+    for name in features:
+        print(f"Precomputing {name}...")
+        with metric_labels(feature=name):
+            frames[name] = FEATURES[name](api_key, date_range)
+        if frames[name] is None:
+            print(f"{name} failed; it will be missing from this run")
+    if store_path:
+        print(f"Loading {store_path}...")
+        sync_store(api_key, date_range, store_path)
+    if all(df is None for df in frames.values()):
+        print("All analyses failed - no artifacts written")
+        return None
+    run_dir = write_artifacts(frames, output_dir, api_key=api_key, date_range=date_range)
+    report = run_profile.report()
+    write_report(report, os.path.join(run_dir, "run_profile.json"))
+    print(format_report(report))
+    print(f"Artifacts written to {run_dir}")
+    return run_dir
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute dashboard results as Parquet artifacts")
+    add_date_range_args(parser)
+    parser.add_argument("--output-dir", default=ARTIFACTS_DIR, help=f"Artifact directory (default: {ARTIFACTS_DIR})")
+    parser.add_argument("--features", nargs="+", choices=list(FEATURES), default=list(FEATURES),
+                        help="Analyses to run (default: all)")
+    parser.add_argument("--every", type=float, metavar="MINUTES",
+                        help="Keep running and recompute every MINUTES (default: run once)")
+    parser.add_argument("--keep", type=int, default=10, help="Number of runs to keep (default: 10)")
+    parser.add_argument("--store", nargs="?", const=STORE_PATH,
+                        help=f"Also load each run into the SQLite store (default path: {STORE_PATH}; off if omitted)")
+    parser.add_argument("--metrics-port", type=int, nargs="?", const=METRICS_PORT,
+                        help=f"Serve live Prometheus metrics (default port: {METRICS_PORT}; off if omitted)")
+    args = parser.parse_args()
+
+    api_key = os.getenv("KLAVIYO_API_KEY")
+    if not api_key:
+        raise ValueError("No API key found. Please create a .env file with your KLAVIYO_API_KEY")
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.metrics_port is not None:
+        start_metrics_server(args.metrics_port)
+
+    while True:
+        started = time.monotonic()
+        # With --every and no explicit --start/--end the window slides forward on each run
+        run_precompute(api_key, date_range_from_args(args), args.features, args.output_dir, args.store)
+        prune_artifacts(args.keep, args.output_dir)
+        if not args.every:
+            break
+        wait = max(args.every * 60 - (time.monotonic() - started), 0)
+        next_run = datetime.utcnow() + timedelta(seconds=wait)
+        print(f"Next run at {next_run.replace(microsecond=0).isoformat()}Z")
+        time.sleep(wait)
+
+if __name__ == "__main__":
+    main()
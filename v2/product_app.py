@@ -1,52 +1,23 @@
-import os
 from dotenv import load_dotenv
-import requests
-from datetime import datetime, timedelta
-import time
-import json
-import pandas as pd
+from functools import partial
+from daterange import date_range_from_dates, default_date_range, resolve_date_range, to_klaviyo_datetime
+from event_cache import fetch_events, next_page_cursor
+from klaviyo_client import account_key, make_klaviyo_request
+from instrumentation import RunProfile, format_report, profiling, timed_stage
+from writers import new_run_dir, result_paths, run_dir, update_manifest, write_results
+from tables import product_attribution_tables, product_attribution_view
 import streamlit as st
+from downloads import download_section, reset_downloads
+from display import show_dataframe, precomputed_results, show_artifact_notice, show_run_profile
 
 load_dotenv()
 
-KLAVIYO_API_URL = "https://a.klaviyo.com/api"
-
-def make_klaviyo_request(endpoint, api_key, params=None, method="GET", json_body=None):
-    """Make a request to Klaviyo API with enhanced error handling"""
-    headers = {
-        "Authorization": f"Klaviyo-API-Key {api_key}",
-        "Accept": "application/json",
-        "revision": "2025-01-15"
-    }
-    url = f"{KLAVIYO_API_URL}/{endpoint.lstrip('/')}"
-    
-    try:
-        if method == "POST":
-            response = requests.post(url, headers=headers, params=params, json=json_body)
-        else:
-            response = requests.get(url, headers=headers, params=params)
-        
-        if response.status_code == 429:
-            retry_after = int(response.headers.get("Retry-After", 60))
-            print(f"Rate limit reached. Waiting {retry_after} seconds...")
-            time.sleep(retry_after)
-            return make_klaviyo_request(endpoint, api_key, params, method, json_body)
-        
-        if response.status_code != 200:
-            print(f"Error response for {endpoint}: {response.text}")
-            return None
-            
-        return response.json()
-    
-    except requests.exceptions.RequestException as e:
-        print(f"API Request failed for {endpoint}: {str(e)}")
-        return None
-
-def get_campaigns_and_flows(api_key):
-    """Fetch campaigns and flows from the last 365 days"""
+@timed_stage("fetch")
+def get_campaigns_and_flows(api_key, date_range=None):
+    """Fetch campaigns and flows updated within the date range (default: last 365 days)"""
     campaign_list = []
     flow_list = []
-    start_date = (datetime.utcnow() - timedelta(days=365)).isoformat() + "Z"
+    start_date = to_klaviyo_datetime(resolve_date_range(date_range)[0])
     
     # Fetch campaigns
     next_page = None
@@ -60,9 +31,8 @@ def get_campaigns_and_flows(api_key):
         if campaigns is None or 'data' not in campaigns:
             break
         campaign_list.extend(campaigns['data'])
-        if 'links' in campaigns and 'next' in campaigns['links'] and campaigns['links']['next']:
-            next_page = campaigns['links']['next'].split("?page[cursor]=")[1]
-        else:
+        next_page = next_page_cursor(campaigns)
+        if next_page is None:
             break
 
     # Fetch flows
@@ -77,45 +47,17 @@ def get_campaigns_and_flows(api_key):
         if flows is None or 'data' not in flows:
             break
         flow_list.extend(flows['data'])
-        if 'links' in flows and 'next' in flows['links'] and campaigns['links']['next']:
-            next_page = flows['links']['next'].split("?page[cursor]=")[1]
-        else:
+        next_page = next_page_cursor(flows)
+        if next_page is None:
             break
     
     return campaign_list, flow_list
 
-def get_product_purchases(api_key, metric_id):
+@timed_stage("aggregate")
+def get_product_purchases(api_key, metric_id, date_range=None):
     """Fetch product purchase data from Placed Order events"""
-    start_date = (datetime.utcnow() - timedelta(days=365)).isoformat() + "Z"
-    filter_str = f'greater-or-equal(datetime,{start_date})'
-    params = {"filter": filter_str}
-    print(f"Fetching events with filter: {filter_str}")
-    
-    events = []
-    next_page = None
-    
-    while True:
-        if next_page:
-            params["page[cursor]"] = next_page
-        response = make_klaviyo_request("events", api_key, params=params)
-        if response is None or "data" not in response:
-            break
-        filtered_events = [e for e in response["data"] if e["relationships"]["metric"]["data"]["id"] == metric_id]
-        events.extend(filtered_events)
-        print(f"Fetched {len(filtered_events)} Placed Order events this page")
-        
-        # Improved pagination handling
-        if "links" in response and "next" in response["links"] and response["links"]["next"] is not None:
-            next_link = response["links"]["next"]
-            if "?page[cursor]=" in next_link:
-                next_page = next_link.split("?page[cursor]=")[1]
-            elif "page%5Bcursor%5D=" in next_link:
-                next_page = next_link.split("page%5Bcursor%5D=")[1]
-            else:
-                print(f"Unexpected next link format: {next_link}")
-                break
-        else:
-            break
+    events = fetch_events(partial(make_klaviyo_request, api_key=api_key), api_key, metric_id,
+                          resolve_date_range(date_range))
     
     # Process product data
     product_data = {}
@@ -134,58 +76,39 @@ def get_product_purchases(api_key, metric_id):
         
         items = event["attributes"]["properties"].get("Items", [])
         for item in items:
-            product_id = item.get("ProductID", "unknown")
-            if product_id not in product_data:
-                product_data[product_id] = {
-                    "campaign_ids": set(),
+            key = (campaign_id, item.get("ProductID", "unknown"))
+            if key not in product_data:
+                product_data[key] = {
                     "product_name": item.get("ProductName", "Unknown"),
-                    "units_sold": 0,
                     "product_type": item.get("Categories", ["Unknown"])[0],
+                    "orders": 0,
+                    "units_sold": 0,
                     "revenue": 0.0
                 }
-            product_data[product_id]["campaign_ids"].add(campaign_id)
-            product_data[product_id]["units_sold"] += int(item.get("Quantity", 0))
-            product_data[product_id]["revenue"] += float(item.get("ItemPrice", 0.0)) * int(item.get("Quantity", 0))
+            product_data[key]["units_sold"] += int(item.get("Quantity", 0))
+            product_data[key]["revenue"] += float(item.get("ItemPrice", 0.0)) * int(item.get("Quantity", 0))
+        for key in {(campaign_id, item.get("ProductID", "unknown")) for item in items}:
+            product_data[key]["orders"] += 1
     
     return product_data
 
-def process_product_attribution(api_key, campaigns, flows, product_data):
-    """Process product purchase attribution"""
-    results = []
-    campaign_dict = {c["id"]: c for c in campaigns}
-    flow_dict = {f["id"]: f for f in flows}
-    
-    for product_id, data in product_data.items():
-        for campaign_id in data["campaign_ids"]:
-            source = campaign_dict.get(campaign_id, flow_dict.get(campaign_id, {}))
-            results.append({
-                "klaviyo_api_key": api_key,
-                "campaign_id": campaign_id,
-                "campaign_name": source.get("attributes", {}).get("name", "Unknown"),
-                "send_time": source.get("attributes", {}).get("created_at", 
-                                                            source.get("attributes", {}).get("updated_at", 
-                                                                                           datetime.utcnow().isoformat()))[:10],
-                "products": [{
-                    "product_id": product_id,
-                    "product_name": data["product_name"],
-                    "units_sold": data["units_sold"],
-                    "product_type": data["product_type"],
-                    "revenue": data["revenue"]
-                }]
-            })
-    
-    df = pd.DataFrame(results)
-    if not df.empty:
-        df.to_json("product_attribution_results.json", orient="records", indent=2)
-        df.to_csv("product_attribution_results.csv", index=False)
-    return df
+@timed_stage("write")
+def process_product_attribution(api_key, campaigns, flows, product_data, output_dir=None):
+    """Write product attribution as a fact table plus campaign and product dimension tables"""
+    tables = product_attribution_tables(campaigns, flows, product_data)
+    if not tables["product_attribution_results"].empty:
+        for stem, table in tables.items():
+            write_results(table, stem, output_dir)
+        # The account is recorded once, as a fingerprint, instead of the API key on every row
+        update_manifest(output_dir, account=account_key(api_key))
+    return product_attribution_view(tables)
 
-def main_analysis(api_key):
+def main_analysis(api_key, date_range=None, output_dir=None):
     try:
         print("Starting product purchase attribution analysis...")
         
         # Fetch campaigns and flows
-        campaigns, flows = get_campaigns_and_flows(api_key)
+        campaigns, flows = get_campaigns_and_flows(api_key, date_range)
         print(f"Found {len(campaigns)} campaigns and {len(flows)} flows")
         
         # Fetch metric ID
@@ -196,13 +119,14 @@ def main_analysis(api_key):
             return None
         
         # Fetch and process product data
-        product_data = get_product_purchases(api_key, metric_id)
-        df = process_product_attribution(api_key, campaigns, flows, product_data)
+        product_data = get_product_purchases(api_key, metric_id, date_range)
+        df = process_product_attribution(api_key, campaigns, flows, product_data, output_dir)
         
-        print("\nAnalysis complete! Results saved to:")
+        print(f"\nAnalysis complete! Results saved to {output_dir or run_dir()}:")
         if not df.empty:
-            print("- product_attribution_results.json")
-            print("- product_attribution_results.csv")
+            for stem in ("product_attribution_results", "campaigns", "products"):
+                for path in result_paths(stem, output_dir):
+                    print(f"- {path}")
             print("\nDataFrame Preview:")
             print(df.head())
         else:
@@ -222,38 +146,51 @@ def main():
     with st.sidebar:
         st.header("API Configuration")
         private_api_key = st.text_input("Private API Key (Klaviyo API Key)", type="password")
+        default_start, default_end = default_date_range()
+        selected_dates = st.date_input("Date range", value=(default_start.date(), default_end.date()),
+                                       max_value=default_end.date())
         analyze_button = st.button("Run Analysis")
 
+    # Start from the latest precomputed run so the first view needs no crawl
+    if "df" not in st.session_state:
+        manifest, frames = precomputed_results(["product_attribution"])
+        if manifest is not None and frames["product_attribution"] is not None:
+            st.session_state["df"] = frames["product_attribution"]
+            st.session_state["artifact_manifest"] = manifest
+
     if analyze_button:
-        if not private_api_key:
+        if len(selected_dates) != 2:
+            st.error("Please pick both a start and an end date")
+        elif not private_api_key:
             st.error("Please provide a Private API Key")
         else:
             print(f"Loaded API Key: {private_api_key[:6]}...")
-            with st.spinner("Running product attribution analysis..."):
-                df = main_analysis(private_api_key)
-                
-                if df is not None and not df.empty:
-                    st.success("Analysis completed!")
-                    st.subheader("Results Preview")
-                    st.dataframe(df)
-                    
-                    csv = df.to_csv(index=False)
-                    st.download_button(
-                        label="Download CSV",
-                        data=csv,
-                        file_name="product_attribution_results.csv",
-                        mime="text/csv"
-                    )
-                    
-                    json_data = df.to_json(orient="records", indent=2)
-                    st.download_button(
-                        label="Download JSON",
-                        data=json_data,
-                        file_name="product_attribution_results.json",
-                        mime="application/json"
-                    )
-                else:
-                    st.warning("No data retrieved or analysis failed")
+            date_range = date_range_from_dates(*selected_dates)
+            # This session's own output directory and profile: other sessions in the process run concurrently
+            output_dir = new_run_dir()
+            profile = RunProfile()
+            with profiling(profile), st.spinner("Running product attribution analysis..."):
+                # Keep the result in session state so reruns (e.g. from a download click) keep it
+                st.session_state["df"] = main_analysis(private_api_key, date_range, output_dir)
+            reset_downloads("products")
+            st.session_state.pop("artifact_manifest", None)
+            st.session_state["run_profile"] = profile.report()
+            print(format_report(st.session_state["run_profile"]))
+
+    if "df" in st.session_state:
+        df = st.session_state["df"]
+        if "artifact_manifest" in st.session_state:
+            show_artifact_notice(st.session_state["artifact_manifest"])
+        if df is not None and not df.empty:
+            st.success("Analysis completed!")
+            st.subheader("Results Preview")
+            show_dataframe(df, "products")
+            download_section(df, "product_attribution_results", "products")
+        else:
+            st.warning("No data retrieved or analysis failed")
+
+    if "run_profile" in st.session_state:
+        show_run_profile(st.session_state["run_profile"])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
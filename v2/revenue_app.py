@@ -1,55 +1,30 @@
-import os
 from dotenv import load_dotenv
-import requests
-from datetime import datetime, timedelta
-import time
-import json
+from datetime import datetime
+import logging
 import pandas as pd
+from functools import partial
+from daterange import date_range_from_dates, default_date_range, resolve_date_range, to_klaviyo_datetime
+from event_cache import fetch_events, new_customer_orders, next_page_cursor
+from klaviyo_client import make_klaviyo_request
+from logs import get_logger, log
+from instrumentation import RunProfile, format_report, profiling, timed_stage
+from writers import new_run_dir, result_paths, run_dir, write_results
+from tables import aggregate_totals
 import streamlit as st
+from downloads import download_section, reset_downloads
+from display import show_dataframe, precomputed_results, show_artifact_notice, show_run_profile
 
 # Load .env for fallback (optional), but we'll override with sidebar inputs
 load_dotenv()
 
-# Configuration (these will be overridden by sidebar inputs)
-KLAVIYO_API_URL = "https://a.klaviyo.com/api"
-KLAVIYO_TRACK_URL = "https://a.klaviyo.com/api/track"
+logger = get_logger("revenue")
 
-def make_klaviyo_request(endpoint, api_key, params=None, method="GET", json_body=None, use_track=False):
-    """Make a request to Klaviyo API with enhanced error handling"""
-    headers = {
-        "Authorization": f"Klaviyo-API-Key {api_key}",
-        "Accept": "application/json",
-        "revision": "2025-01-15"
-    }
-    url = KLAVIYO_TRACK_URL if use_track else f"{KLAVIYO_API_URL}/{endpoint.lstrip('/')}"
-    
-    try:
-        if method == "POST":
-            response = requests.post(url, headers=headers, params=params, json=json_body)
-        else:
-            response = requests.get(url, headers=headers, params=params)
-        
-        if response.status_code == 429:
-            retry_after = int(response.headers.get("Retry-After", 60))
-            print(f"Rate limit reached. Waiting {retry_after} seconds...")
-            time.sleep(retry_after)
-            return make_klaviyo_request(endpoint, api_key, params, method, json_body, use_track)
-        
-        if response.status_code != 200:
-            print(f"Error response for {endpoint}: {response.text}")
-            return None
-            
-        return response.json() if not use_track else response.text
-    
-    except requests.exceptions.RequestException as e:
-        print(f"API Request failed for {endpoint}: {str(e)}")
-        return None
-
-def get_campaigns_and_flows(api_key):
-    """Fetch both campaigns and flows with 365-day filter"""
+@timed_stage("fetch")
+def get_campaigns_and_flows(api_key, date_range=None):
+    """Fetch both campaigns and flows updated within the date range (default: last 365 days)"""
     campaign_list = []
     flow_list = []
-    start_date = (datetime.utcnow() - timedelta(days=365)).isoformat() + "Z"
+    start_date = to_klaviyo_datetime(resolve_date_range(date_range)[0])
     
     # Fetch campaigns with pagination
     next_page = None
@@ -64,9 +39,8 @@ def get_campaigns_and_flows(api_key):
             break
         if 'data' in campaigns:
             campaign_list.extend(campaigns['data'])
-            if 'links' in campaigns and 'next' in campaigns['links'] and campaigns['links']['next']:
-                next_page = campaigns['links']['next'].split("?page[cursor]=")[1]
-            else:
+            next_page = next_page_cursor(campaigns)
+            if next_page is None:
                 break
         else:
             break
@@ -84,19 +58,20 @@ def get_campaigns_and_flows(api_key):
             break
         if 'data' in flows:
             flow_list.extend(flows['data'])
-            if 'links' in flows and 'next' in flows['links'] and flows['links']['next']:
-                next_page = flows['links']['next'].split("?page[cursor]=")[1]
-            else:
+            next_page = next_page_cursor(flows)
+            if next_page is None:
                 break
         else:
             break
     
     return campaign_list, flow_list
 
-def get_revenue_data(api_key, metric_id):
+@timed_stage("fetch")
+def get_revenue_data(api_key, metric_id, date_range=None):
     """Fetch revenue data for campaigns and flows"""
-    start_date = (datetime.utcnow() - timedelta(days=365)).isoformat() + "Z"
-    end_date = datetime.utcnow().isoformat() + "Z"
+    start, end = resolve_date_range(date_range)
+    start_date = to_klaviyo_datetime(start)
+    end_date = to_klaviyo_datetime(end)
     json_body = {
         "data": {
             "type": "metric-aggregate",
@@ -111,74 +86,31 @@ def get_revenue_data(api_key, metric_id):
     response = make_klaviyo_request("metric-aggregates", api_key, method="POST", json_body=json_body)
     return response["data"]["attributes"]["data"] if response and "data" in response else []
 
-def split_revenue(api_key, metric_id):
+@timed_stage("aggregate")
+def split_revenue(api_key, metric_id, date_range=None):
     """Fetch events and split revenue into new vs. recurring"""
-    start_date = "2024-01-01T00:00:00Z"  # Wider net to catch all
-    filter_str = f'greater-or-equal(datetime,{start_date})'
-    params = {"filter": filter_str}
-    print(f"Fetching events with filter: {filter_str}")
-    
-    events = []
-    next_page = None
-    
-    while True:
-        if next_page:
-            params["page[cursor]"] = next_page
-        response = make_klaviyo_request("events", api_key, params=params)
-        if response is None:
-            print(f"Failed to fetch events with filter: {filter_str}")
-            break
-        if "data" not in response:
-            break
-        print(f"Total events in response: {len(response['data'])}")  # Debug raw count
-        # Filter by metric ID in relationships
-        filtered_events = [e for e in response["data"] if e["relationships"]["metric"]["data"]["id"] == metric_id]
-        events.extend(filtered_events)
-        print(f"Fetched {len(filtered_events)} Placed Order events this page")
-        if filtered_events and len(filtered_events) > 0:
-            print(f"Sample event: {json.dumps(filtered_events[0], indent=2)}")
-        
-        # Fixed pagination handling
-        if "links" in response and "next" in response["links"] and response["links"]["next"] is not None:
-            # Handle both URL formats - with or without query params
-            if "?page[cursor]=" in response["links"]["next"]:
-                next_page = response["links"]["next"].split("?page[cursor]=")[1]
-            elif "page%5Bcursor%5D=" in response["links"]["next"]:
-                next_page = response["links"]["next"].split("page%5Bcursor%5D=")[1]
-            else:
-                # If format is different, extract cursor another way or break
-                print(f"Unexpected next link format: {response['links']['next']}")
-                break
-        else:
-            break
+    events = fetch_events(partial(make_klaviyo_request, api_key=api_key), api_key, metric_id,
+                          resolve_date_range(date_range))
     
     revenue_split = {}
+    new_orders = new_customer_orders(partial(make_klaviyo_request, api_key=api_key), metric_id, events)
     for event in events:
         campaign_id = event["attributes"]["properties"].get("$attributed_message", event["attributes"]["properties"].get("$attributed_flow", ""))
         revenue = event["attributes"]["properties"].get("$value", 0.0)
-        profile_id = event["relationships"]["profile"]["data"]["id"]
-        timestamp = event["attributes"]["datetime"]
-        
-        # Check prior orders
-        prior_filter = f'equals(metric_id,"{metric_id}"),less-than(datetime,{timestamp})'
-        prior_params = {"filter": prior_filter}
-        print(f"Checking prior events for profile {profile_id} with filter: {prior_filter}")
-        prior_response = make_klaviyo_request(f"profiles/{profile_id}/events", api_key, params=prior_params)
-        prior_count = len(prior_response["data"]) if prior_response and "data" in prior_response else 0
-        
         if campaign_id not in revenue_split:
             revenue_split[campaign_id] = {"new": 0.0, "recurring": 0.0}
-        if prior_count == 0:
+        if event["id"] in new_orders:
             revenue_split[campaign_id]["new"] += revenue
         else:
             revenue_split[campaign_id]["recurring"] += revenue
     
     return revenue_split
 
-def process_revenue_attribution(campaigns, flows, revenue_data, revenue_split):
+@timed_stage("write")
+def process_revenue_attribution(campaigns, flows, revenue_data, revenue_split, output_dir=None):
     """Process revenue attribution with new vs. recurring split"""
     results = []
-    revenue_dict = {item["dimensions"][0]: item["measurements"]["sum_value"][0] for item in revenue_data if item["dimensions"][0]}
+    revenue_dict = aggregate_totals(revenue_data, "sum_value")
     
     for campaign in campaigns:
         campaign_id = campaign.get('id', '')
@@ -212,16 +144,15 @@ def process_revenue_attribution(campaigns, flows, revenue_data, revenue_split):
     
     df = pd.DataFrame(results)
     if not df.empty:
-        df.to_json("revenue_attribution_results.json", orient="records", indent=2)
-        df.to_csv("revenue_attribution_results.csv", index=False)
+        write_results(df, "revenue_attribution_results", output_dir)
     return df
 
-def main_analysis_only(api_key):
+def main_analysis_only(api_key, date_range=None, output_dir=None):
     try:
         print("Starting revenue attribution analysis (skipping simulation)...")
         
         # Fetch campaigns and flows
-        campaigns, flows = get_campaigns_and_flows(api_key)
+        campaigns, flows = get_campaigns_and_flows(api_key, date_range)
         print(f"Found {len(campaigns)} campaigns and {len(flows)} flows")
         
         # Fetch metric ID
@@ -234,19 +165,21 @@ def main_analysis_only(api_key):
         print(f"Using Placed Order metric ID: {metric_id}")
         
         # Fetch revenue data
-        revenue_data = get_revenue_data(api_key, metric_id)
-        print(f"Raw revenue data: {json.dumps(revenue_data, indent=2)}")
+        revenue_data = get_revenue_data(api_key, metric_id, date_range)
+        log(logger, logging.INFO, "Fetched revenue data", series=len(revenue_data))
+        log(logger, logging.DEBUG, "Raw revenue data", payload=revenue_data)
         
-        revenue_split = split_revenue(api_key, metric_id)
-        print(f"Revenue split data: {json.dumps(revenue_split, indent=2)}")
+        revenue_split = split_revenue(api_key, metric_id, date_range)
+        log(logger, logging.INFO, "Split revenue", sources=len(revenue_split))
+        log(logger, logging.DEBUG, "Revenue split data", payload=revenue_split)
         
         # Process and output
-        df_revenue = process_revenue_attribution(campaigns, flows, revenue_data, revenue_split)
+        df_revenue = process_revenue_attribution(campaigns, flows, revenue_data, revenue_split, output_dir)
         
-        print("\nAnalysis complete! Results saved to:")
+        print(f"\nAnalysis complete! Results saved to {output_dir or run_dir()}:")
         if not df_revenue.empty:
-            print("- revenue_attribution_results.json")
-            print("- revenue_attribution_results.csv")
+            for path in result_paths("revenue_attribution_results", output_dir):
+                print(f"- {path}")
             print("\nDataFrame Preview:")
             print(df_revenue.head())
         else:
@@ -269,41 +202,53 @@ def main():
         st.header("API Configuration")
         public_api_key = st.text_input("Public API Key", type="password")
         private_api_key = st.text_input("Private API Key (Klaviyo API Key)", type="password")
+        default_start, default_end = default_date_range()
+        selected_dates = st.date_input("Date range", value=(default_start.date(), default_end.date()),
+                                       max_value=default_end.date())
         analyze_button = st.button("Run Analysis")
 
     # Main content
+    # Start from the latest precomputed run so the first view needs no crawl
+    if "df" not in st.session_state:
+        manifest, frames = precomputed_results(["revenue_attribution"])
+        if manifest is not None and frames["revenue_attribution"] is not None:
+            st.session_state["df"] = frames["revenue_attribution"]
+            st.session_state["artifact_manifest"] = manifest
+
     if analyze_button:
-        if not public_api_key or not private_api_key:
+        if len(selected_dates) != 2:
+            st.error("Please pick both a start and an end date")
+        elif not public_api_key or not private_api_key:
             st.error("Please provide both Public and Private API keys")
         else:
             print(f"Loaded API Key: {private_api_key[:6]}...")
-            with st.spinner("Running revenue attribution analysis..."):
+            date_range = date_range_from_dates(*selected_dates)
+            # This session's own output directory and profile: other sessions in the process run concurrently
+            output_dir = new_run_dir()
+            profile = RunProfile()
+            with profiling(profile), st.spinner("Running revenue attribution analysis..."):
                 # Run analysis with the private API key from the sidebar
-                df = main_analysis_only(private_api_key)
-                
-                if df is not None and not df.empty:
-                    st.success("Analysis completed!")
-                    st.subheader("Results Preview")
-                    st.dataframe(df)
-                    
-                    # Download buttons
-                    csv = df.to_csv(index=False)
-                    st.download_button(
-                        label="Download CSV",
-                        data=csv,
-                        file_name="revenue_attribution_results.csv",
-                        mime="text/csv"
-                    )
-                    
-                    json_data = df.to_json(orient="records", indent=2)
-                    st.download_button(
-                        label="Download JSON",
-                        data=json_data,
-                        file_name="revenue_attribution_results.json",
-                        mime="application/json"
-                    )
-                else:
-                    st.warning("No data retrieved or analysis failed")
+                # Keep the result in session state so reruns (e.g. from a download click) keep it
+                st.session_state["df"] = main_analysis_only(private_api_key, date_range, output_dir)
+            reset_downloads("revenue")
+            st.session_state.pop("artifact_manifest", None)
+            st.session_state["run_profile"] = profile.report()
+            print(format_report(st.session_state["run_profile"]))
+
+    if "df" in st.session_state:
+        df = st.session_state["df"]
+        if "artifact_manifest" in st.session_state:
+            show_artifact_notice(st.session_state["artifact_manifest"])
+        if df is not None and not df.empty:
+            st.success("Analysis completed!")
+            st.subheader("Results Preview")
+            show_dataframe(df, "revenue")
+            download_section(df, "revenue_attribution_results", "revenue")
+        else:
+            st.warning("No data retrieved or analysis failed")
+
+    if "run_profile" in st.session_state:
+        show_run_profile(st.session_state["run_profile"])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
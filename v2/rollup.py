@@ -0,0 +1,98 @@
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+
+class RollupIndex:
+    """Cumulative per-day revenue, so the total over any date range is the difference of two entries
+
+    Built once from daily totals (the revenue share result) and, optionally, daily revenue per campaign or flow.
+    Days without orders count as zero; ranges are inclusive calendar dates and are clipped to the indexed days.
+    """
+
+    def __init__(self, first_day, total, attributed, source_ids=(), source_revenue=None):
+        self.first_day = first_day
+        self.days = len(total)
+        # Row i holds the sum over the first i days, so row 0 is all zeros
+        self.total = np.concatenate(([0.0], np.cumsum(total)))
+        self.attributed = np.concatenate(([0.0], np.cumsum(attributed)))
+        self.source_ids = list(source_ids)
+        self._source_positions = {source_id: i for i, source_id in enumerate(self.source_ids)}
+        if source_revenue is None:
+            source_revenue = np.zeros((self.days, 0))
+        self.sources = np.vstack([np.zeros((1, len(self.source_ids))), np.cumsum(source_revenue, axis=0)])
+
+    @classmethod
+    def from_frames(cls, daily, source_daily=None):
+        """Index a frame with date, total_shop_revenue and klaviyo_attributed_revenue columns
+
+        `source_daily` is a long frame with date, source_id and revenue columns.
+        """
+        days = pd.to_datetime(daily["date"]).dt.normalize()
+        first_day, last_day = days.min(), days.max()
+        if source_daily is not None and not source_daily.empty:
+            source_days = pd.to_datetime(source_daily["date"]).dt.normalize()
+            first_day, last_day = min(first_day, source_days.min()), max(last_day, source_days.max())
+        length = (last_day - first_day).days + 1
+        positions = (days - first_day).dt.days.to_numpy()
+        total = np.bincount(positions, weights=daily["total_shop_revenue"].to_numpy(float), minlength=length)
+        attributed = np.bincount(positions, weights=daily["klaviyo_attributed_revenue"].to_numpy(float),
+                                 minlength=length)
+
+        source_ids, source_revenue = (), None
+        if source_daily is not None and not source_daily.empty:
+            codes, source_ids = pd.factorize(source_daily["source_id"])
+            source_revenue = np.zeros((length, len(source_ids)))
+            np.add.at(source_revenue, ((source_days - first_day).dt.days.to_numpy(), codes),
+                      source_daily["revenue"].to_numpy(float))
+        return cls(first_day.date(), total, attributed, source_ids, source_revenue)
+
+    @property
+    def last_day(self):
+        return self.first_day + timedelta(days=self.days - 1)
+
+    def last(self, days):
+        """(start, end) of the last `days` indexed days"""
+        return max(self.last_day - timedelta(days=days - 1), self.first_day), self.last_day
+
+    def _bounds(self, start, end):
+        """Prefix rows (lo, hi) for inclusive dates start..end; hi - lo days are covered"""
+        lo = 0 if start is None else (pd.Timestamp(start).date() - self.first_day).days
+        hi = self.days if end is None else (pd.Timestamp(end).date() - self.first_day).days + 1
+        lo, hi = min(max(lo, 0), self.days), min(max(hi, 0), self.days)
+        return lo, max(lo, hi)
+
+    def total_revenue(self, start=None, end=None):
+        lo, hi = self._bounds(start, end)
+        return float(self.total[hi] - self.total[lo])
+
+    def attributed_revenue(self, start=None, end=None):
+        lo, hi = self._bounds(start, end)
+        return float(self.attributed[hi] - self.attributed[lo])
+
+    def share(self, start=None, end=None):
+        """Attributed share of revenue in percent, as in the revenue share results"""
+        total = self.total_revenue(start, end)
+        return self.attributed_revenue(start, end) / total * 100 if total > 0 else 0.0
+
+    def source_revenue(self, source_id, start=None, end=None):
+        """Revenue attributed to one campaign or flow; 0.0 for an unknown id"""
+        position = self._source_positions.get(source_id)
+        if position is None:
+            return 0.0
+        lo, hi = self._bounds(start, end)
+        return float(self.sources[hi, position] - self.sources[lo, position])
+
+    def sources_revenue(self, start=None, end=None):
+        """Revenue per campaign and flow over the range, largest first"""
+        lo, hi = self._bounds(start, end)
+        revenue = pd.Series(self.sources[hi] - self.sources[lo], index=pd.Index(self.source_ids, name="source_id"),
+                            name="revenue")
+        return revenue[revenue != 0].sort_values(ascending=False)
+
+    def summary(self, start=None, end=None):
+        """Totals for a range, with the same names as the revenue share columns"""
+        return {
+            "total_shop_revenue": self.total_revenue(start, end),
+            "klaviyo_attributed_revenue": self.attributed_revenue(start, end),
+            "klaviyo_revenue_share": self.share(start, end),
+        }
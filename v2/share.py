@@ -1,84 +1,31 @@
 import os
 from dotenv import load_dotenv
-import requests
-from datetime import datetime, timedelta
-import time
-import json
 import pandas as pd
+from daterange import parse_date_range_args, resolve_date_range
+from event_cache import fetch_events
+import klaviyo_client
+from instrumentation import PROFILE_FILE, report_run, timed_stage
+from writers import result_paths, run_dir, update_manifest, write_results
 
 load_dotenv()
 
 # Configuration
 KLAVIYO_API_KEY = os.getenv("KLAVIYO_API_KEY")
-if not KLAVIYO_API_KEY:
-    raise ValueError("No API key found. Please create a .env file with your KLAVIYO_API_KEY")
 
-KLAVIYO_API_URL = "https://a.klaviyo.com/api"
-
-print(f"Loaded API Key: {KLAVIYO_API_KEY[:6]}...")
+def require_api_key():
+    """Fail when no API key is configured; checked when run, not on import"""
+    if not KLAVIYO_API_KEY:
+        raise ValueError("No API key found. Please create a .env file with your KLAVIYO_API_KEY")
+    print(f"Loaded API Key: {KLAVIYO_API_KEY[:6]}...")
 
 def make_klaviyo_request(endpoint, params=None, method="GET", json_body=None):
-    """Make a request to Klaviyo API with enhanced error handling"""
-    headers = {
-        "Authorization": f"Klaviyo-API-Key {KLAVIYO_API_KEY}",
-        "Accept": "application/json",
-        "revision": "2025-01-15"
-    }
-    url = f"{KLAVIYO_API_URL}/{endpoint.lstrip('/')}"
-    
-    try:
-        if method == "POST":
-            response = requests.post(url, headers=headers, params=params, json=json_body)
-        else:
-            response = requests.get(url, headers=headers, params=params)
-        
-        if response.status_code == 429:
-            retry_after = int(response.headers.get("Retry-After", 60))
-            print(f"Rate limit reached. Waiting {retry_after} seconds...")
-            time.sleep(retry_after)
-            return make_klaviyo_request(endpoint, params, method, json_body)
-        
-        if response.status_code != 200:
-            print(f"Error response for {endpoint}: {response.text}")
-            return None
-            
-        return response.json()
-    
-    except requests.exceptions.RequestException as e:
-        print(f"API Request failed for {endpoint}: {str(e)}")
-        return None
+    """Make a request to Klaviyo API with the key from .env"""
+    return klaviyo_client.make_klaviyo_request(endpoint, KLAVIYO_API_KEY, params, method, json_body)
 
-def get_revenue_share(metric_id):
+@timed_stage("aggregate")
+def get_revenue_share(metric_id, date_range=None):
     """Fetch Placed Order events and calculate daily revenue share"""
-    start_date = (datetime.utcnow() - timedelta(days=365)).isoformat() + "Z"
-    filter_str = f'greater-or-equal(datetime,{start_date})'
-    params = {"filter": filter_str}
-    print(f"Fetching events with filter: {filter_str}")
-    
-    events = []
-    next_page = None
-    
-    while True:
-        if next_page:
-            params["page[cursor]"] = next_page
-        response = make_klaviyo_request("events", params=params)
-        if response is None or "data" not in response:
-            break
-        filtered_events = [e for e in response["data"] if e["relationships"]["metric"]["data"]["id"] == metric_id]
-        events.extend(filtered_events)
-        print(f"Fetched {len(filtered_events)} Placed Order events this page")
-        
-        if "links" in response and "next" in response["links"] and response["links"]["next"] is not None:
-            next_link = response["links"]["next"]
-            if "?page[cursor]=" in next_link:
-                next_page = next_link.split("?page[cursor]=")[1]
-            elif "page%5Bcursor%5D=" in next_link:
-                next_page = next_link.split("page%5Bcursor%5D=")[1]
-            else:
-                print(f"Unexpected next link format: {next_link}")
-                break
-        else:
-            break
+    events = fetch_events(make_klaviyo_request, KLAVIYO_API_KEY, metric_id, resolve_date_range(date_range))
     
     # Aggregate daily data
     daily_data = {}
@@ -108,7 +55,6 @@ def get_revenue_share(metric_id):
         attributed = data["attributed"]
         share = (attributed / total * 100) if total > 0 else 0.0
         results.append({
-            "klaviyo_api_key": KLAVIYO_API_KEY,
             "date": date,
             "total_shop_revenue": total,
             "klaviyo_attributed_revenue": attributed,
@@ -117,15 +63,16 @@ def get_revenue_share(metric_id):
     
     return results
 
+@timed_stage("write")
 def process_revenue_share(results):
     """Process and save revenue share data"""
     df = pd.DataFrame(results)
     if not df.empty:
-        df.to_json("revenue_share_results.json", orient="records", indent=2)
-        df.to_csv("revenue_share_results.csv", index=False)
+        write_results(df, "revenue_share_results")
+        update_manifest(account=klaviyo_client.account_key(KLAVIYO_API_KEY))
     return df
 
-def main():
+def main(date_range=None):
     try:
         print("Starting revenue share analysis...")
         
@@ -137,13 +84,13 @@ def main():
             return
         
         # Fetch and process revenue share
-        share_data = get_revenue_share(metric_id)
+        share_data = get_revenue_share(metric_id, date_range)
         df = process_revenue_share(share_data)
         
-        print("\nAnalysis complete! Results saved to:")
+        print(f"\nAnalysis complete! Results saved to {run_dir()}:")
         if not df.empty:
-            print("- revenue_share_results.json")
-            print("- revenue_share_results.csv")
+            for path in result_paths("revenue_share_results"):
+                print(f"- {path}")
             print("\nDataFrame Preview:")
             print(df.head())
         else:
@@ -155,4 +102,6 @@ def main():
         print(traceback.format_exc())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    require_api_key()
+    main(parse_date_range_args("Daily Klaviyo revenue share"))
+    report_run(os.path.join(run_dir(), PROFILE_FILE))
\ No newline at end of file
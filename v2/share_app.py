@@ -1,78 +1,23 @@
-import os
 from dotenv import load_dotenv
-import requests
-from datetime import datetime, timedelta
-import time
-import json
 import pandas as pd
+from functools import partial
+from daterange import date_range_from_dates, default_date_range, resolve_date_range
+from event_cache import fetch_events
+from klaviyo_client import account_key, make_klaviyo_request
+from instrumentation import RunProfile, format_report, profiling, timed_stage
+from writers import new_run_dir, result_paths, run_dir, update_manifest, write_results
+from store import load_source_daily_revenue
 import streamlit as st
+from downloads import download_section, reset_downloads
+from display import show_dataframe, precomputed_results, show_artifact_notice, show_range_totals, show_run_profile
 
 load_dotenv()
 
-KLAVIYO_API_URL = "https://a.klaviyo.com/api"
-
-def make_klaviyo_request(endpoint, api_key, params=None, method="GET", json_body=None):
-    """Make a request to Klaviyo API with enhanced error handling"""
-    headers = {
-        "Authorization": f"Klaviyo-API-Key {api_key}",
-        "Accept": "application/json",
-        "revision": "2025-01-15"
-    }
-    url = f"{KLAVIYO_API_URL}/{endpoint.lstrip('/')}"
-    
-    try:
-        if method == "POST":
-            response = requests.post(url, headers=headers, params=params, json=json_body)
-        else:
-            response = requests.get(url, headers=headers, params=params)
-        
-        if response.status_code == 429:
-            retry_after = int(response.headers.get("Retry-After", 60))
-            print(f"Rate limit reached. Waiting {retry_after} seconds...")
-            time.sleep(retry_after)
-            return make_klaviyo_request(endpoint, api_key, params, method, json_body)
-        
-        if response.status_code != 200:
-            print(f"Error response for {endpoint}: {response.text}")
-            return None
-            
-        return response.json()
-    
-    except requests.exceptions.RequestException as e:
-        print(f"API Request failed for {endpoint}: {str(e)}")
-        return None
-
-def get_revenue_share(api_key, metric_id):
+@timed_stage("aggregate")
+def get_revenue_share(api_key, metric_id, date_range=None):
     """Fetch Placed Order events and calculate daily revenue share"""
-    start_date = (datetime.utcnow() - timedelta(days=365)).isoformat() + "Z"
-    filter_str = f'greater-or-equal(datetime,{start_date})'
-    params = {"filter": filter_str}
-    print(f"Fetching events with filter: {filter_str}")
-    
-    events = []
-    next_page = None
-    
-    while True:
-        if next_page:
-            params["page[cursor]"] = next_page
-        response = make_klaviyo_request("events", api_key, params=params)
-        if response is None or "data" not in response:
-            break
-        filtered_events = [e for e in response["data"] if e["relationships"]["metric"]["data"]["id"] == metric_id]
-        events.extend(filtered_events)
-        print(f"Fetched {len(filtered_events)} Placed Order events this page")
-        
-        if "links" in response and "next" in response["links"] and response["links"]["next"] is not None:
-            next_link = response["links"]["next"]
-            if "?page[cursor]=" in next_link:
-                next_page = next_link.split("?page[cursor]=")[1]
-            elif "page%5Bcursor%5D=" in next_link:
-                next_page = next_link.split("page%5Bcursor%5D=")[1]
-            else:
-                print(f"Unexpected next link format: {next_link}")
-                break
-        else:
-            break
+    events = fetch_events(partial(make_klaviyo_request, api_key=api_key), api_key, metric_id,
+                          resolve_date_range(date_range))
     
     # Aggregate daily data
     daily_data = {}
@@ -102,7 +47,6 @@ def get_revenue_share(api_key, metric_id):
         attributed = data["attributed"]
         share = (attributed / total * 100) if total > 0 else 0.0
         results.append({
-            "klaviyo_api_key": api_key,
             "date": date,
             "total_shop_revenue": total,
             "klaviyo_attributed_revenue": attributed,
@@ -111,15 +55,16 @@ def get_revenue_share(api_key, metric_id):
     
     return results
 
-def process_revenue_share(results):
+@timed_stage("write")
+def process_revenue_share(api_key, results, output_dir=None):
     """Process and save revenue share data"""
     df = pd.DataFrame(results)
     if not df.empty:
-        df.to_json("revenue_share_results.json", orient="records", indent=2)
-        df.to_csv("revenue_share_results.csv", index=False)
+        write_results(df, "revenue_share_results", output_dir)
+        update_manifest(output_dir, account=account_key(api_key))
     return df
 
-def main_analysis(api_key):
+def main_analysis(api_key, date_range=None, output_dir=None):
     try:
         print("Starting revenue share analysis...")
         
@@ -131,13 +76,13 @@ def main_analysis(api_key):
             return None
         
         # Fetch and process revenue share
-        share_data = get_revenue_share(api_key, metric_id)
-        df = process_revenue_share(share_data)
+        share_data = get_revenue_share(api_key, metric_id, date_range)
+        df = process_revenue_share(api_key, share_data, output_dir)
         
-        print("\nAnalysis complete! Results saved to:")
+        print(f"\nAnalysis complete! Results saved to {output_dir or run_dir()}:")
         if not df.empty:
-            print("- revenue_share_results.json")
-            print("- revenue_share_results.csv")
+            for path in result_paths("revenue_share_results", output_dir):
+                print(f"- {path}")
             print("\nDataFrame Preview:")
             print(df.head())
         else:
@@ -157,38 +102,56 @@ def main():
     with st.sidebar:
         st.header("API Configuration")
         private_api_key = st.text_input("Private API Key (Klaviyo API Key)", type="password")
+        default_start, default_end = default_date_range()
+        selected_dates = st.date_input("Date range", value=(default_start.date(), default_end.date()),
+                                       max_value=default_end.date())
         analyze_button = st.button("Run Analysis")
 
+    # Start from the latest precomputed run so the first view needs no crawl
+    if "df" not in st.session_state:
+        manifest, frames = precomputed_results(["revenue_share"])
+        if manifest is not None and frames["revenue_share"] is not None:
+            st.session_state["df"] = frames["revenue_share"]
+            st.session_state["artifact_manifest"] = manifest
+            # Per-campaign daily revenue for the range totals, if the store has this account
+            st.session_state["source_daily"] = load_source_daily_revenue(manifest.get("account"))
+
     if analyze_button:
-        if not private_api_key:
+        if len(selected_dates) != 2:
+            st.error("Please pick both a start and an end date")
+        elif not private_api_key:
             st.error("Please provide a Private API Key")
         else:
             print(f"Loaded API Key: {private_api_key[:6]}...")
-            with st.spinner("Running revenue share analysis..."):
-                df = main_analysis(private_api_key)
-                
-                if df is not None and not df.empty:
-                    st.success("Analysis completed!")
-                    st.subheader("Results Preview")
-                    st.dataframe(df)
-                    
-                    csv = df.to_csv(index=False)
-                    st.download_button(
-                        label="Download CSV",
-                        data=csv,
-                        file_name="revenue_share_results.csv",
-                        mime="text/csv"
-                    )
-                    
-                    json_data = df.to_json(orient="records", indent=2)
-                    st.download_button(
-                        label="Download JSON",
-                        data=json_data,
-                        file_name="revenue_share_results.json",
-                        mime="application/json"
-                    )
-                else:
-                    st.warning("No data retrieved or analysis failed")
+            date_range = date_range_from_dates(*selected_dates)
+            # This session's own output directory and profile: other sessions in the process run concurrently
+            output_dir = new_run_dir()
+            profile = RunProfile()
+            with profiling(profile), st.spinner("Running revenue share analysis..."):
+                # Keep the result in session state so reruns (e.g. from a download click) keep it
+                st.session_state["df"] = main_analysis(private_api_key, date_range, output_dir)
+            st.session_state["source_daily"] = load_source_daily_revenue(account_key(private_api_key))
+            reset_downloads("share")
+            st.session_state.pop("artifact_manifest", None)
+            st.session_state["run_profile"] = profile.report()
+            print(format_report(st.session_state["run_profile"]))
+
+    if "df" in st.session_state:
+        df = st.session_state["df"]
+        if "artifact_manifest" in st.session_state:
+            show_artifact_notice(st.session_state["artifact_manifest"])
+        if df is not None and not df.empty:
+            st.success("Analysis completed!")
+            st.subheader("Totals for a range")
+            show_range_totals(df, "share", st.session_state.get("source_daily"))
+            st.subheader("Results Preview")
+            show_dataframe(df, "share")
+            download_section(df, "revenue_share_results", "share")
+        else:
+            st.warning("No data retrieved or analysis failed")
+
+    if "run_profile" in st.session_state:
+        show_run_profile(st.session_state["run_profile"])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
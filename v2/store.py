@@ -0,0 +1,248 @@
+import os
+import sqlite3
+import argparse
+from datetime import timedelta
+from functools import partial
+from dotenv import load_dotenv
+import pandas as pd
+from daterange import add_date_range_args, date_range_from_args, parse_event_datetime, resolve_date_range
+from event_cache import fetch_events
+from instrumentation import PROFILE_FILE, report_run, stage
+from klaviyo_client import account_key, make_klaviyo_request
+
+load_dotenv()
+
+# Local SQLite database the pipelines load orders, campaigns, flows and rollups into
+STORE_PATH = os.getenv("KLAVIYO_STORE_PATH", "analytics.db")
+
+# Every table is keyed by the account fingerprint, so one database can hold several accounts.
+# Dates are UTC "YYYY-MM-DD" text and datetimes ISO text, which sort and compare correctly as strings.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    account TEXT NOT NULL,
+    order_id TEXT NOT NULL,
+    datetime TEXT NOT NULL,
+    date TEXT NOT NULL,
+    profile_id TEXT,
+    value REAL NOT NULL,
+    campaign_id TEXT,
+    flow_id TEXT,
+    PRIMARY KEY (account, order_id)
+);
+CREATE INDEX IF NOT EXISTS orders_date ON orders (account, date);
+CREATE INDEX IF NOT EXISTS orders_campaign ON orders (account, campaign_id, date) WHERE campaign_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS orders_flow ON orders (account, flow_id, date) WHERE flow_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS orders_profile ON orders (account, profile_id, datetime);
+
+CREATE TABLE IF NOT EXISTS order_items (
+    account TEXT NOT NULL,
+    order_id TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    product_name TEXT,
+    product_type TEXT,
+    quantity INTEGER NOT NULL,
+    revenue REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS order_items_order ON order_items (account, order_id);
+CREATE INDEX IF NOT EXISTS order_items_product ON order_items (account, product_id);
+
+CREATE TABLE IF NOT EXISTS campaigns (
+    account TEXT NOT NULL,
+    campaign_id TEXT NOT NULL,
+    name TEXT,
+    created_at TEXT,
+    PRIMARY KEY (account, campaign_id)
+);
+
+CREATE TABLE IF NOT EXISTS flows (
+    account TEXT NOT NULL,
+    flow_id TEXT NOT NULL,
+    name TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (account, flow_id)
+);
+
+CREATE TABLE IF NOT EXISTS daily_rollup (
+    account TEXT NOT NULL,
+    date TEXT NOT NULL,
+    orders INTEGER NOT NULL,
+    total_revenue REAL NOT NULL,
+    attributed_revenue REAL NOT NULL,
+    PRIMARY KEY (account, date)
+);
+
+CREATE TABLE IF NOT EXISTS campaign_rollup (
+    account TEXT NOT NULL,
+    source_id TEXT NOT NULL,
+    source_type TEXT NOT NULL,
+    date TEXT NOT NULL,
+    orders INTEGER NOT NULL,
+    revenue REAL NOT NULL,
+    PRIMARY KEY (account, source_id, date)
+);
+CREATE INDEX IF NOT EXISTS campaign_rollup_date ON campaign_rollup (account, date);
+"""
+
+def connect(path=STORE_PATH):
+    """Open the store, creating its tables and indexes on first use"""
+    conn = sqlite3.connect(path)
+    # WAL lets dashboards query while a sync is writing
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def _order_rows(account, events):
+    """Order and item rows from Placed Order events, first event per OrderId"""
+    orders, items, seen = [], [], set()
+    for event in events:
+        properties = event["attributes"]["properties"]
+        order_id = properties.get("OrderId", "")
+        if order_id in seen:
+            continue
+        seen.add(order_id)
+        timestamp = parse_event_datetime(event["attributes"]["datetime"])
+        orders.append((account, order_id, timestamp.isoformat(), timestamp.date().isoformat(),
+                       event["relationships"]["profile"]["data"]["id"], float(properties.get("$value", 0.0)),
+                       properties.get("$attributed_message") or None, properties.get("$attributed_flow") or None))
+        for item in properties.get("Items", []):
+            quantity = int(item.get("Quantity", 0))
+            items.append((account, order_id, item.get("ProductID", "unknown"), item.get("ProductName", "Unknown"),
+                          item.get("Categories", ["Unknown"])[0], quantity, float(item.get("ItemPrice", 0.0)) * quantity))
+    return orders, items
+
+def load_account(conn, api_key, date_range, campaigns, flows, events):
+    """Replace one account's data for a date range and rebuild the rollups of the days it covers
+
+    Loading the same window again gives the same result.
+    """
+    account = account_key(api_key)
+    start, end = date_range
+    start_date = start.date().isoformat()
+    # The window is [start, end); a range ending at midnight does not touch the day that begins then
+    end_date = (end - timedelta(microseconds=1)).date().isoformat()
+    orders, items = _order_rows(account, events)
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO campaigns VALUES (?, ?, ?, ?)",
+                         [(account, c["id"], c.get("attributes", {}).get("name"), c.get("attributes", {}).get("created_at"))
+                          for c in campaigns if c.get("id")])
+        conn.executemany("INSERT OR REPLACE INTO flows VALUES (?, ?, ?, ?)",
+                         [(account, f["id"], f.get("attributes", {}).get("name"), f.get("attributes", {}).get("updated"))
+                          for f in flows if f.get("id")])
+
+        window = "account = ? AND datetime >= ? AND datetime < ?"
+        bounds = (account, start.isoformat(), end.isoformat())
+        conn.execute(f"DELETE FROM order_items WHERE account = ? AND order_id IN "
+                     f"(SELECT order_id FROM orders WHERE {window})", (account,) + bounds)
+        conn.execute(f"DELETE FROM orders WHERE {window}", bounds)
+        # An order id seen again (e.g. re-dated outside the window) replaces the old order and its items
+        conn.executemany("DELETE FROM order_items WHERE account = ? AND order_id = ?", [row[:2] for row in orders])
+        conn.executemany("INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?, ?, ?, ?)", orders)
+        conn.executemany("INSERT INTO order_items VALUES (?, ?, ?, ?, ?, ?, ?)", items)
+
+        days = (account, start_date, end_date)
+        conn.execute("DELETE FROM daily_rollup WHERE account = ? AND date BETWEEN ? AND ?", days)
+        conn.execute("""
+            INSERT INTO daily_rollup
+            SELECT account, date, COUNT(*), SUM(value),
+                   SUM(CASE WHEN campaign_id IS NOT NULL OR flow_id IS NOT NULL THEN value ELSE 0 END)
+            FROM orders WHERE account = ? AND date BETWEEN ? AND ?
+            GROUP BY account, date""", days)
+        conn.execute("DELETE FROM campaign_rollup WHERE account = ? AND date BETWEEN ? AND ?", days)
+        # Attribution as in the analyses: the campaign when there is one, else the flow
+        conn.execute("""
+            INSERT INTO campaign_rollup
+            SELECT account, COALESCE(campaign_id, flow_id), CASE WHEN campaign_id IS NOT NULL THEN 'campaign' ELSE 'flow' END,
+                   date, COUNT(*), SUM(value)
+            FROM orders WHERE account = ? AND date BETWEEN ? AND ? AND (campaign_id IS NOT NULL OR flow_id IS NOT NULL)
+            GROUP BY 1, 2, 3, 4""", days)
+    return {"orders": len(orders), "order_items": len(items)}
+
+def sync_store(api_key, date_range=None, path=STORE_PATH):
+    """Fetch campaigns, flows and Placed Order events (through the event cache) and load them into the store"""
+    # Imported here: the dashboards, which app.py belongs to, read the store themselves
+    from app import get_campaigns_and_flows
+    date_range = resolve_date_range(date_range)
+    campaigns, flows = get_campaigns_and_flows(api_key, date_range)
+    metrics = make_klaviyo_request("metrics", api_key)
+    metric_id = next((m["id"] for m in (metrics or {}).get("data", []) if m["attributes"]["name"] == "Placed Order"),
+                     None)
+    if not metric_id:
+        print("No Placed Order metric found")
+        return None
+    events = fetch_events(partial(make_klaviyo_request, api_key=api_key), api_key, metric_id, date_range)
+    with stage("store"):
+        conn = connect(path)
+        try:
+            return load_account(conn, api_key, date_range, campaigns, flows, events)
+        finally:
+            conn.close()
+
+def revenue_by_campaign(conn, account, start_date, end_date):
+    """Attributed orders and revenue per campaign and flow for the days start_date..end_date (inclusive)"""
+    return pd.read_sql_query("""
+        SELECT r.source_id, r.source_type, COALESCE(c.name, f.name, 'Unknown') AS name,
+               SUM(r.orders) AS orders, SUM(r.revenue) AS revenue
+        FROM campaign_rollup r
+        LEFT JOIN campaigns c ON c.account = r.account AND c.campaign_id = r.source_id
+        LEFT JOIN flows f ON f.account = r.account AND f.flow_id = r.source_id
+        WHERE r.account = ? AND r.date BETWEEN ? AND ?
+        GROUP BY r.source_id, r.source_type
+        ORDER BY revenue DESC""", conn, params=(account, str(start_date), str(end_date)))
+
+def top_products_per_flow(conn, account, start_date, end_date, limit=5):
+    """The `limit` best-selling products by revenue for each flow, over the days start_date..end_date"""
+    return pd.read_sql_query("""
+        SELECT flow_id, flow_name, product_id, product_name, orders, units_sold, revenue FROM (
+            SELECT o.flow_id, COALESCE(f.name, 'Unknown') AS flow_name, i.product_id, MAX(i.product_name) AS product_name,
+                   COUNT(DISTINCT o.order_id) AS orders, SUM(i.quantity) AS units_sold, SUM(i.revenue) AS revenue,
+                   ROW_NUMBER() OVER (PARTITION BY o.flow_id ORDER BY SUM(i.revenue) DESC) AS rank
+            FROM orders o
+            JOIN order_items i ON i.account = o.account AND i.order_id = o.order_id
+            LEFT JOIN flows f ON f.account = o.account AND f.flow_id = o.flow_id
+            WHERE o.account = ? AND o.flow_id IS NOT NULL AND o.campaign_id IS NULL AND o.date BETWEEN ? AND ?
+            GROUP BY o.flow_id, i.product_id)
+        WHERE rank <= ?
+        ORDER BY flow_id, rank""", conn, params=(account, str(start_date), str(end_date), limit))
+
+def source_daily_revenue(conn, account):
+    """Daily revenue per campaign and flow (the campaign rollup), as a long frame"""
+    return pd.read_sql_query("SELECT date, source_id, source_type, revenue FROM campaign_rollup WHERE account = ? "
+                             "ORDER BY date", conn, params=(account,))
+
+def load_source_daily_revenue(account, path=STORE_PATH):
+    """source_daily_revenue from the store at `path`, or None when there is no store yet"""
+    if not account or not os.path.exists(path):
+        return None
+    conn = connect(path)
+    try:
+        return source_daily_revenue(conn, account)
+    finally:
+        conn.close()
+
+def share_for_date(conn, account, date):
+    """Total and attributed revenue and the attributed share (%) for one day; None if the day has no orders"""
+    row = conn.execute("SELECT orders, total_revenue, attributed_revenue FROM daily_rollup WHERE account = ? AND date = ?",
+                       (account, str(date))).fetchone()
+    if row is None:
+        return None
+    orders, total, attributed = row
+    return {"date": str(date), "orders": orders, "total_shop_revenue": total, "klaviyo_attributed_revenue": attributed,
+            "klaviyo_revenue_share": attributed / total * 100 if total > 0 else 0.0}
+
+def main():
+    parser = argparse.ArgumentParser(description="Load orders, campaigns, flows and rollups into the SQLite store")
+    add_date_range_args(parser)
+    parser.add_argument("--store", default=STORE_PATH, help=f"SQLite database (default: {STORE_PATH})")
+    args = parser.parse_args()
+
+    api_key = os.getenv("KLAVIYO_API_KEY")
+    if not api_key:
+        raise ValueError("No API key found. Please create a .env file with your KLAVIYO_API_KEY")
+    loaded = sync_store(api_key, date_range_from_args(args), args.store)
+    if loaded is not None:
+        print(f"Loaded {loaded['orders']} orders and {loaded['order_items']} order items into {args.store} "
+              f"(account {account_key(api_key)})")
+    report_run(PROFILE_FILE)
+
+if __name__ == "__main__":
+    main()
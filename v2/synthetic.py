@@ -0,0 +1,229 @@
+import os
+import json
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+# Metric ids and names of the synthetic account
+METRICS = {
+    "PLACED": "Placed Order",
+    "RECEIVED": "Received Email",
+    "OPENED": "Opened Email",
+    "CLICKED": "Clicked Email",
+}
+
+CATEGORY_NAMES = ["Apparel", "Shoes", "Accessories", "Beauty", "Home", "Outdoor", "Kids", "Electronics",
+                  "Jewelry", "Sports", "Books", "Toys", "Garden", "Pets", "Food", "Health"]
+
+def _ids(prefix, count, width=9):
+    """Vectorized zero-padded string ids: PREFIX000000001, ..."""
+    return np.char.add(prefix, np.char.zfill(np.arange(count).astype(str), width))
+
+def _iso(values):
+    """Format naive UTC datetime64 values the way Klaviyo returns them"""
+    return [f"{v}+00:00" for v in pd.DatetimeIndex(values).strftime("%Y-%m-%dT%H:%M:%S")]
+
+def _day_weights(start, days, seasonality):
+    """Relative order volume per day: yearly wave, weekend lift and a November/December peak"""
+    dates = pd.date_range(start, periods=days, freq="D")
+    yearly = 1 + 0.3 * seasonality * np.sin(2 * np.pi * (dates.dayofyear.to_numpy() - 80) / 365.25)
+    weekly = np.where(dates.dayofweek.to_numpy() >= 5, 1 + 0.25 * seasonality, 1.0)
+    holiday = np.where(dates.month.to_numpy() >= 11, 1 + 0.8 * seasonality, 1.0)
+    weights = yearly * weekly * holiday
+    return weights / weights.sum()
+
+def generate_dataset(orders=10000, profiles=None, campaigns=50, flows=10, products=500, categories=12,
+                     days=365, end=None, campaign_share=0.25, flow_share=0.2, repeat_sigma=1.0,
+                     duplicate_rate=0.01, seasonality=1.0, recipients_per_campaign=2000,
+                     flow_touches=20000, open_rate=0.35, click_rate=0.12, seed=42):
+    """Generate a synthetic Klaviyo account as the dataset dict used by mock_server and the fixtures"""
+    rng = np.random.default_rng(seed)
+    profiles = profiles or max(orders // 3, 1)
+    end = (end or datetime.utcnow()).replace(hour=0, minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=days)
+    start64 = np.datetime64(start, "s")
+
+    # Campaigns are spread over the window; flows exist from the start
+    campaign_ids = _ids("CAMPAIGN", campaigns, 6)
+    send_offsets = np.sort(rng.integers(0, days * 86400, campaigns))
+    send_times = start64 + send_offsets.astype("timedelta64[s]")
+    campaign_records = [
+        {"type": "campaign", "id": cid, "attributes": {
+            "name": f"Campaign {i + 1}", "status": "Sent", "channel": "email", "archived": False,
+            "send_time": sent, "created_at": created, "updated_at": sent}}
+        for i, (cid, sent, created) in enumerate(zip(
+            campaign_ids, _iso(send_times), _iso(send_times - np.timedelta64(2, "D"))))
+    ]
+    flow_ids = _ids("FLOW", flows, 6)
+    flow_records = [
+        {"type": "flow", "id": fid, "attributes": {
+            "name": f"Flow {i + 1}", "status": "live", "archived": False, "trigger_type": "Metric",
+            "created": _iso([start64])[0], "updated": _iso([start64 + np.timedelta64(i, "D")])[0]}}
+        for i, fid in enumerate(flow_ids)
+    ]
+
+    # Products with Zipf-like popularity and log-normal prices
+    category_labels = np.array([CATEGORY_NAMES[i % len(CATEGORY_NAMES)] + ("" if i < len(CATEGORY_NAMES) else f" {i}")
+                                for i in range(categories)])
+    product_ids = _ids("SKU", products, 6)
+    product_names = np.char.add("Product ", np.arange(1, products + 1).astype(str))
+    product_categories = category_labels[rng.integers(0, categories, products)]
+    product_prices = np.round(rng.lognormal(3.3, 0.6, products), 2)
+    popularity = 1.0 / np.arange(1, products + 1) ** 1.1
+    popularity /= popularity.sum()
+
+    # Orders: seasonal timestamps, heavy-tailed repeat purchases per profile
+    day_index = rng.choice(days, size=orders, p=_day_weights(start, days, seasonality))
+    order_times = np.sort(start64 + (day_index * 86400 + rng.integers(0, 86400, orders)).astype("timedelta64[s]"))
+    profile_weights = rng.lognormal(0.0, repeat_sigma, profiles)
+    profile_weights /= profile_weights.sum()
+    profile_ids = _ids("PROFILE", profiles)
+    order_profiles = profile_ids[rng.choice(profiles, size=orders, p=profile_weights)]
+
+    # Attribution mix: recent campaigns (sent before the order) or a flow; the rest unattributed
+    source = rng.random(orders)
+    attributed_message = np.full(orders, None, dtype=object)
+    attributed_flow = np.full(orders, None, dtype=object)
+    sent_before = np.searchsorted(send_times, order_times, side="right") - 1
+    recency = rng.geometric(0.35, orders) - 1
+    campaign_pick = sent_before - recency
+    is_campaign = (source < campaign_share) & (campaign_pick >= 0)
+    attributed_message[is_campaign] = campaign_ids[campaign_pick[is_campaign]]
+    is_flow = (source >= campaign_share) & (source < campaign_share + flow_share) & (flows > 0)
+    if flows:
+        attributed_flow[is_flow] = flow_ids[rng.integers(0, flows, is_flow.sum())]
+
+    # Line items: 1 + Poisson items per order, popular products more likely
+    items_per_order = 1 + rng.poisson(0.8, orders)
+    item_order = np.repeat(np.arange(orders), items_per_order)
+    item_product = rng.choice(products, size=len(item_order), p=popularity)
+    item_quantity = 1 + rng.poisson(0.3, len(item_order))
+    item_price = product_prices[item_product]
+    order_values = np.round(np.bincount(item_order, weights=item_price * item_quantity, minlength=orders), 2)
+
+    order_ids = _ids("ORDER", orders)
+    event_ids = _ids("EVTORD", orders)
+    placed = pd.DataFrame({
+        "event_id": event_ids,
+        "metric_id": "PLACED",
+        "profile_id": order_profiles,
+        "datetime": order_times,
+        "value": order_values,
+        "order_id": order_ids,
+        "attributed_message": attributed_message,
+        "attributed_flow": attributed_flow,
+    })
+    order_items = pd.DataFrame({
+        "event_id": event_ids[item_order],
+        "product_id": product_ids[item_product],
+        "product_name": product_names[item_product],
+        "category": product_categories[item_product],
+        "quantity": item_quantity,
+        "item_price": item_price,
+    })
+
+    # Duplicate OrderIds: the same order tracked twice a few seconds apart
+    duplicates = np.flatnonzero(rng.random(orders) < duplicate_rate)
+    if len(duplicates):
+        dup = placed.iloc[duplicates].copy()
+        dup["event_id"] = _ids("EVTDUP", len(duplicates))
+        dup["datetime"] = dup["datetime"] + pd.to_timedelta(rng.integers(1, 30, len(duplicates)), unit="s")
+        dup_items = order_items[order_items["event_id"].isin(set(placed["event_id"].iloc[duplicates]))].copy()
+        dup_items["event_id"] = dup_items["event_id"].map(dict(zip(placed["event_id"].iloc[duplicates], dup["event_id"])))
+        placed = pd.concat([placed, dup], ignore_index=True)
+        order_items = pd.concat([order_items, dup_items], ignore_index=True)
+
+    touches = _email_touches(rng, campaign_ids, send_times, flow_ids, profile_ids, profile_weights, start64, days,
+                             recipients_per_campaign, flow_touches, open_rate, click_rate)
+    events = pd.concat([placed, touches], ignore_index=True).sort_values("datetime", kind="stable", ignore_index=True)
+
+    return {
+        "metrics": [{"type": "metric", "id": mid, "attributes": {"name": name}} for mid, name in METRICS.items()],
+        "campaigns": campaign_records,
+        "flows": flow_records,
+        "events": events,
+        "order_items": order_items,
+    }
+
+def _email_touches(rng, campaign_ids, send_times, flow_ids, profile_ids, profile_weights, start64, days,
+                   recipients_per_campaign, flow_touches, open_rate, click_rate):
+    """Received/Opened/Clicked Email events for campaign sends and flow messages"""
+    recipients = min(recipients_per_campaign, len(profile_ids))
+    received_profiles = [profile_ids[rng.choice(len(profile_ids), size=recipients, replace=False)]
+                         for _ in campaign_ids]
+    sends = pd.DataFrame({
+        "profile_id": np.concatenate(received_profiles) if received_profiles else np.array([], dtype=str),
+        "datetime": np.repeat(send_times, recipients) + rng.integers(0, 600, recipients * len(campaign_ids)).astype("timedelta64[s]"),
+        "message": np.repeat(campaign_ids, recipients).astype(object),
+        "flow": None,
+    })
+    if len(flow_ids) and flow_touches:
+        flow_sends = pd.DataFrame({
+            "profile_id": profile_ids[rng.choice(len(profile_ids), size=flow_touches, p=profile_weights)],
+            "datetime": start64 + rng.integers(0, days * 86400, flow_touches).astype("timedelta64[s]"),
+            "message": None,
+            "flow": flow_ids[rng.integers(0, len(flow_ids), flow_touches)].astype(object),
+        })
+        sends = pd.concat([sends, flow_sends], ignore_index=True)
+
+    opened = sends[rng.random(len(sends)) < open_rate].copy()
+    opened["datetime"] = opened["datetime"] + pd.to_timedelta(rng.exponential(3 * 3600, len(opened)).astype(int), unit="s")
+    clicked = opened[rng.random(len(opened)) < click_rate / max(open_rate, 1e-9)].copy()
+    clicked["datetime"] = clicked["datetime"] + pd.to_timedelta(rng.integers(5, 900, len(clicked)), unit="s")
+
+    frames = []
+    for metric_id, prefix, frame in (("RECEIVED", "EVTRCV", sends), ("OPENED", "EVTOPN", opened),
+                                     ("CLICKED", "EVTCLK", clicked)):
+        frame = frame.reset_index(drop=True)
+        frame.insert(0, "event_id", _ids(prefix, len(frame)))
+        frame.insert(1, "metric_id", metric_id)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+def write_fixtures(dataset, output_dir):
+    """Write a dataset as a fixture directory readable by mock_server.load_dataset"""
+    os.makedirs(output_dir, exist_ok=True)
+    for name in ("metrics", "campaigns", "flows"):
+        with open(os.path.join(output_dir, f"{name}.json"), "w") as f:
+            json.dump(dataset[name], f, indent=2)
+    dataset["events"].to_parquet(os.path.join(output_dir, "events.parquet"), index=False)
+    dataset["order_items"].to_parquet(os.path.join(output_dir, "order_items.parquet"), index=False)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Klaviyo account as Parquet/JSON fixtures")
+    parser.add_argument("output_dir", help="Fixture directory to write")
+    parser.add_argument("--orders", type=int, default=10000)
+    parser.add_argument("--profiles", type=int, help="Default: a third of --orders")
+    parser.add_argument("--campaigns", type=int, default=50)
+    parser.add_argument("--flows", type=int, default=10)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--categories", type=int, default=12)
+    parser.add_argument("--days", type=int, default=365, help="Length of the history, ending today")
+    parser.add_argument("--campaign-share", type=float, default=0.25, help="Fraction of orders attributed to campaigns")
+    parser.add_argument("--flow-share", type=float, default=0.2, help="Fraction of orders attributed to flows")
+    parser.add_argument("--repeat-sigma", type=float, default=1.0,
+                        help="Log-normal spread of purchase propensity; higher means more heavy repeat buyers")
+    parser.add_argument("--duplicate-rate", type=float, default=0.01, help="Fraction of orders tracked twice")
+    parser.add_argument("--seasonality", type=float, default=1.0, help="0 = flat volume, 1 = default seasonal swing")
+    parser.add_argument("--recipients-per-campaign", type=int, default=2000)
+    parser.add_argument("--flow-touches", type=int, default=20000, help="Received Email events from flows")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    dataset = generate_dataset(
+        orders=args.orders, profiles=args.profiles, campaigns=args.campaigns, flows=args.flows,
+        products=args.products, categories=args.categories, days=args.days,
+        campaign_share=args.campaign_share, flow_share=args.flow_share, repeat_sigma=args.repeat_sigma,
+        duplicate_rate=args.duplicate_rate, seasonality=args.seasonality,
+        recipients_per_campaign=args.recipients_per_campaign, flow_touches=args.flow_touches, seed=args.seed)
+    write_fixtures(dataset, args.output_dir)
+    counts = dataset["events"]["metric_id"].value_counts()
+    print(f"Wrote fixtures to {args.output_dir}:")
+    for metric_id, name in METRICS.items():
+        print(f"- {name}: {counts.get(metric_id, 0):,} events")
+    print(f"- {len(dataset['order_items']):,} order items, {len(dataset['campaigns'])} campaigns, "
+          f"{len(dataset['flows'])} flows")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+from datetime import datetime
+import pandas as pd
+from daterange import parse_event_datetime
+
+# Fact table of product attribution: one row per attributed (campaign or flow, product) pair
+PRODUCT_FACT_COLUMNS = {
+    "campaign_id": "string",
+    "product_id": "string",
+    "orders": "int64",
+    "units_sold": "int64",
+    "revenue": "float64",
+}
+
+CAMPAIGN_COLUMNS = {
+    "campaign_id": "string",
+    "campaign_name": "string",
+    "source_type": "string",
+    "send_time": "string",
+}
+
+PRODUCT_COLUMNS = {
+    "product_id": "string",
+    "product_name": "string",
+    "product_type": "string",
+}
+
+def _frame(rows, columns):
+    return pd.DataFrame(rows, columns=list(columns)).astype(columns)
+
+def campaign_dimension(campaigns, flows, ids=()):
+    """One row per campaign and flow, plus an "Unknown" row for any other id in `ids`"""
+    rows = {}
+    for source_type, sources, time_field in (("campaign", campaigns, "created_at"), ("flow", flows, "updated_at")):
+        for source in sources:
+            if not source.get("id"):
+                continue
+            attributes = source.get("attributes", {})
+            rows[source["id"]] = {
+                "campaign_id": source["id"],
+                "campaign_name": attributes.get("name", "Unknown"),
+                "source_type": source_type,
+                "send_time": attributes.get(time_field, attributes.get("updated_at", datetime.utcnow().isoformat()))[:10],
+            }
+    for campaign_id in ids:
+        rows.setdefault(campaign_id, {"campaign_id": campaign_id, "campaign_name": "Unknown", "source_type": "unknown",
+                                      "send_time": None})
+    return _frame(list(rows.values()), CAMPAIGN_COLUMNS)
+
+def product_attribution_tables(campaigns, flows, product_data):
+    """Fact and dimension frames from aggregated product data keyed by (campaign_id, product_id)
+
+    Returns {"product_attribution_results": facts, "campaigns": ..., "products": ...}.
+    """
+    facts, products = [], {}
+    for (campaign_id, product_id), data in product_data.items():
+        facts.append({"campaign_id": campaign_id, "product_id": product_id, "orders": data["orders"],
+                      "units_sold": data["units_sold"], "revenue": data["revenue"]})
+        products.setdefault(product_id, {"product_id": product_id, "product_name": data["product_name"],
+                                         "product_type": data["product_type"]})
+    fact_frame = _frame(facts, PRODUCT_FACT_COLUMNS).sort_values(
+        ["campaign_id", "revenue"], ascending=[True, False], ignore_index=True)
+    return {
+        "product_attribution_results": fact_frame,
+        "campaigns": campaign_dimension(campaigns, flows, fact_frame["campaign_id"].unique()),
+        "products": _frame(list(products.values()), PRODUCT_COLUMNS).sort_values("product_id", ignore_index=True),
+    }
+
+def product_attribution_view(tables):
+    """Facts joined with campaign and product names: the flat frame shown in the dashboards"""
+    facts = tables["product_attribution_results"]
+    view = facts.merge(tables["campaigns"][["campaign_id", "campaign_name", "send_time"]], on="campaign_id", how="left")
+    view = view.merge(tables["products"], on="product_id", how="left")
+    return view[["campaign_id", "campaign_name", "send_time", "product_id", "product_name", "product_type",
+                 "orders", "units_sold", "revenue"]]
+
+# Fact table of orders: one row per deduplicated Placed Order event
+ORDER_FACT_COLUMNS = {
+    "order_id": "string",
+    "datetime": "datetime64[ns]",
+    "profile_id": "string",
+    "value": "float64",
+    "campaign_id": "string",
+    "flow_id": "string",
+    "customer_status": "string",
+}
+
+def order_fact(event, customer_status):
+    """Order fact row for one Placed Order event; customer_status is "new" or "recurring" """
+    properties = event["attributes"]["properties"]
+    return {
+        "order_id": properties.get("OrderId", ""),
+        "datetime": parse_event_datetime(event["attributes"]["datetime"]),
+        "profile_id": event["relationships"]["profile"]["data"]["id"],
+        "value": float(properties.get("$value", 0.0)),
+        "campaign_id": properties.get("$attributed_message") or None,
+        "flow_id": properties.get("$attributed_flow") or None,
+        "customer_status": customer_status,
+    }
+
+def order_fact_frame(rows):
+    """Frame with the order fact dtypes, so every chunk of a streamed export has the same schema"""
+    return _frame(rows, ORDER_FACT_COLUMNS)
+
+# Order history for the customer analyses: the order facts without the per-order customer status
+ORDER_COLUMNS = {column: dtype for column, dtype in ORDER_FACT_COLUMNS.items() if column != "customer_status"}
+
+def order_frame(events):
+    """One row per order (the first event of each OrderId) from Placed Order events, oldest first"""
+    rows = [(properties.get("OrderId", ""), event["attributes"]["datetime"],
+             event["relationships"]["profile"]["data"]["id"], properties.get("$value", 0.0),
+             properties.get("$attributed_message") or None, properties.get("$attributed_flow") or None)
+            for event in events for properties in (event["attributes"]["properties"],)]
+    frame = pd.DataFrame(rows, columns=list(ORDER_COLUMNS)).drop_duplicates("order_id")
+    frame["datetime"] = pd.to_datetime(frame["datetime"], utc=True, format="ISO8601").dt.tz_localize(None)
+    return _frame(frame, ORDER_COLUMNS).sort_values("datetime", kind="stable", ignore_index=True)
+
+def acquisition_source(orders):
+    """The campaign, else the flow, an order is attributed to, or "unattributed" """
+    return orders["campaign_id"].fillna(orders["flow_id"]).fillna("unattributed")
+
+def aggregate_totals(series, measurement):
+    """Total of one measurement per campaign or flow from metric-aggregates `data` grouped by (message, flow)
+
+    Each series holds one value per interval (day by default), so the whole window is their sum. A series is keyed
+    by its message, else its flow; series without either are left out.
+    """
+    totals = {}
+    for item in series:
+        source_id = next((dimension for dimension in item["dimensions"] if dimension), None)
+        if source_id:
+            totals[source_id] = totals.get(source_id, 0.0) + sum(item["measurements"][measurement])
+    return totals
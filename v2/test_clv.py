@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+from clv import acquisition_ltv, customer_metrics
+from tables import acquisition_source, order_frame
+
+def _orders(count=400, profiles=60, seed=11):
+    rng = np.random.default_rng(seed)
+    days = rng.integers(0, 300, count)
+    sources = [("c1", None), ("c2", None), (None, "f1"), (None, None)]
+    events = []
+    for i in range(count):
+        campaign_id, flow_id = sources[rng.integers(len(sources))]
+        events.append({"attributes": {
+            "datetime": (pd.Timestamp("2025-01-01") + pd.Timedelta(days=int(days[i]), minutes=int(i))).isoformat(),
+            "properties": {"OrderId": f"o{i}", "$value": float(rng.integers(1, 200)),
+                           "$attributed_message": campaign_id, "$attributed_flow": flow_id}},
+            "relationships": {"profile": {"data": {"id": f"p{rng.integers(profiles)}"}}}})
+    return order_frame(events)
+
+def _brute_force(orders):
+    """Per-profile metrics, one profile at a time"""
+    rows = []
+    for profile_id, group in orders.groupby("profile_id", sort=False):
+        gaps = group["datetime"].diff().dropna() / pd.Timedelta(days=1)
+        rows.append({
+            "profile_id": profile_id,
+            "first_order_at": group["datetime"].iloc[0],
+            "last_order_at": group["datetime"].iloc[-1],
+            "orders": len(group),
+            "total_revenue": group["value"].sum(),
+            "average_order_value": group["value"].mean(),
+            "days_to_second_order": gaps.iloc[0] if len(gaps) else np.nan,
+            "median_days_between_orders": gaps.median() if len(gaps) else np.nan,
+            "acquisition_source_id": acquisition_source(group.iloc[:1]).iloc[0],
+        })
+    return pd.DataFrame(rows)
+
+def test_customer_metrics_match_brute_force():
+    orders = _orders()
+    customers = customer_metrics(orders)
+    expected = _brute_force(orders)
+    pd.testing.assert_frame_equal(customers[expected.columns].sort_values("profile_id", ignore_index=True),
+                                  expected.sort_values("profile_id", ignore_index=True), check_dtype=False)
+
+def test_acquisition_ltv_totals():
+    customers = customer_metrics(_orders())
+    ltv = acquisition_ltv(customers).set_index("acquisition_source_id")
+    expected = customers.groupby("acquisition_source_id")["total_revenue"].sum()
+    pd.testing.assert_series_equal(ltv["total_ltv"].sort_index(), expected.sort_index(), check_names=False)
+    assert ltv["customers"].sum() == len(customers)
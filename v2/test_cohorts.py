@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+from cohorts import cohort_table
+from tables import acquisition_source, order_frame
+
+def _orders(count=400, profiles=60, seed=7):
+    rng = np.random.default_rng(seed)
+    days = rng.integers(0, 400, count)
+    sources = [("c1", None), ("c2", None), (None, "f1"), (None, None)]
+    events = []
+    for i in range(count):
+        campaign_id, flow_id = sources[rng.integers(len(sources))]
+        events.append({"attributes": {
+            "datetime": (pd.Timestamp("2025-01-01") + pd.Timedelta(days=int(days[i]), hours=int(i % 24))).isoformat(),
+            "properties": {"OrderId": f"o{i}", "$value": float(rng.integers(1, 200)),
+                           "$attributed_message": campaign_id, "$attributed_flow": flow_id}},
+            "relationships": {"profile": {"data": {"id": f"p{rng.integers(profiles)}"}}}})
+    return order_frame(events)
+
+def _brute_force(orders, by_source):
+    """Cohort cells by grouping on each profile's first order"""
+    orders = orders.assign(month=orders["datetime"].dt.to_period("M"))
+    first = orders.groupby("profile_id").head(1).set_index("profile_id")
+    orders["cohort"] = orders["profile_id"].map(first["month"])
+    orders["source_id"] = orders["profile_id"].map(acquisition_source(first)) if by_source else "all"
+    orders["months_since_first"] = (orders["month"] - orders["cohort"]).apply(lambda offset: offset.n)
+    cells = orders.groupby(["source_id", "cohort", "months_since_first"]).agg(
+        customers=("profile_id", "nunique"), revenue=("value", "sum")).reset_index()
+    sizes = cells[cells["months_since_first"] == 0].set_index(["source_id", "cohort"])["customers"]
+    cells["retention"] = cells["customers"] / [sizes[key] for key in zip(cells["source_id"], cells["cohort"])]
+    cells["cohort"] = cells["cohort"].astype(str)
+    return cells
+
+def test_cohort_table_matches_brute_force():
+    orders = _orders()
+    for by_source in (False, True):
+        table = cohort_table(orders, by_source)
+        expected = _brute_force(orders, by_source)
+        keys = ["source_id", "cohort", "months_since_first"]
+        if not by_source:
+            table = table.assign(source_id="all")
+        table = table.sort_values(keys, ignore_index=True)
+        expected = expected.sort_values(keys, ignore_index=True)[table.columns]
+        pd.testing.assert_frame_equal(table, expected, check_dtype=False)
+
+def test_cohort_table_empty():
+    assert cohort_table(_orders().iloc[:0]).empty
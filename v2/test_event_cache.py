@@ -0,0 +1,56 @@
+from datetime import datetime
+import event_cache
+from event_cache import cache_gaps, fetch_events, new_customer_orders
+
+METRIC_ID = "PLACED"
+DATE_RANGE = (datetime(2026, 1, 1), datetime(2026, 1, 3))
+
+def _event(i):
+    return {"id": f"e{i}", "attributes": {"datetime": f"2026-01-01T0{i}:00:00+00:00", "properties": {}},
+            "relationships": {"metric": {"data": {"id": METRIC_ID}}}}
+
+def _api(fail_second_page):
+    """Two-page /events stand-in; the second page returns None (a failed request) when asked to"""
+    calls = []
+
+    def request(endpoint, params=None):
+        calls.append(dict(params))
+        if "page[cursor]" not in params:
+            return {"data": [_event(1)], "links": {"next": "https://a.klaviyo.com/api/events?page[cursor]=2"}}
+        return None if fail_second_page else {"data": [_event(2)], "links": {}}
+    return request, calls
+
+def test_failed_page_is_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(event_cache, "CACHE_DIR", str(tmp_path))
+    request, _ = _api(fail_second_page=True)
+    events = fetch_events(request, "pk_test", METRIC_ID, DATE_RANGE)
+    assert [e["id"] for e in events] == ["e1"]
+    assert cache_gaps("pk_test", METRIC_ID, DATE_RANGE) == [DATE_RANGE]
+
+    request, calls = _api(fail_second_page=False)
+    events = fetch_events(request, "pk_test", METRIC_ID, DATE_RANGE)
+    assert [e["id"] for e in events] == ["e1", "e2"]
+    assert len(calls) == 2
+    assert cache_gaps("pk_test", METRIC_ID, DATE_RANGE) == []
+
+    request, calls = _api(fail_second_page=False)
+    assert [e["id"] for e in fetch_events(request, "pk_test", METRIC_ID, DATE_RANGE)] == ["e1", "e2"]
+    assert calls == []
+
+def test_prior_orders_looked_up_once_per_profile():
+    def order(event_id, profile_id, hour):
+        return {"id": event_id, "attributes": {"datetime": f"2026-01-01T{hour:02d}:00:00+00:00", "properties": {}},
+                "relationships": {"profile": {"data": {"id": profile_id}}}}
+    events = [order("a2", "A", 9), order("a1", "A", 3), order("b1", "B", 4), order("b2", "B", 4),
+              order("c1", "C", 5), order("d1", "D", 6)]
+    calls = []
+
+    def request(endpoint, params=None):
+        calls.append((endpoint, params["filter"]))
+        if endpoint == "profiles/C/events":
+            return {"data": [{"id": "older"}]}
+        return None if endpoint == "profiles/D/events" else {"data": []}
+
+    assert new_customer_orders(request, METRIC_ID, events) == {"a1", "b1", "b2", "d1"}
+    assert len(calls) == 4
+    assert ("profiles/A/events", f'equals(metric_id,"{METRIC_ID}"),less-than(datetime,2026-01-01T03:00:00+00:00)') in calls
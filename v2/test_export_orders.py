@@ -0,0 +1,48 @@
+import export_orders
+from event_cache import new_customer_orders
+from export_orders import CustomerStatus
+
+METRIC_ID = "PLACED"
+
+def _order(event_id, profile_id, hour):
+    return {"id": event_id, "attributes": {"datetime": f"2026-01-01T{hour:02d}:00:00+00:00", "properties": {}},
+            "relationships": {"profile": {"data": {"id": profile_id}}}}
+
+# Time-ordered, as the export streams them: B has two orders at its first datetime, C ordered before the window
+EVENTS = [_order("a1", "A", 1), _order("b1", "B", 2), _order("b2", "B", 2), _order("c1", "C", 3),
+          _order("a2", "A", 4), _order("b3", "B", 5), _order("c2", "C", 6), _order("a3", "A", 7)]
+
+def _api():
+    calls = []
+
+    def request(endpoint, params=None):
+        """Orders of the profile before the filter's datetime; C also ordered before the window"""
+        calls.append(endpoint)
+        profile_id = endpoint.split("/")[1]
+        before = params["filter"].split("less-than(datetime,")[1].rstrip(")")
+        prior = [e for e in EVENTS if e["relationships"]["profile"]["data"]["id"] == profile_id
+                 and e["attributes"]["datetime"] < before]
+        return {"data": prior + ([{"id": "older"}] if profile_id == "C" else [])}
+    return request, calls
+
+def _statuses(classify):
+    return {event["id"] for event in EVENTS if classify(event) == "new"}
+
+def test_export_and_revenue_split_agree():
+    request, calls = _api()
+    assert _statuses(CustomerStatus(request, METRIC_ID)) == new_customer_orders(request, METRIC_ID, EVENTS)
+    assert _statuses(CustomerStatus(request, METRIC_ID)) == {"a1", "b1", "b2"}
+    assert calls.count("profiles/B/events") == 3
+
+def test_forgotten_profiles_keep_their_status(monkeypatch):
+    monkeypatch.setattr(export_orders, "PROFILE_WINDOW", 1)
+    request, calls = _api()
+    classify = CustomerStatus(request, METRIC_ID)
+    assert _statuses(classify) == {"a1", "b1", "b2"}
+    assert len(classify.first_orders) == 1
+    assert len(calls) > 3
+
+def test_without_lookups_first_datetime_is_new():
+    request, calls = _api()
+    assert _statuses(CustomerStatus(request, METRIC_ID, lookups=False)) == {"a1", "b1", "b2", "c1"}
+    assert not calls
@@ -0,0 +1,40 @@
+from datetime import datetime
+from functools import partial
+import pytest
+import app
+import klaviyo_client
+import product
+import product_app
+import revenue
+import revenue_app
+from mock_server import MockKlaviyo, start_mock_server
+from synthetic import generate_dataset
+
+API_KEY = "pk_test"
+DATE_RANGE = (datetime(2000, 1, 1), datetime(2100, 1, 1))
+
+@pytest.fixture
+def mock(monkeypatch):
+    """A mock account with 5 campaigns and 3 flows, served two records per page"""
+    mock = MockKlaviyo(generate_dataset(orders=50, campaigns=5, flows=3, products=5, days=30,
+                                        recipients_per_campaign=5, flow_touches=5), page_size=2)
+    server, api_url = start_mock_server(mock)
+    monkeypatch.setattr(klaviyo_client, "KLAVIYO_API_URL", api_url)
+    monkeypatch.setattr(product, "KLAVIYO_API_KEY", API_KEY)
+    monkeypatch.setattr(revenue, "KLAVIYO_API_KEY", API_KEY)
+    yield mock
+    server.shutdown()
+    server.server_close()
+
+@pytest.mark.parametrize("fetch", [
+    partial(app.get_campaigns_and_flows, API_KEY),
+    partial(product_app.get_campaigns_and_flows, API_KEY),
+    partial(revenue_app.get_campaigns_and_flows, API_KEY),
+    product.get_campaigns_and_flows,
+    revenue.get_campaigns_and_flows,
+], ids=["app", "product_app", "revenue_app", "product", "revenue"])
+def test_campaigns_and_flows_follow_every_page(mock, fetch):
+    campaigns, flows = fetch(DATE_RANGE)
+    assert sorted(c["id"] for c in campaigns) == sorted(c["id"] for c in mock.campaigns)
+    assert sorted(f["id"] for f in flows) == sorted(f["id"] for f in mock.flows)
+    assert mock.stats_snapshot()["requests"]["campaigns"] == 3
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+from multitouch import POSITION_ENDS, UNATTRIBUTED, model_comparison, multi_touch_attribution
+from tables import acquisition_source
+
+START = pd.Timestamp("2026-01-01")
+
+def _frames(orders=150, touches=600, profiles=30, seed=3):
+    rng = np.random.default_rng(seed)
+    sources = [("c1", None), ("c2", None), (None, "f1"), (None, None)]
+    picked = [sources[i] for i in rng.integers(len(sources), size=orders)]
+    order_frame = pd.DataFrame({
+        "profile_id": [f"p{i}" for i in rng.integers(profiles, size=orders)],
+        "datetime": START + pd.to_timedelta(rng.integers(0, 30 * 86400, orders), unit="s"),
+        "value": rng.integers(1, 200, orders).astype(float),
+        "campaign_id": [campaign_id for campaign_id, _ in picked],
+        "flow_id": [flow_id for _, flow_id in picked],
+    }).sort_values("datetime", ignore_index=True)
+    touch_frame = pd.DataFrame({
+        "profile_id": [f"p{i}" for i in rng.integers(profiles, size=touches)],
+        # Whole hours, so some touches fall exactly on an order or on the lookback edge
+        "datetime": START + pd.to_timedelta(rng.integers(-5 * 24, 30 * 24, touches), unit="h"),
+        "source_id": rng.choice(["c1", "c2", "c3", "f1", "f2"], touches),
+    }).sort_values("datetime", kind="stable", ignore_index=True)
+    return order_frame, touch_frame
+
+def _brute_force(orders, touches, lookback_days, half_life_days):
+    """Revenue per (model, source), order by order"""
+    revenue = {}
+    for order in orders.itertuples():
+        window = touches[(touches["profile_id"] == order.profile_id)
+                         & (touches["datetime"] <= order.datetime)
+                         & (touches["datetime"] >= order.datetime - pd.Timedelta(days=lookback_days))]
+        n = len(window)
+        if n == 0:
+            weights = {model: {UNATTRIBUTED: 1.0} for model in
+                       ("first_touch", "last_touch", "linear", "time_decay", "position_based")}
+        else:
+            ages = (order.datetime - window["datetime"]) / pd.Timedelta(days=1)
+            decay = np.exp2(-ages.to_numpy() / half_life_days)
+            ends = [1.0] if n == 1 else [0.5, 0.5] if n == 2 else \
+                [POSITION_ENDS] + [(1 - 2 * POSITION_ENDS) / (n - 2)] * (n - 2) + [POSITION_ENDS]
+            per_touch = {
+                "first_touch": [1.0] + [0.0] * (n - 1),
+                "last_touch": [0.0] * (n - 1) + [1.0],
+                "linear": [1.0 / n] * n,
+                "time_decay": decay / decay.sum(),
+                "position_based": ends,
+            }
+            weights = {}
+            for model, values in per_touch.items():
+                for source_id, weight in zip(window["source_id"], values):
+                    weights.setdefault(model, {})
+                    weights[model][source_id] = weights[model].get(source_id, 0.0) + weight
+        for model, shares in weights.items():
+            for source_id, weight in shares.items():
+                revenue[(model, source_id)] = revenue.get((model, source_id), 0.0) + weight * order.value
+    stored = orders.assign(source_id=acquisition_source(orders)).groupby("source_id")["value"].sum()
+    for source_id, value in stored.items():
+        revenue[("property", source_id)] = value
+    return revenue
+
+def test_models_match_brute_force():
+    orders, touches = _frames()
+    for lookback_days, half_life_days in ((5.0, 1.0), (2.5, 0.5)):
+        table = multi_touch_attribution(orders, touches, lookback_days, half_life_days)
+        result = {(model, source_id): value for model, source_id, value
+                  in zip(table["model"], table["source_id"], table["revenue"])}
+        expected = {key: value for key, value in _brute_force(orders, touches, lookback_days, half_life_days).items()
+                    if abs(value) > 1e-9}
+        assert result.keys() == expected.keys()
+        for key, value in expected.items():
+            assert np.isclose(result[key], value), key
+        # Every model hands out each order's revenue exactly once
+        assert np.allclose(model_comparison(table).sum(), orders["value"].sum())
+
+def test_orders_without_touches():
+    orders, touches = _frames()
+    table = multi_touch_attribution(orders, touches.iloc[:0])
+    linear = table[table["model"] == "linear"]
+    assert linear["source_id"].tolist() == [UNATTRIBUTED]
+    assert linear["conversions"].iloc[0] == len(orders)
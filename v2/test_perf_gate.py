@@ -0,0 +1,13 @@
+import json
+import sys
+import perf_gate
+
+def test_tolerance_overrides_do_not_reach_the_baseline(tmp_path, monkeypatch):
+    tolerances = {"time": 0.25, "stages": {"revenue_share/fetch": {"time": 0.5}}}
+    baseline, results = tmp_path / "baseline.json", tmp_path / "results.json"
+    baseline.write_text(json.dumps({"config": {}, "results": [], "tolerances": tolerances}))
+    results.write_text(json.dumps({"config": {}, "results": []}))
+    monkeypatch.setattr(sys, "argv", ["perf_gate.py", "--baseline", str(baseline), "--results", str(results),
+                                      "--time-tolerance", "0.9", "--update-baseline"])
+    perf_gate.main()
+    assert json.loads(baseline.read_text())["tolerances"] == tolerances
@@ -0,0 +1,49 @@
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+from rollup import RollupIndex
+
+def _frames(seed=5):
+    rng = np.random.default_rng(seed)
+    # A 60-day window with some days missing, as in a revenue share result
+    days = sorted(rng.choice(60, 45, replace=False))
+    daily = pd.DataFrame({
+        "date": [date(2026, 1, 1) + timedelta(days=int(day)) for day in days],
+        "total_shop_revenue": rng.integers(100, 1000, len(days)).astype(float),
+        "klaviyo_attributed_revenue": rng.integers(0, 100, len(days)).astype(float),
+    })
+    source_daily = pd.DataFrame({
+        "date": [str(date(2026, 1, 1) + timedelta(days=int(day))) for day in rng.integers(0, 60, 120)],
+        "source_id": rng.choice(["c1", "c2", "f1"], 120),
+        "revenue": rng.integers(1, 50, 120).astype(float),
+    })
+    return daily, source_daily
+
+def _between(frame, start, end):
+    dates = pd.to_datetime(frame["date"]).dt.date
+    return frame[(dates >= start) & (dates <= end)]
+
+def test_range_totals_match_filtered_sums():
+    daily, source_daily = _frames()
+    index = RollupIndex.from_frames(daily, source_daily)
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        start = date(2025, 12, 20) + timedelta(days=int(rng.integers(0, 80)))
+        end = start + timedelta(days=int(rng.integers(-3, 40)))
+        days = _between(daily, start, end)
+        assert np.isclose(index.total_revenue(start, end), days["total_shop_revenue"].sum())
+        assert np.isclose(index.attributed_revenue(start, end), days["klaviyo_attributed_revenue"].sum())
+        sources = _between(source_daily, start, end).groupby("source_id")["revenue"].sum()
+        for source_id in ("c1", "c2", "f1"):
+            assert np.isclose(index.source_revenue(source_id, start, end), sources.get(source_id, 0.0))
+        pd.testing.assert_series_equal(index.sources_revenue(start, end).sort_index(),
+                                       sources[sources != 0].sort_index(), check_names=False, check_index_type=False)
+
+def test_open_ranges_and_unknown_sources():
+    daily, source_daily = _frames()
+    index = RollupIndex.from_frames(daily, source_daily)
+    assert np.isclose(index.total_revenue(), daily["total_shop_revenue"].sum())
+    assert index.summary()["klaviyo_revenue_share"] == index.share()
+    assert index.source_revenue("missing") == 0.0
+    start, end = index.last(7)
+    assert (end - start).days == 6 and end == index.last_day
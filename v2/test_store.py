@@ -0,0 +1,63 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from klaviyo_client import account_key
+from store import connect, load_account, revenue_by_campaign, share_for_date
+
+API_KEY = "pk_test"
+DATE_RANGE = (datetime(2026, 1, 1), datetime(2026, 2, 1))
+
+def _events(count=300, seed=9):
+    rng = np.random.default_rng(seed)
+    sources = [("c1", None), ("c2", None), (None, "f1"), ("c1", "f1"), (None, None)]
+    events = []
+    for i in range(count):
+        campaign_id, flow_id = sources[rng.integers(len(sources))]
+        moment = DATE_RANGE[0] + pd.Timedelta(minutes=int(rng.integers(0, 31 * 1440)))
+        events.append({"attributes": {"datetime": moment.isoformat() + "+00:00", "properties": {
+            # Some order ids repeat; the store keeps the first event of each
+            "OrderId": f"o{rng.integers(count - 20)}", "$value": float(rng.integers(1, 200)),
+            "$attributed_message": campaign_id, "$attributed_flow": flow_id,
+            "Items": [{"ProductID": "sku1", "ProductName": "Mug", "Quantity": 1, "ItemPrice": 5.0}]}},
+            "relationships": {"profile": {"data": {"id": f"p{rng.integers(50)}"}}}})
+    return events
+
+def _orders(events):
+    """The loaded orders as a frame, first event per OrderId"""
+    rows = [(properties["OrderId"], event["attributes"]["datetime"][:10], properties["$value"],
+             properties["$attributed_message"], properties["$attributed_flow"])
+            for event in events for properties in (event["attributes"]["properties"],)]
+    orders = pd.DataFrame(rows, columns=["order_id", "date", "value", "campaign_id", "flow_id"])
+    orders = orders.drop_duplicates("order_id")
+    source_id = orders["campaign_id"].fillna(orders["flow_id"])
+    return orders.assign(source_id=source_id, attributed=orders["value"].where(source_id.notna(), 0.0))
+
+def test_rollups_match_groupby(tmp_path):
+    events = _events()
+    conn = connect(str(tmp_path / "store.db"))
+    try:
+        # Loading the same window twice gives the same rollups
+        for _ in range(2):
+            load_account(conn, API_KEY, DATE_RANGE, [{"id": "c1", "attributes": {"name": "Launch"}}], [], events)
+        account = account_key(API_KEY)
+        orders = _orders(events)
+
+        daily = pd.read_sql_query("SELECT date, orders, total_revenue, attributed_revenue FROM daily_rollup "
+                                  "WHERE account = ? ORDER BY date", conn, params=(account,))
+        expected = orders.groupby("date").agg(orders=("order_id", "size"), total_revenue=("value", "sum"),
+                                              attributed_revenue=("attributed", "sum"))
+        pd.testing.assert_frame_equal(daily, expected.reset_index(), check_dtype=False)
+
+        by_campaign = revenue_by_campaign(conn, account, "2026-01-05", "2026-01-20").set_index("source_id")
+        window = orders[(orders["date"] >= "2026-01-05") & (orders["date"] <= "2026-01-20")]
+        expected = window.groupby("source_id")["value"].agg(["size", "sum"])
+        assert by_campaign["orders"].sort_index().tolist() == expected["size"].sort_index().tolist()
+        assert np.allclose(by_campaign["revenue"].sort_index(), expected["sum"].sort_index())
+        assert by_campaign.loc["c1", "name"] == "Launch"
+
+        day = orders[orders["date"] == "2026-01-10"]
+        share = share_for_date(conn, account, "2026-01-10")
+        assert share["orders"] == len(day) and np.isclose(share["total_shop_revenue"], day["value"].sum())
+        assert share_for_date(conn, account, "2025-12-31") is None
+    finally:
+        conn.close()
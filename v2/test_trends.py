@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+from trends import ShareTrends, share_trends
+
+def _daily(days, start="2026-01-01"):
+    return pd.DataFrame({
+        "date": pd.date_range(start, periods=days).date,
+        "total_shop_revenue": np.full(days, 100.0),
+        "klaviyo_attributed_revenue": np.full(days, 30.0),
+    })
+
+def test_share_trends_shorter_than_windows():
+    trends = share_trends(_daily(20))
+    assert len(trends) == 20
+    assert trends["share_28d"].isna().all()
+    assert trends["share_7d"].notna().sum() == 14
+    assert trends["share_zscore"].isna().all()
+    assert not trends["anomaly"].any()
+
+def test_share_trends_single_day():
+    trends = share_trends(_daily(1))
+    assert len(trends) == 1
+    assert trends["klaviyo_revenue_share"].iloc[0] == 30.0
+    assert trends["share_7d"].isna().all()
+
+def test_incremental_update_starts_short():
+    daily = _daily(40)
+    trends = ShareTrends()
+    first = trends.update(daily.iloc[:5])
+    rest = trends.update(daily.iloc[5:])
+    assert len(first) == 5 and first["share_7d"].isna().all()
+    pd.testing.assert_frame_equal(pd.concat([first, rest], ignore_index=True), share_trends(daily))
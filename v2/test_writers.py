@@ -0,0 +1,43 @@
+import os
+import threading
+import pandas as pd
+import pyarrow.parquet as pq
+from instrumentation import RunProfile, current_profile, profiling, run_profile
+from writers import new_run_dir, open_writer, write_results
+
+def test_empty_results_stay_readable(tmp_path):
+    empty = pd.DataFrame({"date": pd.Series([], dtype="string"), "revenue": pd.Series([], dtype="float64")})
+    paths = write_results(empty, "empty", str(tmp_path), formats=["parquet", "csv", "ndjson"])
+    assert pq.read_table(paths[0]).schema.names == ["date", "revenue"]
+    assert open(paths[1]).read().strip() == "date,revenue"
+    with open_writer(str(tmp_path), "no_records", "parquet") as writer:
+        writer.write_records([])
+    assert pq.read_table(writer.path).num_rows == 0
+
+def test_committed_files_follow_the_umask(tmp_path):
+    old = os.umask(0o027)
+    try:
+        path = write_results(pd.DataFrame({"a": [1]}), "perms", str(tmp_path), formats=["ndjson"])[0]
+    finally:
+        os.umask(old)
+    assert os.stat(path).st_mode & 0o777 == 0o640
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+def test_sessions_keep_their_own_run_dir_and_profile(tmp_path):
+    seen = {}
+
+    def session(name):
+        profile = RunProfile()
+        with profiling(profile):
+            current_profile().record_request("events", 200, 0.01, 10)
+            seen[name] = (new_run_dir(str(tmp_path)), profile)
+
+    threads = [threading.Thread(target=session, args=(name,)) for name in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen["a"][0] != seen["b"][0]
+    for _, profile in seen.values():
+        assert profile.report()["endpoints"]["events"]["requests"] == 1
+    assert current_profile() is run_profile
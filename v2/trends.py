@@ -0,0 +1,155 @@
+import warnings
+import numpy as np
+import pandas as pd
+
+# Trailing windows, in days, for the rolling share columns (share_7d, share_28d)
+WINDOWS = (7, 28)
+
+# Days before a day that its anomaly scores compare it against
+BASELINE_DAYS = 28
+
+# Fewest days with orders in the baseline before a day is scored at all
+MIN_BASELINE_DAYS = 14
+
+# |z| above this flags a day; the z-score uses the baseline mean and standard deviation
+Z_THRESHOLD = 3.0
+
+# |modified z| above this flags a day; it uses the baseline median and median absolute deviation
+MAD_THRESHOLD = 3.5
+
+# Daily rows an incremental update needs before its first new day: the longest window or baseline
+TAIL_DAYS = max(max(WINDOWS) - 1, 2 * WINDOWS[0] - 1, BASELINE_DAYS)
+
+# Most recent days an incremental update may send again, e.g. while their orders are still arriving
+REVISION_DAYS = 7
+
+def _dense_days(daily):
+    """Dates, total and attributed revenue as arrays with one entry per calendar day, missing days as zero"""
+    days = pd.to_datetime(daily["date"]).to_numpy().astype("datetime64[D]")
+    first = days.min()
+    positions = (days - first).astype(int)
+    length = positions.max() + 1
+    total = np.bincount(positions, weights=daily["total_shop_revenue"].to_numpy(float), minlength=length)
+    attributed = np.bincount(positions, weights=daily["klaviyo_attributed_revenue"].to_numpy(float), minlength=length)
+    return first + np.arange(length), total, attributed
+
+def _trailing_sums(values, window):
+    """Sum of each day and the window - 1 days before it; NaN until the first full window"""
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    sums = np.full(len(values), np.nan)
+    if len(values) >= window:
+        sums[window - 1:] = cumulative[window:] - cumulative[:len(values) - window + 1]
+    return sums
+
+def _lag(values, days):
+    lagged = np.full(len(values), np.nan)
+    if days < len(values):
+        lagged[days:] = values[:len(values) - days]
+    return lagged
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / denominator * 100, np.nan)
+
+def _zscores(shares):
+    """Score each day against the mean and standard deviation of the BASELINE_DAYS before it"""
+    valid = ~np.isnan(shares)
+    values = np.where(valid, shares, 0.0)
+    count = _lag(_trailing_sums(valid.astype(float), BASELINE_DAYS), 1)
+    mean = _lag(_trailing_sums(values, BASELINE_DAYS), 1) / count
+    square_mean = _lag(_trailing_sums(values * values, BASELINE_DAYS), 1) / count
+    with np.errstate(divide="ignore", invalid="ignore"):
+        std = np.sqrt(np.maximum(square_mean - mean * mean, 0.0) * count / (count - 1))
+        z = (shares - mean) / std
+    z[~(count >= MIN_BASELINE_DAYS) | ~(std > 0)] = np.nan
+    return z
+
+def _mad_scores(shares):
+    """Modified z-scores against the median and MAD of the BASELINE_DAYS before each day
+
+    Medians need the window itself rather than running sums, but at a fixed window length this is still linear.
+    """
+    padded = np.concatenate((np.full(BASELINE_DAYS, np.nan), shares))
+    baseline = np.lib.stride_tricks.sliding_window_view(padded, BASELINE_DAYS)[:len(shares)]
+    with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"):
+        # Days whose baseline has no orders at all give all-NaN slices
+        warnings.simplefilter("ignore", RuntimeWarning)
+        median = np.nanmedian(baseline, axis=1)
+        mad = np.nanmedian(np.abs(baseline - median[:, None]), axis=1)
+        scores = 0.6745 * (shares - median) / mad
+    scores[~(np.sum(~np.isnan(baseline), axis=1) >= MIN_BASELINE_DAYS) | ~(mad > 0)] = np.nan
+    return scores
+
+def _trend_frame(dates, total, attributed):
+    share = _ratio(attributed, total)
+    frame = {
+        "date": dates,
+        "total_shop_revenue": total,
+        "klaviyo_attributed_revenue": attributed,
+        "klaviyo_revenue_share": share,
+    }
+    for window in WINDOWS:
+        frame[f"share_{window}d"] = _ratio(_trailing_sums(attributed, window), _trailing_sums(total, window))
+    # Percentage points against the 7-day share a week earlier
+    frame["share_7d_wow_delta"] = frame["share_7d"] - _lag(frame["share_7d"], 7)
+    frame["share_zscore"] = _zscores(share)
+    frame["share_mad_score"] = _mad_scores(share)
+    frame["anomaly"] = ((np.abs(frame["share_zscore"]) > Z_THRESHOLD)
+                        | (np.abs(frame["share_mad_score"]) > MAD_THRESHOLD))
+    return pd.DataFrame(frame)
+
+def share_trends(daily):
+    """Rolling shares, week-over-week deltas and anomaly flags for a daily revenue share frame
+
+    `daily` needs date, total_shop_revenue and klaviyo_attributed_revenue columns, as in the revenue share results.
+    Days without orders get a row with NaN shares and are left out of the anomaly baselines.
+    """
+    return _trend_frame(*_dense_days(daily))
+
+class ShareTrends:
+    """share_trends that grows as days arrive, scoring only the new days
+
+    Keeps the last TAIL_DAYS + REVISION_DAYS days of revenue as state. The last REVISION_DAYS days can be sent again
+    (e.g. today, once its orders are complete) and are rescored.
+    """
+
+    def __init__(self, tail=None, truncated=False):
+        self.tail = tail
+        # Whether older days were dropped from the tail, so the start of the tail is not the start of the history
+        self.truncated = truncated
+
+    def update(self, daily):
+        """Add or revise days and return their trend rows"""
+        dates, total, attributed = _dense_days(daily)
+        new_rows = len(dates)
+        if self.tail is not None:
+            tail_dates, tail_total, tail_attributed = self.tail
+            if self.truncated and dates[0] < tail_dates[0] + TAIL_DAYS:
+                raise ValueError(f"Cannot revise {dates[0]}: "
+                                 f"only days from {tail_dates[0] + TAIL_DAYS} on can be sent again")
+            # Days sent again replace the kept ones; days skipped in between count as zero
+            keep = tail_dates < dates[0]
+            start = tail_dates[keep][-1] + 1 if keep.any() else dates[0]
+            gap = np.arange(start, dates[0])
+            dates = np.concatenate((tail_dates[keep], gap, dates))
+            total = np.concatenate((tail_total[keep], np.zeros(len(gap)), total))
+            attributed = np.concatenate((tail_attributed[keep], np.zeros(len(gap)), attributed))
+            new_rows += len(gap)
+        self.truncated = self.truncated or len(dates) > TAIL_DAYS + REVISION_DAYS
+        self.tail = tuple(values[-(TAIL_DAYS + REVISION_DAYS):] for values in (dates, total, attributed))
+        return _trend_frame(dates, total, attributed).iloc[-new_rows:].reset_index(drop=True)
+
+    def state(self):
+        """JSON-friendly state, for from_state"""
+        if self.tail is None:
+            return None
+        dates, total, attributed = self.tail
+        return {"dates": [str(d) for d in dates], "total": total.tolist(), "attributed": attributed.tolist(),
+                "truncated": self.truncated}
+
+    @classmethod
+    def from_state(cls, state):
+        if state is None:
+            return cls()
+        return cls((np.array(state["dates"], dtype="datetime64[D]"), np.array(state["total"], dtype=float),
+                    np.array(state["attributed"], dtype=float)), state["truncated"])
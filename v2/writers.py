@@ -0,0 +1,212 @@
+import os
+import gzip
+import json
+import secrets
+import threading
+from datetime import datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Analysis results are written here, one sub-directory per run
+OUTPUT_DIR = os.getenv("KLAVIYO_OUTPUT_DIR", "output")
+
+# Comma-separated formats written for every result: any of parquet, ndjson, csv
+OUTPUT_FORMATS = tuple(f.strip() for f in os.getenv("KLAVIYO_OUTPUT_FORMATS", "parquet,ndjson").split(",") if f.strip())
+
+# Set KLAVIYO_OUTPUT_GZIP=1 to gzip NDJSON and CSV files and use gzip instead of snappy inside Parquet
+OUTPUT_GZIP = os.getenv("KLAVIYO_OUTPUT_GZIP", "") not in ("", "0")
+
+# Written into every output directory: account metadata and the tables with their files, rows and columns
+MANIFEST_FILE = "manifest.json"
+
+# Rows serialized per chunk, so large results never exist twice in memory in serialized form
+CHUNK_ROWS = 50000
+
+class ResultWriter:
+    """Stream chunks of rows into a temp file and rename it into place on commit
+
+    Use as a context manager: the file only appears under its final name if the block succeeds.
+    """
+
+    extension = ""
+    # Whether compress=True gzips the whole file (and adds .gz to its name)
+    gzip_file = True
+
+    def __init__(self, output_dir, stem, compress=False):
+        self.compress = compress
+        gzipped = compress and self.gzip_file
+        self.path = os.path.join(output_dir, self.file_name(stem, compress))
+        # Same directory as the final file, so the rename is atomic. Created with mode 0o666 like open() so the
+        # process umask applies, unlike mkstemp's owner-only files.
+        self.tmp_path = os.path.join(output_dir, f".{stem}.{secrets.token_hex(8)}.tmp")
+        fd = os.open(self.tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        self.file = os.fdopen(fd, "wb")
+        self.stream = gzip.GzipFile(fileobj=self.file, mode="wb") if gzipped else self.file
+        self.rows = 0
+
+    @classmethod
+    def file_name(cls, stem, compress=False):
+        return stem + cls.extension + (".gz" if compress and cls.gzip_file else "")
+
+    def write_chunk(self, df):
+        raise NotImplementedError
+
+    def write_frame(self, df):
+        # An empty frame is still written once, so the file gets its columns (CSV header, Parquet schema)
+        for start in range(0, max(len(df), 1), CHUNK_ROWS):
+            self.write_chunk(df.iloc[start:start + CHUNK_ROWS])
+
+    def write_records(self, records):
+        """Write an iterable of row dicts, CHUNK_ROWS at a time"""
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) == CHUNK_ROWS:
+                self.write_chunk(pd.DataFrame(chunk))
+                chunk = []
+        if chunk:
+            self.write_chunk(pd.DataFrame(chunk))
+
+    def _close(self):
+        if self.stream is not self.file:
+            self.stream.close()
+        self.file.close()
+
+    def commit(self):
+        self._close()
+        os.replace(self.tmp_path, self.path)
+        return self.path
+
+    def abort(self):
+        self._close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+class NdjsonWriter(ResultWriter):
+    extension = ".ndjson"
+
+    def write_chunk(self, df):
+        self.stream.write(df.to_json(orient="records", lines=True, date_format="iso").encode("utf-8"))
+        self.rows += len(df)
+
+class CsvWriter(ResultWriter):
+    extension = ".csv"
+
+    def write_chunk(self, df):
+        self.stream.write(df.to_csv(index=False, header=self.rows == 0).encode("utf-8"))
+        self.rows += len(df)
+
+class ParquetWriter(ResultWriter):
+    extension = ".parquet"
+    # Parquet compresses its column chunks instead
+    gzip_file = False
+
+    def __init__(self, output_dir, stem, compress=False):
+        super().__init__(output_dir, stem, compress)
+        self.writer = None
+
+    def write_chunk(self, df):
+        if self.writer is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            self.writer = pq.ParquetWriter(self.file, table.schema, compression="gzip" if self.compress else "snappy")
+        else:
+            # Later chunks follow the first chunk's schema, e.g. when a column is all null in them
+            table = pa.Table.from_pandas(df, schema=self.writer.schema, preserve_index=False)
+        self.writer.write_table(table)
+        self.rows += len(df)
+
+    def commit(self):
+        # A Parquet file without a single chunk has no footer; write an empty table so it stays readable
+        if self.writer is None:
+            pq.write_table(pa.table({}), self.file)
+        return super().commit()
+
+    def _close(self):
+        if self.writer is not None:
+            self.writer.close()
+        super()._close()
+
+# Format name -> writer class
+WRITERS = {
+    "parquet": ParquetWriter,
+    "ndjson": NdjsonWriter,
+    "csv": CsvWriter,
+}
+
+def open_writer(output_dir, stem, fmt, compress=None):
+    """Writer for one result file in `fmt`; `compress` defaults to KLAVIYO_OUTPUT_GZIP"""
+    return WRITERS[fmt](output_dir, stem, OUTPUT_GZIP if compress is None else compress)
+
+def new_run_dir(root=OUTPUT_DIR):
+    """Create and return a fresh <root>/<run id> directory
+
+    Dashboards pass it to the analyses as output_dir: run_dir() is shared by every session in the process.
+    """
+    run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
+    path = os.path.join(root, f"{run_id}-{os.getpid()}-{secrets.token_hex(3)}")
+    os.makedirs(path)
+    return path
+
+_run_dir = None
+
+def new_run(root=OUTPUT_DIR):
+    """Start a new run of this process (CLI runs): later results without an output_dir go to a fresh directory"""
+    global _run_dir
+    _run_dir = new_run_dir(root)
+    return _run_dir
+
+def run_dir():
+    """Output directory of the current process run, started on first use"""
+    return _run_dir if _run_dir is not None else new_run()
+
+_manifest_lock = threading.Lock()
+
+def update_manifest(output_dir=None, tables=None, **fields):
+    """Merge fields and table entries into an output directory's manifest, replacing it atomically"""
+    output_dir = output_dir if output_dir is not None else run_dir()
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    with _manifest_lock:
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {"created_at": datetime.utcnow().isoformat() + "Z", "tables": {}}
+        manifest.update(fields)
+        manifest["tables"].update(tables or {})
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, path)
+    return manifest
+
+def write_results(df, stem, output_dir=None, formats=None, compress=None):
+    """Write a result frame in every configured format and list it in the manifest; returns the paths"""
+    output_dir = output_dir if output_dir is not None else run_dir()
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for fmt in formats or OUTPUT_FORMATS:
+        with open_writer(output_dir, stem, fmt, compress) as writer:
+            writer.write_frame(df)
+        paths.append(writer.path)
+    update_manifest(output_dir, tables={stem: {
+        "files": [os.path.basename(path) for path in paths],
+        "rows": len(df),
+        "columns": {column: str(dtype) for column, dtype in df.dtypes.items()},
+    }})
+    return paths
+
+def result_paths(stem, output_dir=None, formats=None, compress=None):
+    """Paths write_results writes (or wrote) for a result"""
+    output_dir = output_dir if output_dir is not None else run_dir()
+    compress = OUTPUT_GZIP if compress is None else compress
+    return [os.path.join(output_dir, WRITERS[fmt].file_name(stem, compress)) for fmt in formats or OUTPUT_FORMATS]